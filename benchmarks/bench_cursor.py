@@ -0,0 +1,71 @@
+"""避難場所全件の読み込みをDictCursorとタプルのcursorで比較する。
+
+一時テーブルに指定した件数の避難場所を作成し、同じセッションの
+evacuation_sitesテーブルとして読み込む。DATABASE_URLの設定が必要。
+
+    python benchmarks/bench_cursor.py [件数]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from hinanbasho.db import DB  # noqa: E402
+from hinanbasho.models import EvacuationSiteFactory  # noqa: E402
+from hinanbasho.services import EvacuationSiteService  # noqa: E402
+
+SELECT_ALL = (
+    "SELECT site_id,site_name,postal_code,address,phone_number,latitude,"
+    + "longitude FROM evacuation_sites ORDER BY site_id;"
+)
+
+
+def create_temporary_sites(service, size):
+    # 一時テーブルは同じ名前の通常のテーブルより優先して参照される。
+    service.execute(
+        "CREATE TEMPORARY TABLE evacuation_sites "
+        + "(LIKE public.evacuation_sites INCLUDING DEFAULTS);"
+    )
+    service.execute(
+        "INSERT INTO evacuation_sites (site_id,site_name,postal_code,address,"
+        + "phone_number,latitude,longitude,updated_at) "
+        + "SELECT i,'避難場所' || i,'070-0044','北海道旭川市常磐公園',"
+        + "'0166-23-8961',43.7 + i * 0.000001,142.3 + i * 0.000001,now() "
+        + "FROM generate_series(1, %s) AS i;",
+        (size,),
+    )
+
+
+def get_all_with_dict_rows(service):
+    """変更前と同じくDictCursorの行をキーワード引数に展開して作成する。"""
+    service.execute(SELECT_ALL)
+    factory = EvacuationSiteFactory()
+    for row in service.fetchall():
+        factory.create(**row)
+    return factory.items
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    db = DB()
+    try:
+        service = EvacuationSiteService(db)
+        create_temporary_sites(service, size)
+        cases = [
+            ("DictCursor + create(**row)", lambda: get_all_with_dict_rows(service)),
+            ("タプル + get_all()", service.get_all),
+            ("タプル + get_site_table()", service.get_site_table),
+        ]
+        print("件数: {:,}".format(size))
+        for name, function in cases:
+            seconds = min(timeit.repeat(function, number=1, repeat=5))
+            print("  {}: {:.3f} 秒".format(name, seconds))
+    finally:
+        db.rollback()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
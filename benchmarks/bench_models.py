@@ -0,0 +1,153 @@
+"""モデルのメモリ使用量と作成時間を__slots__の有無とFactoryの作成方法で比較する。
+
+python benchmarks/bench_models.py [件数]
+"""
+
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from hinanbasho.models import (  # noqa: E402
+    AreaAddress,
+    AreaAddressFactory,
+    EvacuationSite,
+    EvacuationSiteFactory
+)
+
+
+class DictPoint:
+    """__slots__を使わない変更前のPoint"""
+
+    def __init__(self, latitude, longitude):
+        self.__latitude = float(latitude)
+        self.__longitude = float(longitude)
+
+    @property
+    def latitude(self):
+        return self.__latitude
+
+    @property
+    def longitude(self):
+        return self.__longitude
+
+
+class DictEvacuationSite(DictPoint):
+    """__slots__を使わない変更前のEvacuationSite"""
+
+    def __init__(
+        self,
+        site_id,
+        site_name,
+        postal_code,
+        address,
+        phone_number,
+        latitude,
+        longitude,
+    ):
+        self.__site_id = int(site_id)
+        self.__site_name = str(site_name)
+        self.__postal_code = str(postal_code)
+        self.__address = str(address)
+        self.__phone_number = str(phone_number)
+        DictPoint.__init__(self, float(latitude), float(longitude))
+
+
+class DictAreaAddress:
+    """__slots__を使わない変更前のAreaAddress"""
+
+    def __init__(self, postal_code, area_name):
+        postal_code = str(postal_code)
+        postal_code = postal_code[:3] + "-" + postal_code[-4:]
+        self.__postal_code = postal_code
+        self.__area_name = str(area_name)
+
+
+def create_rows(size):
+    site_rows = [
+        {
+            "site_id": i,
+            "site_name": "避難場所" + str(i),
+            "postal_code": "070-0044",
+            "address": "北海道旭川市常磐公園",
+            "phone_number": "0166-23-8961",
+            "latitude": 43.7 + i * 1e-6,
+            "longitude": 142.3 + i * 1e-6,
+        }
+        for i in range(size)
+    ]
+    area_rows = [
+        {"postal_code": str(700000 + i), "area_name": "町域" + str(i)}
+        for i in range(size)
+    ]
+    return site_rows, area_rows
+
+
+def measure_memory(create):
+    tracemalloc.start()
+    items = create()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / len(items)
+
+
+def measure_time(create, number=5):
+    return min(timeit.repeat(create, number=1, repeat=number))
+
+
+def create_with_kwargs(factory_class, rows):
+    factory = factory_class()
+    for row in rows:
+        factory.create(**row)
+    return factory.items
+
+
+def create_with_rows(factory_class, rows):
+    factory = factory_class()
+    factory.create_many(rows)
+    return factory.items
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    site_rows, area_rows = create_rows(size)
+    cases = [
+        (
+            "EvacuationSite",
+            lambda: [DictEvacuationSite(**row) for row in site_rows],
+            lambda: [EvacuationSite(**row) for row in site_rows],
+            lambda: create_with_kwargs(EvacuationSiteFactory, site_rows),
+            lambda: create_with_rows(EvacuationSiteFactory, site_rows),
+        ),
+        (
+            "AreaAddress",
+            lambda: [DictAreaAddress(**row) for row in area_rows],
+            lambda: [AreaAddress(**row) for row in area_rows],
+            lambda: create_with_kwargs(AreaAddressFactory, area_rows),
+            lambda: create_with_rows(AreaAddressFactory, area_rows),
+        ),
+    ]
+    print("件数: {:,}".format(size))
+    for name, dict_create, slots_create, kwargs_create, rows_create in cases:
+        print(name)
+        print(
+            "  メモリ（1件あたり）: __dict__ {:.0f} B / __slots__ {:.0f} B".format(
+                measure_memory(dict_create), measure_memory(slots_create)
+            )
+        )
+        print(
+            "  作成時間: __dict__ {:.3f} 秒 / __slots__ {:.3f} 秒".format(
+                measure_time(dict_create), measure_time(slots_create)
+            )
+        )
+        print(
+            "  Factory: create(**row) {:.3f} 秒 / create_many(rows) {:.3f} 秒".format(
+                measure_time(kwargs_create), measure_time(rows_create)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
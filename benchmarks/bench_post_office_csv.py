@@ -0,0 +1,131 @@
+"""郵便番号CSVの読み込みを行ごとのループと配列の集約で比較する。
+
+北海道のCSVを繰り返して全国版（約12万4千行）と同じ行数のCSVを一時ファイルに
+作成し、読み込みにかかる時間とPythonのメモリ使用量の最大値を測る。
+モデルのオブジェクトの作成まで、全件をまとめて作る場合とチャンクごとに
+作って捨てる場合も比較する。
+
+    python benchmarks/bench_post_office_csv.py [行数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from hinanbasho.config import Config  # noqa: E402
+from hinanbasho.models import AreaAddressFactory  # noqa: E402
+from hinanbasho.pipeline import flatten, iter_models, prefetch  # noqa: E402
+from hinanbasho.scraper import PostOfficeCSV  # noqa: E402
+
+
+def read_with_loop(path):
+    """変更前と同じく全ての列を読み込み、行ごとのループで町域名をつなげる。"""
+    lists = list()
+    df = pd.read_csv(path, encoding="cp932", header=None, dtype=str)
+    df.replace(np.nan, "", inplace=True)
+    i = 0
+    data_length = len(df.values.tolist())
+    tmp = None
+    duplicate_key = ""
+    for row in df.values.tolist():
+        postal_code = row[2]
+        area_name = row[8]
+        if i == 0:
+            tmp = {"postal_code": postal_code, "area_name": area_name}
+            duplicate_key = postal_code
+        elif i < data_length - 1:
+            if postal_code == duplicate_key:
+                tmp["area_name"] = tmp["area_name"] + area_name
+            else:
+                lists.append(tmp)
+                tmp = {"postal_code": postal_code, "area_name": area_name}
+                duplicate_key = postal_code
+        else:
+            lists.append(tmp)
+            lists.append({"postal_code": postal_code, "area_name": area_name})
+        i += 1
+    return lists
+
+
+def create_all_models(path):
+    factory = AreaAddressFactory()
+    factory.create_many(PostOfficeCSV(path, municipality_code="").lists)
+    return len(factory.items)
+
+
+def stream_models(path):
+    chunks = PostOfficeCSV(path, municipality_code="").iter_chunks()
+    count = 0
+    for _ in flatten(prefetch(iter_models(chunks, AreaAddressFactory()))):
+        count += 1
+    return count
+
+
+def create_csv(path, size):
+    with open(Config.POST_OFFICE_CSV_PATH, "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+    with open(path, "wb") as f:
+        for i in range(size):
+            f.write(lines[i % len(lines)])
+
+
+def measure(function):
+    # メモリの追跡は処理を遅くするので、時間とは別に測る。
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        function()
+        return result, seconds, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 124000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "KEN_ALL.CSV")
+        create_csv(path, size)
+        cases = [
+            ("行ごとのループ", lambda: read_with_loop(path)),
+            ("配列の集約", lambda: PostOfficeCSV(path, municipality_code="").lists),
+            (
+                "配列の集約（旭川市のみ）",
+                lambda: PostOfficeCSV(path, municipality_code="01204").lists,
+            ),
+        ]
+        print("行数: {:,}".format(size))
+        results = list()
+        for name, function in cases:
+            lists, seconds, peak = measure(function)
+            results.append(lists)
+            print(
+                "  {}: {:.3f} 秒, {:.1f} MiB, {:,}件".format(
+                    name, seconds, peak / 2**20, len(lists)
+                )
+            )
+        print("  結果が一致: {}".format(results[0] == results[1]))
+
+        print("モデルの作成（チャンク{:,}行）".format(Config.CSV_CHUNK_SIZE))
+        for name, function in [
+            ("全件をまとめて作成", lambda: create_all_models(path)),
+            ("チャンクごとに作成", lambda: stream_models(path)),
+        ]:
+            count, seconds, peak = measure(function)
+            print(
+                "  {}: {:.3f} 秒, {:.1f} MiB, {:,}件".format(
+                    name, seconds, peak / 2**20, count
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""よく使う検索の1回あたりの時間をPREPAREする場合としない場合で比較する。
+
+データベースに取り込んである避難場所と町域のデータを検索する。
+DATABASE_URLの設定が必要。
+
+    python benchmarks/bench_prepared.py [回数]
+"""
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from hinanbasho.config import Config  # noqa: E402
+from hinanbasho.db import DB  # noqa: E402
+from hinanbasho.services import EvacuationSiteService  # noqa: E402
+
+
+def measure(function, number):
+    # 初回はPREPAREを含むので除き、残りの中央値を1回あたりの時間とする。
+    function()
+    times = list()
+    for _ in range(number):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    results = dict()
+    for prepare in (False, True):
+        Config.DB_PREPARE_STATEMENTS = prepare
+        db = DB()
+        try:
+            service = EvacuationSiteService(db)
+            sites = service.get_all()
+            if not sites:
+                sys.exit("避難場所のデータを取り込んでから実行してください。")
+            area_name = next(name for name in service.get_area_names() if name)
+            cases = [
+                ("find_by_site_id", lambda: service.find_by_site_id(sites[0].site_id)),
+                ("find_by_area_name", lambda: service.find_by_area_name(area_name)),
+                ("find_by_site_name", lambda: service.find_by_site_name("公園")),
+                ("get_area_names", service.get_area_names),
+            ]
+            for name, function in cases:
+                results[(name, prepare)] = measure(function, number)
+        finally:
+            db.close()
+
+    print("回数: {:,}（中央値）".format(number))
+    for name, _ in cases:
+        before = results[(name, False)] * 1e6
+        after = results[(name, True)] * 1e6
+        print(
+            "  {}: {:.0f} µs -> {:.0f} µs（{:.2f}倍）".format(
+                name, before, after, before / after
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""避難場所全件の読み込みで使用するメモリをget_allとiter_allで比較する。
+
+bench_cursor.pyと同じく一時テーブルに避難場所を作成し、件数を変えて
+読み込んだ時のPythonのメモリ使用量の最大値を測る。DATABASE_URLの設定が必要。
+
+    python benchmarks/bench_stream.py [件数 ...]
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_cursor import create_temporary_sites  # noqa: E402
+
+from hinanbasho.db import DB  # noqa: E402
+from hinanbasho.services import EvacuationSiteService  # noqa: E402
+
+
+def count_sites(sites):
+    count = 0
+    for _ in sites:
+        count += 1
+    return count
+
+
+def measure_peak(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    for size in sizes:
+        db = DB()
+        try:
+            service = EvacuationSiteService(db)
+            create_temporary_sites(service, size)
+            cases = [
+                ("get_all()", lambda: count_sites(service.get_all())),
+                ("iter_all()", lambda: count_sites(service.iter_all())),
+            ]
+            print("件数: {:,}".format(size))
+            for name, function in cases:
+                peak = measure_peak(function)
+                print("  {}: {:.2f} MiB".format(name, peak / 2**20))
+        finally:
+            db.rollback()
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+from hinanbasho.config import Config
+from hinanbasho.db import DB
+from hinanbasho.errors import DatabaseError, DataError
+from hinanbasho.grid import build_nearest_grid
+from hinanbasho.services import EvacuationSiteService
+
+
+def build():
+    """避難場所ごとの最寄りの候補を格子のセルごとに求めてファイルに書き出す"""
+
+    db = DB()
+    try:
+        service = EvacuationSiteService(db)
+        sites = service.get_all()
+    except (DatabaseError, DataError) as e:
+        print(e.message)
+        return
+    finally:
+        db.close()
+    build_nearest_grid(sites)
+    print(Config.NEAREST_GRID_PATH + "に書き出しました。")
+
+
+if __name__ == "__main__":
+    build()
@@ -8,9 +8,11 @@ CREATE TABLE evacuation_sites(
   phone_number VARCHAR(16),
   latitude decimal NOT NULL,
   longitude decimal NOT NULL,
+  area_name TEXT,
   updated_at TIMESTAMPTZ NOT NULL
 );
 CREATE INDEX ON evacuation_sites (site_id);
+CREATE INDEX ON evacuation_sites (area_name);
 DROP TABLE IF EXISTS area_addresses;
 CREATE TABLE area_addresses(
   id SERIAL NOT NULL,
@@ -19,3 +21,10 @@ CREATE TABLE area_addresses(
   updated_at TIMESTAMPTZ NOT NULL
 );
 CREATE INDEX ON area_addresses (postal_code);
+DROP TABLE IF EXISTS download_states;
+CREATE TABLE download_states(
+  url TEXT NOT NULL PRIMARY KEY,
+  etag TEXT,
+  last_modified TEXT,
+  updated_at TIMESTAMPTZ NOT NULL
+);
@@ -0,0 +1,682 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from hinanbasho.config import Config
+from hinanbasho.errors import LocationError
+from hinanbasho.grid import get_sites_fingerprint
+from hinanbasho.logs import Log
+from hinanbasho.models import CurrentLocation, SiteTable, round_half_up
+from hinanbasho.search import NgramIndex, PrefixIndex
+from hinanbasho.spatial import ClusterIndex, SiteIndex
+
+
+class SingleFlight:
+    """同じキーの処理を同時に実行せず、実行中の処理の結果を共有する
+
+    あるキーの処理の実行中に同じキーで呼び出したスレッドは、処理を実行せずに
+    実行中の処理が終わるのを待って同じ結果（例外の場合は同じ例外）を受け取る。
+
+    Attributes:
+        calls (int): 呼び出された回数
+        executions (int): 実際に処理を実行した回数
+        coalesced (int): 実行中の処理の結果を共有した回数
+
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__in_flight = dict()
+        self.__executions = 0
+        self.__coalesced = 0
+
+    @property
+    def calls(self) -> int:
+        return self.__executions + self.__coalesced
+
+    @property
+    def executions(self) -> int:
+        return self.__executions
+
+    @property
+    def coalesced(self) -> int:
+        return self.__coalesced
+
+    def do(self, key, function):
+        """
+        キーに対応する処理を実行して結果を返す。
+
+        Args:
+            key (hashable): 処理を識別するキー
+            function (callable): 実行する処理
+
+        Returns:
+            result: 処理の結果
+
+        """
+        with self.__lock:
+            call = self.__in_flight.get(key)
+            if call is None:
+                call = {"event": threading.Event(), "result": None, "error": None}
+                self.__in_flight[key] = call
+                self.__executions += 1
+                is_leader = True
+            else:
+                self.__coalesced += 1
+                is_leader = False
+
+        if not is_leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = function()
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__in_flight[key]
+            call["event"].set()
+        return call["result"]
+
+    def get_stats(self) -> dict:
+        """
+        呼び出された回数、実行した回数、結果を共有した回数を返す。
+
+        Returns:
+            stats (dict): 回数の辞書
+
+        """
+        with self.__lock:
+            return {
+                "calls": self.__executions + self.__coalesced,
+                "executions": self.__executions,
+                "coalesced": self.__coalesced,
+            }
+
+
+class LRUCache:
+    """件数に上限のあるLRUキャッシュ
+
+    スレッドセーフで、上限を超えると最も長く使われていない値から破棄する。
+
+    Attributes:
+        maxsize (int): キャッシュする値の数の上限
+        size (int): キャッシュしている値の数
+        hits (int): キャッシュにあった回数
+        misses (int): キャッシュになかった回数
+
+    """
+
+    def __init__(self, maxsize: int):
+        """
+        Args:
+            maxsize (int): キャッシュする値の数の上限
+
+        """
+        self.__maxsize = int(maxsize)
+        self.__values = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def maxsize(self) -> int:
+        return self.__maxsize
+
+    @property
+    def size(self) -> int:
+        return len(self.__values)
+
+    @property
+    def hits(self) -> int:
+        return self.__hits
+
+    @property
+    def misses(self) -> int:
+        return self.__misses
+
+    def get(self, key, create):
+        """
+        キーに対応する値を返す。
+
+        Args:
+            key (hashable): キー
+            create (callable): キャッシュにない場合に値を作成する関数
+
+        Returns:
+            value: キーに対応する値
+
+        """
+        with self.__lock:
+            if key in self.__values:
+                self.__values.move_to_end(key)
+                self.__hits += 1
+                return self.__values[key]
+            self.__misses += 1
+        # 値の作成中は他のスレッドを待たせない。
+        value = create()
+        with self.__lock:
+            self.__values[key] = value
+            self.__values.move_to_end(key)
+            while len(self.__values) > self.__maxsize:
+                self.__values.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        """キャッシュした値と回数を破棄する。"""
+        with self.__lock:
+            self.__values.clear()
+            self.__hits = 0
+            self.__misses = 0
+
+
+class SiteSnapshot:
+    """ある時点の避難場所データ全体をメモリ上に保持する読み取り専用のスナップショット
+
+    避難場所の一覧、町域と避難場所の対応、空間インデックス、避難場所名と住所の
+    n-gramインデックス、避難場所名と町域名の前方一致検索用の配列を保持し、
+    データベースに問い合わせずに避難場所を検索する。
+
+    Attributes:
+        generation (tuple): スナップショットを作成した時のデータの世代
+        sites (:obj:`SiteTable`): 避難場所連番順の避難場所の表
+        area_names (list): 避難場所の住所の町域のリスト
+        site_index (:obj:`SiteIndex`): 避難場所の空間インデックス
+        cluster_index (:obj:`ClusterIndex`): 地図の縮尺ごとに避難場所をまとめた
+            グリッド
+
+    """
+
+    def __init__(
+        self,
+        generation: tuple,
+        sites: list,
+        site_area_names: dict,
+        area_names: list,
+        nearest_grid=None,
+        near_sites_cache_size: int = None,
+        near_sites_cache_precision: float = None,
+    ):
+        """
+        Args:
+            generation (tuple): スナップショットを作成した時のデータの世代
+            sites (list of :obj:`EvacuationSite` or :obj:`SiteTable`): 避難場所
+                連番順の避難場所オブジェクトのリストまたは避難場所の表
+            site_area_names (dict): 避難場所連番をキー、町域名を値とする辞書
+            area_names (list): 避難場所の住所の町域のリスト
+            nearest_grid (:obj:`NearestSiteGrid`): 最寄りの避難場所の候補の格子。
+                避難場所のデータが格子を作成した時と異なる場合は使わない
+            near_sites_cache_size (int): 近い避難場所の候補をキャッシュする
+                セルの数の上限。0ならキャッシュしない
+            near_sites_cache_precision (float): 近い避難場所の候補をキャッシュする
+                セルの緯度経度の幅（度）
+
+        """
+        if near_sites_cache_size is None:
+            near_sites_cache_size = Config.NEAR_SITES_CACHE_SIZE
+        if near_sites_cache_precision is None:
+            near_sites_cache_precision = Config.NEAR_SITES_CACHE_PRECISION
+        self.__generation = generation
+        self.__sites = SiteTable.from_sites(sites)
+        self.__area_names = list(area_names)
+        if (
+            nearest_grid is not None
+            and nearest_grid.fingerprint != get_sites_fingerprint(self.__sites)
+        ):
+            Log().warning(
+                "最寄りの避難場所の候補が避難場所のデータと異なるため使いません。"
+                + "build_nearest_grid.pyで作り直してください。"
+            )
+            nearest_grid = None
+        self.__site_index = SiteIndex(self.__sites, nearest_grid)
+        self.__cluster_index = ClusterIndex(self.__sites)
+        self.__near_sites_cache = LRUCache(near_sites_cache_size)
+        self.__near_sites_cache_precision = float(near_sites_cache_precision)
+        self.__site_name_index = NgramIndex(self.__sites.site_names)
+        self.__address_index = NgramIndex(self.__sites.addresses)
+        # 行番号だけを保持し、検索結果を返す時に行のビューを作る。
+        self.__indices_by_id = dict()
+        self.__indices_by_area_name = dict()
+        site_ids = self.__sites.site_ids.tolist()
+        for i, site_id in enumerate(site_ids):
+            self.__indices_by_id[site_id] = i
+            area_name = site_area_names.get(site_id)
+            if area_name is not None:
+                self.__indices_by_area_name.setdefault(area_name, list()).append(i)
+        completions = [
+            (site_name, {"type": "site", "name": site_name, "site_id": site_id})
+            for site_name, site_id in zip(self.__sites.site_names, site_ids)
+        ]
+        completions += [
+            (area_name, {"type": "area", "name": area_name})
+            for area_name in self.__area_names
+            if area_name is not None
+        ]
+        self.__prefix_index = PrefixIndex(completions)
+
+    @property
+    def generation(self) -> tuple:
+        return self.__generation
+
+    @property
+    def sites(self) -> SiteTable:
+        return self.__sites
+
+    @property
+    def area_names(self) -> list:
+        return self.__area_names
+
+    @property
+    def site_index(self) -> SiteIndex:
+        return self.__site_index
+
+    @property
+    def cluster_index(self) -> ClusterIndex:
+        return self.__cluster_index
+
+    @property
+    def near_sites_cache(self) -> LRUCache:
+        return self.__near_sites_cache
+
+    def get_near_sites(self, current_location: CurrentLocation) -> list:
+        """
+        現在地から直線距離で最も近い避難場所上位5件の避難場所データのリストを返す。
+
+        Args:
+            current_location (obj:`CurrentLocation`): 現在地の緯度経度情報を持つ
+                オブジェクト
+
+        Returns:
+            near_sites (list of dicts): 現在地から最も近い避難場所上位5件の
+                避難場所オブジェクトと現在地までの距離のリストを要素に持つ辞書のリスト
+
+        Raises:
+            LocationError: 緯度経度が有限の数でない場合
+
+        """
+        if not np.isfinite(
+            [current_location.latitude, current_location.longitude]
+        ).all():
+            raise LocationError("緯度経度の値が正しくありません。")
+        return self.__get_near_sites(self.__get_nearest(current_location, 5))
+
+    def __get_nearest(self, current_location: CurrentLocation, k: int) -> list:
+        nearest_grid = self.__site_index.nearest_grid
+        if self.__near_sites_cache.maxsize <= 0 or (
+            nearest_grid is not None and k <= nearest_grid.k
+        ):
+            # 格子があればセルの候補はファイルから読めるので、キャッシュを通さない。
+            return self.__site_index.get_nearest(current_location, k)
+        # 近い場所からの検索は同じセルに入るので、セル内のどの地点でも上位k件を
+        # 含む候補をキャッシュし、候補だけ正確な距離を計算して並べ替える。
+        precision = self.__near_sites_cache_precision
+        row = int(np.floor(current_location.latitude / precision))
+        column = int(np.floor(current_location.longitude / precision))
+        candidates = self.__near_sites_cache.get(
+            (row, column, k),
+            lambda: self.__site_index.get_cell_candidates(
+                row * precision,
+                column * precision,
+                (row + 1) * precision,
+                (column + 1) * precision,
+                k,
+            ),
+        )
+        return self.__site_index.get_nearest_from(current_location, candidates, k)
+
+    def get_near_sites_many(self, locations, k: int = 5):
+        """
+        複数の地点について、それぞれ直線距離で最も近い避難場所上位k件の
+        避難場所データのリストを返す。
+
+        Args:
+            locations (array_like): 緯度と経度の組の配列
+            k (int): 地点ごとに返す避難場所の件数
+
+        Returns:
+            near_sites_many (generator): 地点ごとに、get_near_sitesと同じ形式の
+                避難場所データのリストを順に返すジェネレータ
+
+        """
+        try:
+            locations = np.asarray(locations, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise LocationError("緯度経度の値が正しくありません。")
+        if locations.size == 0:
+            locations = locations.reshape(0, 2)
+        if locations.ndim != 2 or locations.shape[1] != 2:
+            raise LocationError("緯度経度の組の配列を指定してください。")
+        if not np.isfinite(locations).all():
+            raise LocationError("緯度経度の値が正しくありません。")
+
+        def generate():
+            for nearest in self.__site_index.get_nearest_many(
+                locations[:, 0], locations[:, 1], k
+            ):
+                yield self.__get_near_sites(nearest)
+
+        return generate()
+
+    def find_within_radius(self, current_location: CurrentLocation, radius) -> list:
+        """
+        現在地から指定した距離以内にある避難場所データのリストを近い順に返す。
+
+        Args:
+            current_location (obj:`CurrentLocation`): 現在地の緯度経度情報を持つ
+                オブジェクト
+            radius (float): 探索する距離（キロメートル）
+
+        Returns:
+            near_sites (list of dicts): get_near_sitesと同じ形式の避難場所データの
+                リスト
+
+        """
+        try:
+            radius = float(radius)
+        except (TypeError, ValueError):
+            raise LocationError("距離の値が正しくありません。")
+        if not np.isfinite(radius) or radius < 0:
+            raise LocationError("距離の値が正しくありません。")
+        return self.__get_near_sites(
+            self.__site_index.get_within_radius(current_location, radius * 1000)
+        )
+
+    def find_in_bbox(self, south, west, north, east) -> list:
+        """
+        緯度経度の矩形の範囲内にある避難場所を返す。
+
+        Args:
+            south (float): 南端の緯度
+            west (float): 西端の経度
+            north (float): 北端の緯度
+            east (float): 東端の経度
+
+        Returns:
+            evacuation_site (list of obj:`EvacuationSite`): 範囲内にある避難場所の
+                避難場所連番順のリスト
+
+        """
+        try:
+            bounds = np.array([south, west, north, east], dtype=np.float64)
+        except (TypeError, ValueError):
+            raise LocationError("緯度経度の値が正しくありません。")
+        if not np.isfinite(bounds).all():
+            raise LocationError("緯度経度の値が正しくありません。")
+        return self.__site_index.get_in_bbox(*bounds.tolist())
+
+    def get_clusters(self, south, west, north, east, zoom, max_cells=None) -> tuple:
+        """
+        表示範囲内の避難場所を地図のズームレベルに応じてまとめて返す。
+
+        Args:
+            south (float): 南端の緯度
+            west (float): 西端の経度
+            north (float): 北端の緯度
+            east (float): 東端の経度
+            zoom (int): 地図のズームレベル
+            max_cells (int): まとまりを作るセルの数の上限
+
+        Returns:
+            zoom, clusters (tuple): まとめたズームレベルと、まとまりごとの件数、
+                重心の緯度経度、件数が1件の場合はその避難場所オブジェクトを持つ
+                辞書のリスト
+
+        """
+        try:
+            bounds = np.array([south, west, north, east], dtype=np.float64)
+            zoom = int(zoom)
+        except (TypeError, ValueError):
+            raise LocationError("緯度経度またはズームレベルの値が正しくありません。")
+        if not np.isfinite(bounds).all():
+            raise LocationError("緯度経度の値が正しくありません。")
+        return self.__cluster_index.get_clusters(*bounds.tolist(), zoom, max_cells)
+
+    def __get_near_sites(self, nearest: list) -> list:
+        near_sites = list()
+        for site, distance in nearest:
+            near_sites.append(
+                {
+                    "order": None,
+                    "site": site,
+                    "distance": distance,
+                }
+            )
+        # 距離を分かりやすくするためキロメートルに変換する。
+        distances = round_half_up(
+            np.array([near_site["distance"] for near_site in near_sites]) / 1000, 1
+        )
+        for i in range(len(near_sites)):
+            # 現在地から近い順で連番を付与する。
+            near_sites[i]["order"] = i + 1
+            near_sites[i]["distance"] = float(distances[i])
+        return near_sites
+
+    def find_by_site_id(self, site_id) -> list:
+        """
+        避難場所連番から該当する避難場所データを返す。
+
+        Args:
+            site_id (int): 避難場所連番
+
+        Returns
+            evacuation_site (list of obj:`EvacuationSite`): 避難場所データ
+
+        """
+        try:
+            index = self.__indices_by_id.get(int(site_id))
+        except (TypeError, ValueError):
+            return list()
+        return [self.__sites[index]] if index is not None else list()
+
+    def find_by_area_name(self, area_name) -> list:
+        """
+        町域名から避難場所を検索する。
+
+        Args:
+            area_name (str): 町域名
+
+        Returns:
+            area_sites (list of obj:`EvacuationSite`): 指定した町域名の避難場所の
+                避難場所オブジェクトのリスト
+
+        """
+        return self.__sites.take(
+            self.__indices_by_area_name.get(str(area_name), list())
+        )
+
+    def find_by_site_name(self, site_name) -> list:
+        """
+        指定した避難場所名を含む避難場所を検索する。
+
+        SQLのLIKE演算子と同じく、キーワード中の%と_はワイルドカードとして扱う。
+
+        Args:
+            site_name (str): 避難場所名（キーワード）
+
+        Returns
+            evacuation_site (list of obj:`EvacuationSite`): 避難場所データ
+
+        """
+        pattern = "%" + str(site_name) + "%"
+        return self.__sites.take(self.__site_name_index.find_like(pattern))
+
+    def complete(self, keyword, limit: int = 10) -> list:
+        """
+        避難場所名と町域名からキーワードで始まるものを返す。
+
+        ひらがなとカタカナ、全角と半角の違いは区別しない。
+
+        Args:
+            keyword (str): 入力途中のキーワード
+            limit (int): 返す候補の最大数
+
+        Returns:
+            completions (list of dicts): 候補の種類（siteまたはarea）と名称、
+                避難場所の場合は避難場所連番を持つ辞書のリスト
+
+        """
+        return [dict(value) for value in self.__prefix_index.complete(keyword, limit)]
+
+    def find_by_address(self, address) -> list:
+        """
+        指定した住所を含む避難場所を検索する。
+
+        SQLのLIKE演算子と同じく、キーワード中の%と_はワイルドカードとして扱う。
+
+        Args:
+            address (str): 住所（キーワード）
+
+        Returns
+            evacuation_site (list of obj:`EvacuationSite`): 避難場所データ
+
+        """
+        pattern = "%" + str(address) + "%"
+        return self.__sites.take(self.__address_index.find_like(pattern))
+
+
+class SiteSnapshotCache:
+    """プロセス内で共有する避難場所スナップショットのキャッシュ
+
+    データの世代を一定間隔でデータベースに問い合わせ、世代が変わっていれば
+    スナップショットを作り直す。問い合わせの間隔内はデータベースに接続せずに
+    キャッシュしたスナップショットを返す。
+
+    データを取り込むのはワーカーとは別のプロセスなので、取り込んだデータは
+    各ワーカーが次に世代を確認した時（コミットから最大でcheck_interval秒後）に
+    反映される。
+
+    Attributes:
+        check_interval (float): データの世代を確認する間隔（秒）
+        single_flight (:obj:`SingleFlight`): 同時に必要になった世代の確認と
+            スナップショットの作成をまとめる
+
+    """
+
+    def __init__(self, check_interval: float = None):
+        """
+        Args:
+            check_interval (float): データの世代を確認する間隔（秒）
+
+        """
+        if check_interval is None:
+            check_interval = Config.SNAPSHOT_CHECK_INTERVAL
+        self.__check_interval = float(check_interval)
+        self.__state = (None, None)
+        self.__lock = threading.Lock()
+        self.__single_flight = SingleFlight()
+
+    @property
+    def check_interval(self) -> float:
+        return self.__check_interval
+
+    @property
+    def single_flight(self) -> SingleFlight:
+        return self.__single_flight
+
+    def __get_fresh_snapshot(self, check_interval: float):
+        # 他のスレッドが更新中でも一貫した組み合わせを読めるようタプルで保持する。
+        snapshot, checked_at = self.__state
+        if snapshot is None or time.monotonic() - checked_at >= check_interval:
+            return None
+        return snapshot
+
+    def get(self, create_service, check_interval: float = None) -> SiteSnapshot:
+        """
+        避難場所スナップショットを返す。
+
+        Args:
+            create_service (callable): データの世代の確認やスナップショットの
+                作成が必要な時だけ呼び出す、EvacuationSiteServiceオブジェクトを
+                返す関数
+            check_interval (float): データの世代を確認する間隔（秒）。省略した
+                場合はコンストラクタで指定した間隔
+
+        Returns:
+            snapshot (obj:`SiteSnapshot`): 避難場所スナップショット
+
+        """
+        if check_interval is None:
+            check_interval = self.__check_interval
+
+        snapshot = self.__get_fresh_snapshot(check_interval)
+        if snapshot is not None:
+            return snapshot
+        # 同時に確認が必要になったスレッドは、1つのスレッドの確認の結果を共有する。
+        return self.__single_flight.do(
+            ("refresh", check_interval),
+            lambda: self.__refresh(create_service, check_interval),
+        )
+
+    def __refresh(self, create_service, check_interval: float) -> SiteSnapshot:
+        with self.__lock:
+            # 他のスレッドが確認を済ませた直後であればそれを使う。
+            snapshot = self.__get_fresh_snapshot(check_interval)
+            if snapshot is not None:
+                return snapshot
+            snapshot = self.__state[0]
+            service = create_service()
+            generation = service.get_generation()
+            if snapshot is None or snapshot.generation != generation:
+                snapshot = service.load_snapshot(generation)
+            self.__state = (snapshot, time.monotonic())
+            return snapshot
+
+    def invalidate(self) -> None:
+        """
+        キャッシュしたスナップショットを破棄する。
+
+        破棄するのはこのプロセスのキャッシュだけで、他のプロセスには影響しない。
+
+        """
+        with self.__lock:
+            self.__state = (None, None)
+
+
+class GenerationCache:
+    """避難場所スナップショットの世代ごとに値をキャッシュする
+
+    スナップショットから作る値（描画済みのHTMLなど）を、スナップショットの世代が
+    変わるまで使い回す。
+
+    """
+
+    def __init__(self):
+        self.__state = (None, None)
+        self.__lock = threading.Lock()
+
+    def get(self, snapshot: SiteSnapshot, create):
+        """
+        スナップショットの世代に対応する値を返す。
+
+        Args:
+            snapshot (obj:`SiteSnapshot`): 避難場所スナップショット
+            create (callable): キャッシュがない場合にスナップショットを受け取って
+                値を作成する関数
+
+        Returns:
+            value: スナップショットの世代に対応する値
+
+        """
+        generation, value = self.__state
+        if generation is not None and generation == snapshot.generation:
+            return value
+        with self.__lock:
+            generation, value = self.__state
+            if generation is None or generation != snapshot.generation:
+                value = create(snapshot)
+                self.__state = (snapshot.generation, value)
+            return value
+
+    def invalidate(self) -> None:
+        """キャッシュした値を破棄する。"""
+        with self.__lock:
+            self.__state = (None, None)
+
+
+site_snapshot_cache = SiteSnapshotCache()
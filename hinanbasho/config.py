@@ -3,8 +3,59 @@ import os
 
 class Config:
     DATABASE_URL = os.environ.get("DATABASE_URL")
+    # Webアプリケーションのワーカープロセスごとにプールする接続数の上限
+    # （0ならプールせずにリクエストごとに接続する）
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 4))
+    # プールの接続が全て使用中の場合に返却を待つ時間（秒）
+    DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+    # 使われていなかった時間がこれを超えた接続は貸し出す前に確認する（秒）
+    DB_POOL_PING_INTERVAL = float(os.environ.get("DB_POOL_PING_INTERVAL", 30))
+    # よく使う検索を接続ごとにPREPAREしておき、EXECUTEで実行するか
+    DB_PREPARE_STATEMENTS = os.environ.get("DB_PREPARE_STATEMENTS", "true") == "true"
     OPENDATA_URL = (
         "https://www.city.asahikawa.hokkaido.jp/kurashi/320/321/d053843_d/fil/"
         + "012041_hinanbasho_list.csv"
     )
     POST_OFFICE_CSV_PATH = "hinanbasho/data/01HOKKAI.CSV"
+    # 郵便番号データから取り出す市区町村の全国地方公共団体コード（空なら全て）
+    POST_OFFICE_MUNICIPALITY_CODE = os.environ.get("POST_OFFICE_MUNICIPALITY_CODE", "")
+    # データを取り込む時にCSVを一度に読み込む行数
+    CSV_CHUNK_SIZE = int(os.environ.get("CSV_CHUNK_SIZE", 10000))
+    # 保存と並行して先に読み込んでおくチャンクの数
+    PREFETCH_BUFFER_SIZE = int(os.environ.get("PREFETCH_BUFFER_SIZE", 2))
+    # データを取り込む時に1回のINSERT文で保存する件数
+    BULK_INSERT_CHUNK_SIZE = int(os.environ.get("BULK_INSERT_CHUNK_SIZE", 1000))
+    # サーバー側のcursorで結果を順に読み込む時に1回に取り寄せる行数
+    STREAM_ITERSIZE = int(os.environ.get("STREAM_ITERSIZE", 2000))
+    # テーブルを差し替える時にロックの取得を待つ時間と再試行する回数
+    SWAP_LOCK_TIMEOUT = os.environ.get("SWAP_LOCK_TIMEOUT", "2s")
+    SWAP_RETRIES = int(os.environ.get("SWAP_RETRIES", 5))
+    # 入力補完で返す候補の既定の件数と上限
+    AUTOCOMPLETE_LIMIT = int(os.environ.get("AUTOCOMPLETE_LIMIT", 10))
+    AUTOCOMPLETE_MAX_LIMIT = int(os.environ.get("AUTOCOMPLETE_MAX_LIMIT", 50))
+    # 複数地点の近い避難場所検索で受け付ける地点数と地点ごとの件数の上限
+    BATCH_MAX_LOCATIONS = int(os.environ.get("BATCH_MAX_LOCATIONS", 100000))
+    BATCH_MAX_SITES = int(os.environ.get("BATCH_MAX_SITES", 20))
+    # 指定した距離以内の避難場所検索で受け付ける距離の上限（キロメートル）
+    RADIUS_SEARCH_MAX_KM = float(os.environ.get("RADIUS_SEARCH_MAX_KM", 50))
+    # 地図の表示範囲で避難場所をまとめるセルの数の上限
+    CLUSTER_MAX_CELLS = int(os.environ.get("CLUSTER_MAX_CELLS", 2048))
+    # 最寄りの避難場所の候補を格子のセルごとに書き出すファイルと、セルの一辺の
+    # 長さ（メートル）、候補を求める件数、避難場所の範囲の外側に広げる距離
+    NEAREST_GRID_PATH = os.environ.get(
+        "NEAREST_GRID_PATH", "hinanbasho/data/nearest_grid.bin"
+    )
+    NEAREST_GRID_CELL_METERS = float(os.environ.get("NEAREST_GRID_CELL_METERS", 200))
+    NEAREST_GRID_K = int(os.environ.get("NEAREST_GRID_K", 5))
+    NEAREST_GRID_PADDING_METERS = float(
+        os.environ.get("NEAREST_GRID_PADDING_METERS", 3000)
+    )
+    # 現在地から近い避難場所の候補をキャッシュするセルの数の上限（0なら
+    # キャッシュしない）と、セルの緯度経度の幅（度）。最寄りの避難場所の候補の
+    # 格子を使える場合はキャッシュしない
+    NEAR_SITES_CACHE_SIZE = int(os.environ.get("NEAR_SITES_CACHE_SIZE", 10000))
+    NEAR_SITES_CACHE_PRECISION = float(
+        os.environ.get("NEAR_SITES_CACHE_PRECISION", 0.001)
+    )
+    # 避難場所データが更新されたかデータベースに確認する間隔（秒）
+    SNAPSHOT_CHECK_INTERVAL = float(os.environ.get("SNAPSHOT_CHECK_INTERVAL", 10))
@@ -1,23 +1,220 @@
+import os
+import threading
+import time
+
 import psycopg2
+from psycopg2.extensions import (
+    TRANSACTION_STATUS_IDLE,
+    TRANSACTION_STATUS_UNKNOWN
+)
 from psycopg2.extras import DictCursor
 
 from hinanbasho.config import Config
 from hinanbasho.errors import DatabaseError
 
 
+class Connection(psycopg2.extensions.connection):
+    """準備した文の名前を覚えておくPostgreSQL接続クラス
+
+    PREPAREした文はトランザクションをロールバックしても接続を閉じるまで残るので、
+    プールに返却された後も同じ接続で使い回せる。
+
+    Attributes:
+        prepared_statements (set of str): この接続でPREPAREした文の名前の集合
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+def connect():
+    """PostgreSQLデータベースに接続する。
+
+    Returns:
+        conn (:obj:`psycopg2.connection`): PostgreSQL接続クラス。
+
+    """
+    try:
+        return psycopg2.connect(Config.DATABASE_URL, connection_factory=Connection)
+    except (psycopg2.DatabaseError, psycopg2.OperationalError) as e:
+        raise DatabaseError(e.args[0])
+
+
+class ConnectionPool:
+    """ワーカープロセスごとに共有するPostgreSQLデータベースへの接続のプール
+
+    スレッドセーフで、接続数が上限に達している場合は接続が返却されるまで待つ。
+    貸し出す前に接続が切れていないか確認し、しばらく使われていなかった接続は
+    クエリを発行して確認する。gunicornの--preloadのようにプロセスがforkされた
+    場合は、親プロセスの接続を使わずに新しくプールを作る。
+
+    Attributes:
+        max_size (int): プールする接続数の上限
+        timeout (float): 接続が返却されるのを待つ時間（秒）
+        ping_interval (float): 使われていなかった時間がこれを超えた接続は
+            貸し出す前にクエリを発行して確認する（秒）
+
+    """
+
+    def __init__(
+        self,
+        max_size: int = None,
+        timeout: float = None,
+        ping_interval: float = None,
+    ):
+        """
+        Args:
+            max_size (int): プールする接続数の上限
+            timeout (float): 接続が返却されるのを待つ時間（秒）
+            ping_interval (float): 使われていなかった時間がこれを超えた接続は
+                貸し出す前にクエリを発行して確認する（秒）
+
+        """
+        if max_size is None:
+            max_size = Config.DB_POOL_SIZE
+        if timeout is None:
+            timeout = Config.DB_POOL_TIMEOUT
+        if ping_interval is None:
+            ping_interval = Config.DB_POOL_PING_INTERVAL
+        self.__max_size = max(int(max_size), 1)
+        self.__timeout = float(timeout)
+        self.__ping_interval = float(ping_interval)
+        self.__lock = threading.Lock()
+        self.__reset()
+
+    @property
+    def max_size(self) -> int:
+        return self.__max_size
+
+    @property
+    def timeout(self) -> float:
+        return self.__timeout
+
+    @property
+    def ping_interval(self) -> float:
+        return self.__ping_interval
+
+    def __reset(self) -> None:
+        self.__pid = os.getpid()
+        self.__idle = list()
+        self.__semaphore = threading.BoundedSemaphore(self.__max_size)
+
+    def __get_semaphore(self) -> threading.BoundedSemaphore:
+        with self.__lock:
+            if self.__pid != os.getpid():
+                # 親プロセスの接続は親プロセスが使うので、閉じずに手放す。
+                self.__reset()
+            return self.__semaphore
+
+    def __is_healthy(self, conn, returned_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.__ping_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def __discard(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """プールから接続を借りる。
+
+        Returns:
+            conn (:obj:`psycopg2.connection`): PostgreSQL接続クラス。
+
+        """
+        semaphore = self.__get_semaphore()
+        if not semaphore.acquire(timeout=self.__timeout):
+            raise DatabaseError("データベースへの接続数が上限に達しています。")
+        try:
+            while True:
+                with self.__lock:
+                    item = self.__idle.pop() if self.__idle else None
+                if item is None:
+                    return connect()
+                conn, returned_at = item
+                if self.__is_healthy(conn, returned_at):
+                    return conn
+                self.__discard(conn)
+        except BaseException:
+            semaphore.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        """借りた接続をプールに返却する。
+
+        実行中のトランザクションはロールバックする。
+
+        Args:
+            conn (:obj:`psycopg2.connection`): PostgreSQL接続クラス。
+
+        """
+        semaphore = self.__get_semaphore()
+        try:
+            if conn.closed:
+                return
+            status = conn.get_transaction_status()
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                self.__discard(conn)
+                return
+            if status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with self.__lock:
+                self.__idle.append((conn, time.monotonic()))
+        except psycopg2.Error:
+            self.__discard(conn)
+        finally:
+            try:
+                semaphore.release()
+            except ValueError:
+                # fork前に借りた接続の返却なので、新しいプールの数には含めない。
+                pass
+
+    def closeall(self) -> None:
+        """プールしている接続を全て閉じる。"""
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = list()
+        for conn, _ in idle:
+            self.__discard(conn)
+
+
 class DB:
     """PostgreSQLデータベースへの接続をラップしたクラス。
 
     Attributes:
         conn (:obj:`psycopg2.connection`): PostgreSQL接続クラス。
+        prepared_statements (set of str): 接続でPREPAREした文の名前の集合
 
     """
 
-    def __init__(self):
-        try:
-            self.__conn = psycopg2.connect(Config.DATABASE_URL)
-        except (psycopg2.DatabaseError, psycopg2.OperationalError) as e:
-            raise DatabaseError(e.args[0])
+    def __init__(self, pool: ConnectionPool = None):
+        """
+        Args:
+            pool (:obj:`ConnectionPool`): 接続を借りるプール。省略した場合は
+                新しく接続する
+
+        """
+        self.__pool = pool
+        if pool is None:
+            self.__conn = connect()
+        else:
+            self.__conn = pool.getconn()
+
+    @property
+    def prepared_statements(self) -> set:
+        return self.__conn.prepared_statements
 
     def cursor(self) -> DictCursor:
         """
@@ -29,6 +226,39 @@ class DB:
         """
         return self.__conn.cursor(cursor_factory=DictCursor)
 
+    def tuple_cursor(self):
+        """
+        行をタプルで返すcursorオブジェクトを返す。
+
+        列名で値を引けない代わりに、行ごとの辞書を作らないので大量の行を
+        読み込む時に速い。
+
+        Returns:
+            cursor (:obj:`psycopg2.extensions.cursor`): cursorオブジェクト
+
+        """
+        return self.__conn.cursor()
+
+    def named_cursor(self, name: str, itersize: int):
+        """
+        サーバー側で結果を保持する名前付きのcursorオブジェクトを返す。
+
+        行を反復するとitersize件ずつサーバーから取り寄せるので、結果の件数に
+        かかわらず使用するメモリは一定になる。トランザクションの中でだけ使える。
+
+        Args:
+            name (str): cursorの名前
+            itersize (int): 1回に取り寄せる行数
+
+        Returns:
+            cursor (:obj:`psycopg2.extensions.cursor`): 行をタプルで返す
+                cursorオブジェクト
+
+        """
+        cursor = self.__conn.cursor(name=name)
+        cursor.itersize = max(int(itersize), 1)
+        return cursor
+
     def commit(self) -> None:
         """PostgreSQLデータベースにクエリをコミット"""
         self.__conn.commit()
@@ -38,5 +268,12 @@ class DB:
         self.__conn.rollback()
 
     def close(self) -> None:
-        """PostgreSQLデータベースへの接続を閉じる"""
-        self.__conn.close()
+        """PostgreSQLデータベースへの接続を閉じる
+
+        プールから借りた接続はプールに返却する。
+
+        """
+        if self.__pool is None:
+            self.__conn.close()
+        else:
+            self.__pool.putconn(self.__conn)
@@ -2,11 +2,49 @@ from abc import ABCMeta, abstractmethod
 
 
 class Factory(metaclass=ABCMeta):
-    def create(self, **row):
-        item = self._create_item(**row)
+    # create_many_from_tuplesに渡すタプルの列の並び
+    COLUMNS = ()
+
+    def create(self, row: dict = None, /, **kwargs):
+        # 辞書を1つだけ渡した場合はキーワード引数に展開せずに作成する。
+        if row is None:
+            item = self._create_item(**kwargs)
+        else:
+            item = self._create_item_from_row(row)
         self._register_item(item)
         return item
 
+    def create_many(self, rows) -> None:
+        create_item = self._create_item_from_row
+        register_item = self._register_item
+        for row in rows:
+            register_item(create_item(row))
+
+    def create_many_from_tuples(self, rows) -> None:
+        # 列がCOLUMNSの順に並んだタプルから、辞書を作らずに作成する。
+        create_item = self._create_item_from_tuple
+        register_item = self._register_item
+        for values in rows:
+            register_item(create_item(values))
+
+    def iter_from_rows(self, rows):
+        # 作成したものを登録せずに順に返すので、件数が多くても溜め込まない。
+        create_item = self._create_item_from_row
+        for row in rows:
+            yield create_item(row)
+
+    def iter_from_tuples(self, rows):
+        # iter_from_rowsと同じく登録せずに、列がCOLUMNSの順に並んだタプルから作成する。
+        create_item = self._create_item_from_tuple
+        for values in rows:
+            yield create_item(values)
+
+    def _create_item_from_row(self, row: dict):
+        return self._create_item(**row)
+
+    def _create_item_from_tuple(self, values: tuple):
+        return self._create_item_from_row(dict(zip(self.COLUMNS, values)))
+
     @abstractmethod
     def _create_item(self, **row):
         pass
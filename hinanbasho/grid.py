@@ -0,0 +1,278 @@
+import hashlib
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from hinanbasho.config import Config
+from hinanbasho.logs import Log
+from hinanbasho.models import SiteTable, get_distances
+from hinanbasho.spatial import EARTH_RADIUS
+
+# ファイルの先頭に置くヘッダー。識別子、避難場所の指紋、南端の緯度、西端の経度、
+# セルの緯度と経度の幅、行数、列数、候補を求めた件数、予備の順に並べる。
+_HEADER = struct.Struct("<8s16sddddIIII")
+_MAGIC = b"HNBGRID1"
+
+
+def get_sites_fingerprint(sites: list) -> bytes:
+    """避難場所の連番と緯度経度から、データが同じか判定するための指紋を作る。
+
+    Args:
+        sites (list of :obj:`EvacuationSite` or :obj:`SiteTable`): 避難場所
+            オブジェクトのリストまたは避難場所の表
+
+    Returns:
+        fingerprint (bytes): 16バイトの指紋
+
+    """
+    table = SiteTable.from_sites(sites)
+    digest = hashlib.sha256()
+    digest.update(table.site_ids.astype("<i8").tobytes())
+    digest.update(table.latitudes.astype("<f8").tobytes())
+    digest.update(table.longitudes.astype("<f8").tobytes())
+    return digest.digest()[:16]
+
+
+def build_nearest_grid(
+    sites: list,
+    path: str = None,
+    cell_meters: float = None,
+    k: int = None,
+    padding_meters: float = None,
+) -> None:
+    """避難場所の範囲を格子に区切り、セルごとの最寄りの避難場所の候補をファイルに書き出す。
+
+    セルの中心から近い順にk番目の避難場所までの距離に、セルの中心から角までの
+    距離の2倍と余裕を足した距離以内の避難場所を候補とする。セル内のどの地点に
+    ついても、近い順にk件の避難場所はこの候補に必ず含まれる。候補が多すぎる
+    セルは候補を書き出さず、検索時に空間インデックスで探索させる。
+
+    Args:
+        sites (list of :obj:`EvacuationSite` or :obj:`SiteTable`): 避難場所
+            オブジェクトのリストまたは避難場所の表
+        path (str): 書き出すファイルのパス
+        cell_meters (float): セルの一辺の長さ（メートル）
+        k (int): 候補を求める避難場所の件数
+        padding_meters (float): 避難場所の範囲の外側に広げる距離（メートル）
+
+    """
+    if path is None:
+        path = Config.NEAREST_GRID_PATH
+    if cell_meters is None:
+        cell_meters = Config.NEAREST_GRID_CELL_METERS
+    if k is None:
+        k = Config.NEAREST_GRID_K
+    if padding_meters is None:
+        padding_meters = Config.NEAREST_GRID_PADDING_METERS
+    sites = SiteTable.from_sites(sites)
+    site_ids = sites.site_ids.astype(np.int32)
+    latitudes = sites.latitudes
+    longitudes = sites.longitudes
+    k = min(max(int(k), 1), len(sites))
+
+    # 緯度1度あたりの距離から、セルの一辺が指定した長さになる緯度経度の幅を求める。
+    meters_per_degree = EARTH_RADIUS * np.pi / 180
+    latitude_step = float(cell_meters) / meters_per_degree
+    padding = float(padding_meters) / meters_per_degree
+    south = float(latitudes.min()) - padding if len(sites) else 0.0
+    north = float(latitudes.max()) + padding if len(sites) else 0.0
+    longitude_step = latitude_step / np.cos(np.radians((south + north) / 2))
+    longitude_padding = padding / np.cos(np.radians((south + north) / 2))
+    west = float(longitudes.min()) - longitude_padding if len(sites) else 0.0
+    east = float(longitudes.max()) + longitude_padding if len(sites) else 0.0
+    rows = int(np.ceil((north - south) / latitude_step)) if len(sites) else 0
+    columns = int(np.ceil((east - west) / longitude_step)) if len(sites) else 0
+
+    offsets = np.zeros(rows * columns + 1, dtype="<u4")
+    candidates = list()
+    count = 0
+    if rows > 0 and columns > 0:
+        row_latitudes = south + (np.arange(rows) + 0.5) * latitude_step
+        column_longitudes = west + (np.arange(columns) + 0.5) * longitude_step
+        # 行ごとにセルの中心から北と南の角までの距離の大きい方を求める。
+        half_diagonals = np.maximum(
+            get_distances(
+                row_latitudes,
+                0.0,
+                row_latitudes + latitude_step / 2,
+                longitude_step / 2,
+            ),
+            get_distances(
+                row_latitudes,
+                0.0,
+                row_latitudes - latitude_step / 2,
+                longitude_step / 2,
+            ),
+        )
+        margin = NearestSiteGrid.MARGIN_METERS
+        chunk_rows = max(NearestSiteGrid.BUILD_MATRIX_SIZE // (columns * len(sites)), 1)
+        for start in range(0, rows, chunk_rows):
+            end = min(start + chunk_rows, rows)
+            center_latitudes = np.repeat(row_latitudes[start:end], columns)
+            center_longitudes = np.tile(column_longitudes, end - start)
+            distances = get_distances(
+                center_latitudes[:, np.newaxis],
+                center_longitudes[:, np.newaxis],
+                latitudes[np.newaxis, :],
+                longitudes[np.newaxis, :],
+            )
+            kth_distances = np.partition(distances, k - 1, axis=1)[:, k - 1]
+            thresholds = (
+                kth_distances
+                + 2 * np.repeat(half_diagonals[start:end], columns)
+                + margin
+            )
+            for i, row in enumerate(distances <= thresholds[:, np.newaxis]):
+                cell_candidates = site_ids[np.flatnonzero(row)]
+                if len(cell_candidates) <= NearestSiteGrid.MAX_CANDIDATES:
+                    candidates.append(cell_candidates)
+                    count += len(cell_candidates)
+                offsets[start * columns + i + 1] = count
+
+    header = _HEADER.pack(
+        _MAGIC,
+        get_sites_fingerprint(sites),
+        south,
+        west,
+        latitude_step,
+        longitude_step,
+        rows,
+        columns,
+        k,
+        0,
+    )
+    # 書き込み途中のファイルをワーカーが読まないよう、別名で書いてから置き換える。
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(header)
+        f.write(offsets.tobytes())
+        for cell_candidates in candidates:
+            f.write(cell_candidates.astype("<i4").tobytes())
+    os.replace(temporary_path, path)
+
+
+class NearestSiteGrid:
+    """最寄りの避難場所の候補を格子のセルごとに保持するファイルを読み込む
+
+    ファイルはmmapで読み取り専用に割り当てるので、forkしたワーカープロセス間で
+    同じページを共有する。
+
+    Attributes:
+        fingerprint (bytes): ファイルを作成した時の避難場所の指紋
+        k (int): 候補を求めた避難場所の件数
+        rows (int): 格子の行数
+        columns (int): 格子の列数
+
+    """
+
+    # 候補を求める時に浮動小数点誤差や距離の丸めで順位が入れ替わっても
+    # 取りこぼさないよう、探索する距離に持たせる余裕（メートル）。
+    MARGIN_METERS = 10.0
+    # 1セルに書き出す候補の数の上限
+    MAX_CANDIDATES = 64
+    # ファイルを作成する時に一度に計算する距離の行列の要素数の上限
+    BUILD_MATRIX_SIZE = 2**22
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): 読み込むファイルのパス
+
+        """
+        with open(path, "rb") as f:
+            self.__buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (
+                magic,
+                self.__fingerprint,
+                self.__south,
+                self.__west,
+                self.__latitude_step,
+                self.__longitude_step,
+                self.__rows,
+                self.__columns,
+                self.__k,
+                _,
+            ) = _HEADER.unpack_from(self.__buffer, 0)
+            if magic != _MAGIC:
+                raise ValueError("ファイルの形式が正しくありません。")
+            cells = self.__rows * self.__columns
+            self.__offsets = np.frombuffer(
+                self.__buffer, dtype="<u4", count=cells + 1, offset=_HEADER.size
+            )
+            self.__candidates = np.frombuffer(
+                self.__buffer,
+                dtype="<i4",
+                count=int(self.__offsets[-1]),
+                offset=_HEADER.size + self.__offsets.nbytes,
+            )
+        except (struct.error, ValueError):
+            self.__buffer.close()
+            raise
+
+    @property
+    def fingerprint(self) -> bytes:
+        return self.__fingerprint
+
+    @property
+    def k(self) -> int:
+        return self.__k
+
+    @property
+    def rows(self) -> int:
+        return self.__rows
+
+    @property
+    def columns(self) -> int:
+        return self.__columns
+
+    def get_candidates(self, latitude: float, longitude: float):
+        """
+        地点を含むセルの最寄りの避難場所の候補を返す。
+
+        Args:
+            latitude (float): 地点の緯度
+            longitude (float): 地点の経度
+
+        Returns:
+            site_ids (:obj:`numpy.ndarray`): 候補の避難場所連番の配列。地点が
+                格子の範囲外か有限の数でないか、候補を書き出していないセルの
+                場合はNone
+
+        """
+        if not (np.isfinite(latitude) and np.isfinite(longitude)):
+            return None
+        row = int(np.floor((latitude - self.__south) / self.__latitude_step))
+        column = int(np.floor((longitude - self.__west) / self.__longitude_step))
+        if not (0 <= row < self.__rows and 0 <= column < self.__columns):
+            return None
+        cell = row * self.__columns + column
+        start = self.__offsets[cell]
+        end = self.__offsets[cell + 1]
+        if start == end:
+            return None
+        return self.__candidates[start:end]
+
+
+def open_nearest_grid(path: str = None):
+    """最寄りの避難場所の候補のファイルがあれば読み込む。
+
+    Args:
+        path (str): 読み込むファイルのパス
+
+    Returns:
+        grid (:obj:`NearestSiteGrid`): 読み込んだ格子。ファイルがないか
+            読み込めない場合はNone
+
+    """
+    if path is None:
+        path = Config.NEAREST_GRID_PATH
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return NearestSiteGrid(path)
+    except (OSError, struct.error, ValueError) as e:
+        Log().warning("最寄りの避難場所の候補を読み込めません: " + str(e))
+        return None
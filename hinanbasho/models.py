@@ -1,3 +1,5 @@
+import hashlib
+import sys
 from decimal import ROUND_HALF_UP, Decimal
 
 import numpy as np
@@ -5,6 +7,77 @@ import numpy as np
 from hinanbasho.errors import LocationError
 from hinanbasho.factory import Factory
 
+# 四捨五入の境界からこの範囲内にある値は、浮動小数点誤差で丸め方向が
+# 変わりうるのでDecimalで丸め直す。
+_ROUNDING_TOLERANCE = 1e-6
+
+
+def round_half_up(values, decimals: int) -> np.ndarray:
+    """
+    配列の各要素を小数点以下decimals桁に四捨五入する。
+
+    値の文字列表現をDecimalで四捨五入した場合と同じ結果を返す。四捨五入の
+    境界に近い要素だけをDecimalで丸め直し、それ以外は配列演算で処理する。
+
+    Args:
+        values (array_like): 四捨五入する値の配列
+        decimals (int): 四捨五入した後の小数点以下の桁数
+
+    Returns:
+        rounded (:obj:`numpy.ndarray`): 四捨五入した値の配列
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10.0**decimals
+    scaled = values * scale
+    rounded = np.floor(scaled + 0.5)
+    ties = np.abs(scaled - np.floor(scaled) - 0.5) <= (
+        _ROUNDING_TOLERANCE + 4 * np.spacing(np.abs(scaled))
+    )
+    if ties.any():
+        exponent = Decimal(1).scaleb(-decimals)
+        flat_values = values.reshape(-1)
+        flat_rounded = rounded.reshape(-1)
+        for i in np.flatnonzero(ties.reshape(-1)):
+            value = Decimal(str(flat_values[i])).quantize(
+                exponent, rounding=ROUND_HALF_UP
+            )
+            flat_rounded[i] = float(value.scaleb(decimals))
+    return rounded / scale
+
+
+def get_distances(
+    start_latitudes, start_longitudes, end_latitudes, end_longitudes
+) -> np.ndarray:
+    """
+    始点と終点の間の距離を配列演算でまとめて計算して返す。
+
+    CurrentLocation.get_distance_toと同じ計算で、引数はNumPyの規則で
+    ブロードキャストするので、始点の配列と終点の配列から距離の行列も作れる。
+
+    Args:
+        start_latitudes (array_like): 始点の緯度の配列
+        start_longitudes (array_like): 始点の経度の配列
+        end_latitudes (array_like): 終点の緯度の配列
+        end_longitudes (array_like): 終点の経度の配列
+
+    Returns:
+        distances (:obj:`numpy.ndarray`): 始点と終点の間の距離（メートル）の配列
+
+    """
+    earth_radius = 6378137.00
+    start_latitudes = np.radians(np.asarray(start_latitudes, dtype=np.float64))
+    start_longitudes = np.radians(np.asarray(start_longitudes, dtype=np.float64))
+    end_latitudes = np.radians(np.asarray(end_latitudes, dtype=np.float64))
+    end_longitudes = np.radians(np.asarray(end_longitudes, dtype=np.float64))
+    distances = earth_radius * np.arccos(
+        np.sin(start_latitudes) * np.sin(end_latitudes)
+        + np.cos(start_latitudes)
+        * np.cos(end_latitudes)
+        * np.cos(end_longitudes - start_longitudes)
+    )
+    return round_half_up(distances, 2)
+
 
 class Point:
     """
@@ -16,6 +89,9 @@ class Point:
 
     """
 
+    # 大量に作成するので__dict__を持たせず、属性は読み取り専用のプロパティで公開する。
+    __slots__ = ("__latitude", "__longitude")
+
     def __init__(self, latitude: float, longitude: float):
         """
         Args:
@@ -49,9 +125,18 @@ class EvacuationSite(Point):
         phone_number (str): 避難場所の電話番号
         latitude (float): 避難場所の緯度
         longitude (float): 避難場所の経度
+        content_hash (str): 連番以外の値から作るハッシュ値
 
     """
 
+    __slots__ = (
+        "__site_id",
+        "__site_name",
+        "__postal_code",
+        "__address",
+        "__phone_number",
+    )
+
     def __init__(
         self,
         site_id: int,
@@ -100,6 +185,21 @@ class EvacuationSite(Point):
     def phone_number(self) -> str:
         return self.__phone_number
 
+    @property
+    def content_hash(self) -> str:
+        # 取り込み直す時に変更の有無を比べるため、連番以外の値から作る。
+        content = "\x1f".join(
+            [
+                self.__site_name,
+                self.__postal_code,
+                self.__address,
+                self.__phone_number,
+                repr(self.latitude),
+                repr(self.longitude),
+            ]
+        )
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
 
 class EvacuationSiteFactory(Factory):
     """避難場所モデルを作成する。
@@ -109,6 +209,16 @@ class EvacuationSiteFactory(Factory):
 
     """
 
+    COLUMNS = (
+        "site_id",
+        "site_name",
+        "postal_code",
+        "address",
+        "phone_number",
+        "latitude",
+        "longitude",
+    )
+
     def __init__(self):
         self.__items = list()
 
@@ -125,6 +235,32 @@ class EvacuationSiteFactory(Factory):
         """
         return EvacuationSite(**row)
 
+    def _create_item_from_row(self, row: dict) -> EvacuationSite:
+        """キーワード引数に展開せずに避難場所オブジェクトを作成する。
+
+        Args:
+            row (dict): 避難場所情報を表すディクショナリ
+
+        """
+        return EvacuationSite(
+            row["site_id"],
+            row["site_name"],
+            row["postal_code"],
+            row["address"],
+            row["phone_number"],
+            row["latitude"],
+            row["longitude"],
+        )
+
+    def _create_item_from_tuple(self, values: tuple) -> EvacuationSite:
+        """COLUMNSの順に値が並んだタプルから避難場所オブジェクトを作成する。
+
+        Args:
+            values (tuple): 避難場所情報の値のタプル
+
+        """
+        return EvacuationSite(*values)
+
     def _register_item(self, item: EvacuationSite) -> None:
         """避難場所オブジェクトをリストに追加。
 
@@ -138,6 +274,322 @@ class EvacuationSiteFactory(Factory):
         self.__items.append(item)
 
 
+class SiteTable:
+    """避難場所データを列ごとの配列で保持する表
+
+    避難場所連番は整数の配列、緯度経度は浮動小数点数の配列、文字列は
+    sys.internで同じ値を共有したオブジェクトの配列で保持する。避難場所ごとに
+    オブジェクトを作らないのでメモリの使用量が少なく、距離の計算や絞り込みを
+    列全体の配列演算で行える。行はEvacuationSiteと同じ属性を持つビューとして
+    取り出せる。
+
+    Attributes:
+        site_ids (:obj:`numpy.ndarray`): 連番の配列
+        site_names (:obj:`numpy.ndarray`): 避難場所名の配列
+        postal_codes (:obj:`numpy.ndarray`): 郵便番号の配列
+        addresses (:obj:`numpy.ndarray`): 住所の配列
+        phone_numbers (:obj:`numpy.ndarray`): 電話番号の配列
+        latitudes (:obj:`numpy.ndarray`): 緯度の配列
+        longitudes (:obj:`numpy.ndarray`): 経度の配列
+
+    """
+
+    def __init__(
+        self,
+        site_ids,
+        site_names,
+        postal_codes,
+        addresses,
+        phone_numbers,
+        latitudes,
+        longitudes,
+    ):
+        """
+        Args:
+            site_ids (array_like): 連番の配列
+            site_names (array_like): 避難場所名の配列
+            postal_codes (array_like): 郵便番号の配列
+            addresses (array_like): 住所の配列
+            phone_numbers (array_like): 電話番号の配列
+            latitudes (array_like): 緯度の配列
+            longitudes (array_like): 経度の配列
+
+        """
+        self.__site_ids = np.asarray(site_ids, dtype=np.int64).reshape(-1)
+        self.__site_names = self.__to_strings(site_names)
+        self.__postal_codes = self.__to_strings(postal_codes)
+        self.__addresses = self.__to_strings(addresses)
+        self.__phone_numbers = self.__to_strings(phone_numbers)
+        try:
+            self.__latitudes = np.asarray(latitudes, dtype=np.float64).reshape(-1)
+            self.__longitudes = np.asarray(longitudes, dtype=np.float64).reshape(-1)
+        except (TypeError, ValueError):
+            raise LocationError("緯度経度の値が正しくありません。")
+        if not (
+            np.isfinite(self.__latitudes).all() and np.isfinite(self.__longitudes).all()
+        ):
+            raise LocationError("緯度経度の値が正しくありません。")
+        columns = (
+            self.__site_names,
+            self.__postal_codes,
+            self.__addresses,
+            self.__phone_numbers,
+            self.__latitudes,
+            self.__longitudes,
+        )
+        if any(len(column) != len(self.__site_ids) for column in columns):
+            raise ValueError("列の長さが揃っていません。")
+
+    def __to_strings(self, values) -> np.ndarray:
+        strings = np.empty(len(values), dtype=object)
+        strings[:] = [sys.intern(str(value)) for value in values]
+        return strings
+
+    @property
+    def site_ids(self) -> np.ndarray:
+        return self.__site_ids
+
+    @property
+    def site_names(self) -> np.ndarray:
+        return self.__site_names
+
+    @property
+    def postal_codes(self) -> np.ndarray:
+        return self.__postal_codes
+
+    @property
+    def addresses(self) -> np.ndarray:
+        return self.__addresses
+
+    @property
+    def phone_numbers(self) -> np.ndarray:
+        return self.__phone_numbers
+
+    @property
+    def latitudes(self) -> np.ndarray:
+        return self.__latitudes
+
+    @property
+    def longitudes(self) -> np.ndarray:
+        return self.__longitudes
+
+    def __len__(self) -> int:
+        return len(self.__site_ids)
+
+    def __getitem__(self, index: int) -> "SiteRow":
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("行番号が範囲外です。")
+        return SiteRow(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield SiteRow(self, index)
+
+    def take(self, indices) -> list:
+        """
+        指定した行番号の行のリストを返す。
+
+        Args:
+            indices (array_like): 行番号の配列
+
+        Returns:
+            rows (list of :obj:`SiteRow`): 行のリスト
+
+        """
+        return [SiteRow(self, index) for index in np.asarray(indices).tolist()]
+
+    @staticmethod
+    def from_sites(sites) -> "SiteTable":
+        """
+        避難場所オブジェクトのリストから表を作成する。
+
+        Args:
+            sites (list of :obj:`EvacuationSite`): 避難場所オブジェクトのリスト。
+                SiteTableの場合はそのまま返す
+
+        Returns:
+            table (:obj:`SiteTable`): 避難場所の表
+
+        """
+        if isinstance(sites, SiteTable):
+            return sites
+        sites = list(sites)
+        return SiteTable(
+            site_ids=[site.site_id for site in sites],
+            site_names=[site.site_name for site in sites],
+            postal_codes=[site.postal_code for site in sites],
+            addresses=[site.address for site in sites],
+            phone_numbers=[site.phone_number for site in sites],
+            latitudes=[site.latitude for site in sites],
+            longitudes=[site.longitude for site in sites],
+        )
+
+
+class SiteRow:
+    """SiteTableの1行のビュー
+
+    値をコピーせずに表を参照し、EvacuationSiteと同じ属性で値を返す。
+
+    Attributes:
+        table (:obj:`SiteTable`): 参照する表
+        index (int): 行番号
+        site_id (int): 連番
+        site_name (str): 避難場所名
+        postal_code (str): 避難場所の郵便番号
+        address (str): 避難場所の住所
+        phone_number (str): 避難場所の電話番号
+        latitude (float): 避難場所の緯度
+        longitude (float): 避難場所の経度
+
+    """
+
+    __slots__ = ("__table", "__index")
+
+    def __init__(self, table: SiteTable, index: int):
+        """
+        Args:
+            table (:obj:`SiteTable`): 参照する表
+            index (int): 行番号
+
+        """
+        self.__table = table
+        self.__index = index
+
+    @property
+    def table(self) -> SiteTable:
+        return self.__table
+
+    @property
+    def index(self) -> int:
+        return self.__index
+
+    @property
+    def site_id(self) -> int:
+        return int(self.__table.site_ids[self.__index])
+
+    @property
+    def site_name(self) -> str:
+        return self.__table.site_names[self.__index]
+
+    @property
+    def postal_code(self) -> str:
+        return self.__table.postal_codes[self.__index]
+
+    @property
+    def address(self) -> str:
+        return self.__table.addresses[self.__index]
+
+    @property
+    def phone_number(self) -> str:
+        return self.__table.phone_numbers[self.__index]
+
+    @property
+    def latitude(self) -> float:
+        return float(self.__table.latitudes[self.__index])
+
+    @property
+    def longitude(self) -> float:
+        return float(self.__table.longitudes[self.__index])
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, SiteRow):
+            return NotImplemented
+        return self.__table is other.table and self.__index == other.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.__table), self.__index))
+
+
+class SiteTableFactory(Factory):
+    """避難場所の表を作成する。
+
+    Attributes:
+        table (:obj:`SiteTable`): 作成した避難場所の表
+
+    """
+
+    COLUMNS = EvacuationSiteFactory.COLUMNS
+
+    def __init__(self):
+        self.__columns = {
+            "site_id": list(),
+            "site_name": list(),
+            "postal_code": list(),
+            "address": list(),
+            "phone_number": list(),
+            "latitude": list(),
+            "longitude": list(),
+        }
+
+    @property
+    def table(self) -> SiteTable:
+        return SiteTable(
+            site_ids=self.__columns["site_id"],
+            site_names=self.__columns["site_name"],
+            postal_codes=self.__columns["postal_code"],
+            addresses=self.__columns["address"],
+            phone_numbers=self.__columns["phone_number"],
+            latitudes=self.__columns["latitude"],
+            longitudes=self.__columns["longitude"],
+        )
+
+    def _create_item(self, **row: dict) -> dict:
+        """避難場所情報を表の列の型に変換する。
+
+        Args:
+            row (dict): 避難場所情報を表すディクショナリ
+
+        """
+        return self._create_item_from_row(row)
+
+    def _create_item_from_row(self, row: dict) -> dict:
+        """キーワード引数に展開せずに避難場所情報を表の列の型に変換する。
+
+        Args:
+            row (dict): 避難場所情報を表すディクショナリ
+
+        """
+        try:
+            latitude = float(row["latitude"])
+            longitude = float(row["longitude"])
+        except (TypeError, ValueError):
+            raise LocationError("緯度経度の値が正しくありません。")
+        return {
+            "site_id": int(row["site_id"]),
+            "site_name": str(row["site_name"]),
+            "postal_code": str(row["postal_code"]),
+            "address": str(row["address"]),
+            "phone_number": str(row["phone_number"]),
+            "latitude": latitude,
+            "longitude": longitude,
+        }
+
+    def create_many_from_tuples(self, rows) -> None:
+        """COLUMNSの順に値が並んだタプルを、行ごとの辞書を作らずに列に追加する。
+
+        値の型は表を作成する時に列ごとにまとめて変換する。
+
+        Args:
+            rows (iterable of tuples): 避難場所情報の値のタプル
+
+        """
+        for key, values in zip(self.COLUMNS, zip(*rows)):
+            self.__columns[key].extend(values)
+
+    def _register_item(self, item: dict) -> None:
+        """避難場所情報を表の列に追加。
+
+        Args:
+            item (dict): 表の列の型に変換した避難場所情報
+
+        """
+        for key, values in self.__columns.items():
+            values.append(item[key])
+
+
 class CurrentLocation(Point):
     """
     現在地の情報を表す
@@ -148,6 +600,8 @@ class CurrentLocation(Point):
 
     """
 
+    __slots__ = ()
+
     def __init__(self, latitude: float = None, longitude: float = None):
         Point.__init__(self, latitude, longitude)
 
@@ -177,6 +631,24 @@ class CurrentLocation(Point):
             Decimal(str(distance)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
         )
 
+    def get_distances_to(self, latitudes, longitudes) -> np.ndarray:
+        """
+        現在地と複数の地点の間の距離をまとめて計算して返す。
+
+        get_distance_toと同じ計算を配列演算で行うので、地点ごとに
+        get_distance_toを呼び出した場合と同じ結果になる。
+
+        Args:
+            latitudes (array_like): 地点の緯度の配列
+            longitudes (array_like): 地点の経度の配列
+
+        Returns:
+            distances (:obj:`numpy.ndarray`): 現在地と各地点の間の距離
+                （メートル）の配列
+
+        """
+        return get_distances(self.latitude, self.longitude, latitudes, longitudes)
+
 
 class AreaAddress:
     """町域と郵便番号のデータモデル
@@ -187,6 +659,8 @@ class AreaAddress:
 
     """
 
+    __slots__ = ("__postal_code", "__area_name")
+
     def __init__(
         self,
         postal_code: str,
@@ -220,6 +694,8 @@ class AreaAddressFactory(Factory):
 
     """
 
+    COLUMNS = ("postal_code", "area_name")
+
     def __init__(self):
         self.__items = list()
 
@@ -236,6 +712,24 @@ class AreaAddressFactory(Factory):
         """
         return AreaAddress(**row)
 
+    def _create_item_from_row(self, row: dict) -> AreaAddress:
+        """キーワード引数に展開せずに町域と郵便番号オブジェクトを作成する。
+
+        Args:
+            row (dict): 町域と郵便番号情報を表すディクショナリ
+
+        """
+        return AreaAddress(row["postal_code"], row["area_name"])
+
+    def _create_item_from_tuple(self, values: tuple) -> AreaAddress:
+        """COLUMNSの順に値が並んだタプルから町域と郵便番号オブジェクトを作成する。
+
+        Args:
+            values (tuple): 町域と郵便番号情報の値のタプル
+
+        """
+        return AreaAddress(*values)
+
     def _register_item(self, item: AreaAddress) -> None:
         """町域と郵便番号オブジェクトをリストに追加。
 
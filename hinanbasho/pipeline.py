@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+
+from hinanbasho.config import Config
+
+# 読み込み側のスレッドが最後の要素を渡したことを表す印
+_END = object()
+
+
+def prefetch(iterable, buffer_size: int = None):
+    """別のスレッドでiterableを先に読み進め、要素を順に返す。
+
+    CSVの読み込みとデータベースへの保存のように、要素を作る処理と使う処理を
+    並行させる。先に読み進めるのはbuffer_size個までなので、使用するメモリは
+    要素の大きさとbuffer_sizeで決まる。iterableで発生した例外は、要素を
+    使う側で同じ順番の位置で送出する。
+
+    Args:
+        iterable (iterable): 要素を作るiterable
+        buffer_size (int): 先に読み進めておく要素の数の上限。省略した場合は設定値
+
+    Returns:
+        items (generator): iterableと同じ順に要素を返すジェネレータ
+
+    """
+    if buffer_size is None:
+        buffer_size = Config.PREFETCH_BUFFER_SIZE
+    buffer = queue.Queue(maxsize=max(int(buffer_size), 1))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # 使う側が途中でやめた場合に待ち続けないよう、間隔を空けて確認する。
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    # 使う側がやめたので、ジェネレータなら後始末をさせる。
+                    close = getattr(iterator, "close", None)
+                    if close is not None:
+                        close()
+                    return
+        except BaseException as e:
+            put((_END, e))
+            return
+        put((_END, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    return _consume(buffer, stop)
+
+
+def _consume(buffer: queue.Queue, stop: threading.Event):
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_models(chunks, factory):
+    """辞書のリストのチャンクを順にモデルのオブジェクトのリストにする。
+
+    Args:
+        chunks (iterable of lists): 行を辞書にしたリストのチャンク
+        factory (:obj:`Factory`): モデルのオブジェクトを作成するファクトリー
+
+    Yields:
+        items (list): チャンクの行から作成したオブジェクトのリスト
+
+    """
+    for rows in chunks:
+        yield list(factory.iter_from_rows(rows))
+
+
+def flatten(chunks):
+    """チャンクの要素を順に返す。
+
+    Args:
+        chunks (iterable of lists): チャンク
+
+    Yields:
+        item: チャンクの要素
+
+    """
+    for chunk in chunks:
+        yield from chunk
+
+
+def run_timed(function, *args):
+    """関数を実行し、結果とかかった時間を返す。
+
+    Args:
+        function (callable): 実行する関数
+        *args: 関数に渡す引数
+
+    Returns:
+        result (tuple): 関数の戻り値とかかった時間（秒）のタプル
+
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
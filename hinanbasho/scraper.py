@@ -10,118 +10,214 @@ from hinanbasho.config import Config
 class OpenData:
     """旭川市オープンデータライブラリからCSVをダウンロードしてテキスト要素の二次元配列に格納する
 
+    前回のダウンロードで受け取ったETagとLast-Modifiedを渡すと条件付きで
+    リクエストし、CSVが更新されていなければダウンロードしない。CSVは
+    iter_chunksで指定した行数ずつ読み込める。
+
     Attributes:
         lists(list of dicts): CSVの各行を辞書にしてリストに格納したデータ
+        not_modified (bool): CSVが前回から更新されていなければ真
+        etag (str): レスポンスのETag
+        last_modified (str): レスポンスのLast-Modified
 
     """
 
-    def __init__(self):
-        self.__lists = list()
+    def __init__(self, etag: str = None, last_modified: str = None, url: str = None):
+        """
+        Args:
+            etag (str): 前回のダウンロードで受け取ったETag
+            last_modified (str): 前回のダウンロードで受け取ったLast-Modified
+            url (str): CSVのURL。省略した場合は設定値
+
+        """
+        self.__content = b""
+        self.__lists = None
+        self.__not_modified = False
+        self.__etag = etag
+        self.__last_modified = last_modified
+        headers = dict()
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
         # 旭川市ホームページのTLS証明書のDH鍵長に問題があるためセキュリティを下げて回避する
         requests.packages.urllib3.util.ssl_.DEFAULT_CIPHERS += "HIGH:!DH"
-        response = requests.get(Config.OPENDATA_URL)
-        csv_content = io.BytesIO(response.content)
-        df = pd.read_csv(csv_content, encoding="cp932", header=0, dtype=str)
-        df.replace(np.nan, "", inplace=True)
-        i = 0
-        for row in df.values.tolist():
-            # CSVの行数をデータベースのキーにできるようにする
-            csv_row_number = i + 1
-            # オープンデータの豊西会館だけ緯度経度が抜けているので対策する
-            if row[0] == "豊西会館":
-                latitude = 43.6832208
-                longitude = 142.1762534
-            else:
-                latitude = float(row[5])
-                longitude = float(row[6])
-            # オープンデータの花咲スポーツ公園の郵便番号が誤っているので対策する
-            if row[0] == "花咲スポーツ公園":
-                postal_code = "070-0901"
-            else:
-                postal_code = row[1]
-
-            self.__lists.append(
-                {
-                    "site_id": csv_row_number,
-                    "site_name": row[0],
-                    "postal_code": postal_code,
-                    "address": row[2],
-                    "phone_number": row[3],
-                    "latitude": latitude,
-                    "longitude": longitude,
-                }
-            )
-            i += 1
+        response = requests.get(url or Config.OPENDATA_URL, headers=headers)
+        if response.status_code == 304:
+            self.__not_modified = True
+            return
+        response.raise_for_status()
+        self.__etag = response.headers.get("ETag")
+        self.__last_modified = response.headers.get("Last-Modified")
+        self.__content = response.content
 
     @property
     def lists(self) -> list:
+        if self.__lists is None:
+            self.__lists = [row for chunk in self.iter_chunks() for row in chunk]
         return self.__lists
 
+    @property
+    def not_modified(self) -> bool:
+        return self.__not_modified
+
+    @property
+    def etag(self) -> str:
+        return self.__etag
+
+    @property
+    def last_modified(self) -> str:
+        return self.__last_modified
+
+    def iter_chunks(self, chunk_size: int = None):
+        """CSVを指定した行数ずつ読み込み、各行を辞書にしたリストを返す。
+
+        Args:
+            chunk_size (int): 一度に読み込む行数。省略した場合は設定値
+
+        Yields:
+            rows (list of dicts): CSVの行を辞書にしたリスト
+
+        """
+        if self.__not_modified or not self.__content:
+            return
+        if chunk_size is None:
+            chunk_size = Config.CSV_CHUNK_SIZE
+        reader = pd.read_csv(
+            io.BytesIO(self.__content),
+            encoding="cp932",
+            header=0,
+            dtype=str,
+            chunksize=max(int(chunk_size), 1),
+        )
+        i = 0
+        for df in reader:
+            df.replace(np.nan, "", inplace=True)
+            rows = list()
+            for row in df.values.tolist():
+                # CSVの行数をデータベースのキーにできるようにする
+                csv_row_number = i + 1
+                rows.append(self.__normalize(csv_row_number, row))
+                i += 1
+            yield rows
+
+    def __normalize(self, csv_row_number: int, row: list) -> dict:
+        # オープンデータの豊西会館だけ緯度経度が抜けているので対策する
+        if row[0] == "豊西会館":
+            latitude = 43.6832208
+            longitude = 142.1762534
+        else:
+            latitude = float(row[5])
+            longitude = float(row[6])
+        # オープンデータの花咲スポーツ公園の郵便番号が誤っているので対策する
+        if row[0] == "花咲スポーツ公園":
+            postal_code = "070-0901"
+        else:
+            postal_code = row[1]
+
+        return {
+            "site_id": csv_row_number,
+            "site_name": row[0],
+            "postal_code": postal_code,
+            "address": row[2],
+            "phone_number": row[3],
+            "latitude": latitude,
+            "longitude": longitude,
+        }
+
 
 class PostOfficeCSV:
     """
     日本郵便株式会社WebサイトからローカルにダウンロードしたCSVファイルから
     データを抽出する
 
+    町域名が長く複数行に分かれている町域は、同じ郵便番号が続く行の町域名を
+    つなげて1件にする。CSVはiter_chunksで指定した行数ずつ読み込める。
+
     Attributes:
         lists(list of dicts): CSVの各行を辞書にしてリストに格納したデータ
 
     """
 
-    def __init__(self):
-        self.__lists = list()
-        df = pd.read_csv(
-            Config.POST_OFFICE_CSV_PATH, encoding="cp932", header=None, dtype=str
-        )
-        df.replace(np.nan, "", inplace=True)
-
-        i = 0
-        data_length = len(df.values.tolist())
-        tmp = {
-            "postal_code": None,
-            "area_name": None,
-        }
-        duplicate_key = ""
-        for row in df.values.tolist():
-            postal_code = row[2]
-            area_name = row[8]
-            if i == 0:
-                # CSV先頭行
-                # 一つ前の行までのデータを一時的に保存するもの。
-                tmp = {
-                    "postal_code": postal_code,
-                    "area_name": area_name,
-                }
-                # 一つ前の行までのデータの郵便番号。
-                duplicate_key = postal_code
-            elif i < data_length - 1:
-                # CSV2行目以降最終行の1行前まで
-                # 町域が複数行に分かれている場合の処理
-                # 前の行と現在の行の郵便番号が同一かどうかで判断する。
-                if postal_code == duplicate_key:
-                    # 町域が複数行に分かれている場合は町域を追記。
-                    tmp["area_name"] = tmp["area_name"] + area_name
-                else:
-                    # 町域が複数行に分かれていない場合に初めてデータを抽出。
-                    self.__lists.append(tmp)
-                    # 一時保存データを現在の行のデータで初期化する。
-                    tmp = {
-                        "postal_code": postal_code,
-                        "area_name": area_name,
-                    }
-                    duplicate_key = postal_code
-            else:
-                # CSV最終行
-                self.__lists.append(tmp)
-                self.__lists.append(
-                    {
-                        "postal_code": postal_code,
-                        "area_name": area_name,
-                    }
-                )
-
-            i += 1
+    # 全国地方公共団体コード、郵便番号、町域名の列
+    CODE_COLUMN = 0
+    POSTAL_CODE_COLUMN = 2
+    AREA_NAME_COLUMN = 8
+
+    def __init__(self, path: str = None, municipality_code: str = None):
+        """
+        Args:
+            path (str): CSVファイルのパス。省略した場合は設定値
+            municipality_code (str): 取り出す市区町村の全国地方公共団体コード
+                （5桁）。省略した場合は設定値で、空なら全ての市区町村
+
+        """
+        if path is None:
+            path = Config.POST_OFFICE_CSV_PATH
+        if municipality_code is None:
+            municipality_code = Config.POST_OFFICE_MUNICIPALITY_CODE
+        self.__path = path
+        self.__municipality_code = municipality_code
+        self.__lists = None
 
     @property
     def lists(self) -> list:
+        if self.__lists is None:
+            self.__lists = [row for chunk in self.iter_chunks() for row in chunk]
         return self.__lists
+
+    def iter_chunks(self, chunk_size: int = None):
+        """CSVを指定した行数ずつ読み込み、町域ごとの辞書のリストを返す。
+
+        チャンクの最後の町域は次のチャンクに続く場合があるので、次の
+        チャンクと合わせてから返す。
+
+        Args:
+            chunk_size (int): 一度に読み込む行数。省略した場合は設定値
+
+        Yields:
+            rows (list of dicts): 郵便番号と町域名の辞書のリスト
+
+        """
+        if chunk_size is None:
+            chunk_size = Config.CSV_CHUNK_SIZE
+        reader = pd.read_csv(
+            self.__path,
+            encoding="cp932",
+            header=None,
+            dtype=str,
+            usecols=[self.CODE_COLUMN, self.POSTAL_CODE_COLUMN, self.AREA_NAME_COLUMN],
+            keep_default_na=False,
+            chunksize=max(int(chunk_size), 1),
+        )
+        pending = None
+        for df in reader:
+            if self.__municipality_code:
+                df = df[df[self.CODE_COLUMN] == self.__municipality_code]
+            postal_codes = df[self.POSTAL_CODE_COLUMN].to_numpy()
+            area_names = df[self.AREA_NAME_COLUMN].to_numpy(dtype=object)
+            if len(postal_codes) == 0:
+                continue
+
+            # 郵便番号が前の行と変わる行を町域の先頭とし、次の町域の先頭までの
+            # 町域名をつなげる。
+            starts = np.flatnonzero(
+                np.concatenate([[True], postal_codes[1:] != postal_codes[:-1]])
+            )
+            rows = [
+                {"postal_code": postal_code, "area_name": area_name}
+                for postal_code, area_name in zip(
+                    postal_codes[starts].tolist(),
+                    np.add.reduceat(area_names, starts).tolist(),
+                )
+            ]
+            if pending is not None:
+                if pending["postal_code"] == rows[0]["postal_code"]:
+                    rows[0]["area_name"] = pending["area_name"] + rows[0]["area_name"]
+                else:
+                    rows.insert(0, pending)
+            pending = rows.pop()
+            if rows:
+                yield rows
+        if pending is not None:
+            yield [pending]
@@ -0,0 +1,244 @@
+import re
+import unicodedata
+from bisect import bisect_left
+
+
+def normalize_reading(text: str) -> str:
+    """読みの揺れを吸収するため文字列を正規化する。
+
+    全角英数字と半角カナをNFKCで統一し、ひらがなをカタカナに変換する。
+
+    Args:
+        text (str): 正規化する文字列
+
+    Returns:
+        normalized (str): 正規化した文字列
+
+    """
+    normalized = unicodedata.normalize("NFKC", str(text))
+    return "".join(
+        chr(ord(char) + 0x60) if "ぁ" <= char <= "ゖ" else char for char in normalized
+    )
+
+
+class LikePattern:
+    """SQLのLIKE演算子のパターン
+
+    %は任意の文字列、_は任意の1文字、\\は次の1文字をそのまま表すものとして
+    パターンを解釈し、ワイルドカードを含まない部分文字列を取り出す。
+
+    Attributes:
+        pattern (str): LIKEのパターン
+        literals (list of str): パターンをワイルドカードで区切った部分文字列のリスト
+        regex (:obj:`re.Pattern`): パターンと同じ文字列にマッチする正規表現
+
+    """
+
+    def __init__(self, pattern: str):
+        """
+        Args:
+            pattern (str): LIKEのパターン
+
+        """
+        self.__pattern = str(pattern)
+        literals = list()
+        regex = ""
+        literal = ""
+        escaped = False
+        for char in self.__pattern:
+            if not escaped and char in ("%", "_"):
+                literals.append(literal)
+                literal = ""
+                regex += ".*" if char == "%" else "."
+            elif not escaped and char == "\\":
+                escaped = True
+            else:
+                literal += char
+                regex += re.escape(char)
+                escaped = False
+        if escaped:
+            literal += "\\"
+            regex += re.escape("\\")
+        literals.append(literal)
+        self.__literals = [literal for literal in literals if literal]
+        self.__regex = re.compile(regex, re.DOTALL)
+
+    @property
+    def pattern(self) -> str:
+        return self.__pattern
+
+    @property
+    def literals(self) -> list:
+        return self.__literals
+
+    @property
+    def regex(self):
+        return self.__regex
+
+    def match(self, text: str) -> bool:
+        """文字列がパターンにマッチするか判定する。
+
+        Args:
+            text (str): 判定する文字列
+
+        Returns:
+            bool: マッチすれば真を返す。
+
+        """
+        return self.__regex.fullmatch(text) is not None
+
+
+class NgramIndex:
+    """文字のn-gramによる転置インデックス
+
+    単語の区切りがない日本語の文字列の部分一致検索のため、各文字列の1文字と
+    連続するn文字をキーに、その文字を含む文字列の番号の集合を保持する。
+    キーワードの全てのn-gramの集合の積で候補を絞り込み、候補だけ実際に
+    含まれるか確認する。
+
+    Attributes:
+        texts (list of str): インデックスを作成した文字列のリスト
+        n (int): n-gramの文字数
+
+    """
+
+    def __init__(self, texts: list, n: int = 2):
+        """
+        Args:
+            texts (list of str): インデックスを作成する文字列のリスト
+            n (int): n-gramの文字数
+
+        """
+        self.__texts = [str(text) for text in texts]
+        self.__n = max(int(n), 1)
+        self.__postings = dict()
+        for i, text in enumerate(self.__texts):
+            for gram in self.__get_grams(text, include_unigrams=True):
+                self.__postings.setdefault(gram, set()).add(i)
+
+    @property
+    def texts(self) -> list:
+        return self.__texts
+
+    @property
+    def n(self) -> int:
+        return self.__n
+
+    def __get_grams(self, text: str, include_unigrams: bool = False) -> set:
+        grams = set()
+        if include_unigrams or len(text) < self.__n:
+            grams.update(text)
+        for i in range(len(text) - self.__n + 1):
+            grams.add(text[i : i + self.__n])
+        return grams
+
+    def __get_candidates(self, keyword: str) -> set:
+        postings = list()
+        for gram in self.__get_grams(keyword):
+            posting = self.__postings.get(gram)
+            if posting is None:
+                return set()
+            postings.append(posting)
+        # 要素数の少ない集合から順に積をとる。
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        return candidates
+
+    def find(self, keyword: str) -> list:
+        """キーワードを含む文字列の番号を返す。
+
+        Args:
+            keyword (str): キーワード
+
+        Returns:
+            indices (list of int): キーワードを含む文字列の番号の昇順のリスト
+
+        """
+        keyword = str(keyword)
+        if not keyword:
+            return list(range(len(self.__texts)))
+        candidates = self.__get_candidates(keyword)
+        return [i for i in sorted(candidates) if keyword in self.__texts[i]]
+
+    def find_like(self, pattern) -> list:
+        """LIKEのパターンにマッチする文字列の番号を返す。
+
+        Args:
+            pattern (str or :obj:`LikePattern`): LIKEのパターン
+
+        Returns:
+            indices (list of int): パターンにマッチする文字列の番号の昇順のリスト
+
+        """
+        if not isinstance(pattern, LikePattern):
+            pattern = LikePattern(pattern)
+        candidates = None
+        for literal in pattern.literals:
+            literal_candidates = self.__get_candidates(literal)
+            if candidates is None:
+                candidates = literal_candidates
+            else:
+                candidates &= literal_candidates
+            if not candidates:
+                return list()
+        if candidates is None:
+            candidates = range(len(self.__texts))
+        return [i for i in sorted(candidates) if pattern.match(self.__texts[i])]
+
+
+class PrefixIndex:
+    """前方一致検索のための文字列の整列済み配列
+
+    正規化した文字列を昇順に並べておき、二分探索で前方一致する範囲を探す。
+
+    Attributes:
+        size (int): 登録した文字列の数
+
+    """
+
+    def __init__(self, entries):
+        """
+        Args:
+            entries (iterable of tuples): 文字列と、その文字列に前方一致した時に
+                返す値のタプル
+
+        """
+        entries = sorted(
+            (normalize_reading(text), i, value)
+            for i, (text, value) in enumerate(entries)
+        )
+        self.__keys = [key for key, _, _ in entries]
+        self.__values = [value for _, _, value in entries]
+
+    @property
+    def size(self) -> int:
+        return len(self.__keys)
+
+    def complete(self, prefix: str, limit: int = 10) -> list:
+        """前方一致する文字列の値を返す。
+
+        Args:
+            prefix (str): 前方一致させる文字列
+            limit (int): 返す値の最大数
+
+        Returns:
+            values (list): 前方一致する文字列の値を文字列の昇順に並べたリスト
+
+        """
+        prefix = normalize_reading(prefix)
+        if not prefix:
+            return list()
+        values = list()
+        i = bisect_left(self.__keys, prefix)
+        while (
+            i < len(self.__keys)
+            and len(values) < limit
+            and self.__keys[i].startswith(prefix)
+        ):
+            values.append(self.__values[i])
+            i += 1
+        return values
@@ -1,18 +1,24 @@
+import time
+import uuid
 from datetime import datetime, timedelta, timezone
-from decimal import ROUND_HALF_UP, Decimal
 
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
 
+from hinanbasho.cache import SiteSnapshot, site_snapshot_cache
+from hinanbasho.config import Config
 from hinanbasho.db import DB
 from hinanbasho.errors import DatabaseError, DataError
+from hinanbasho.grid import build_nearest_grid, open_nearest_grid
 from hinanbasho.logs import Log
 from hinanbasho.models import (
     AreaAddress,
     AreaAddressFactory,
     CurrentLocation,
     EvacuationSite,
-    EvacuationSiteFactory
+    EvacuationSiteFactory,
+    SiteTable,
+    SiteTableFactory
 )
 
 
@@ -21,6 +27,8 @@ class Service:
 
     Attributes:
         cursor (:obj:`DictCursor`): psycopg2.extrasのDictCursorオブジェクト
+        tuple_cursor (:obj:`psycopg2.extensions.cursor`): 行をタプルで返す
+            cursorオブジェクト。初めて使う時に作成する
         table_name (str): テーブル名
 
     """
@@ -32,7 +40,9 @@ class Service:
             table_name (str): テーブル名
 
         """
+        self.__db = db
         self.__cursor = db.cursor()
+        self.__tuple_cursor = None
         self.__table_name = table_name
         self.__logger = Log()
 
@@ -40,26 +50,38 @@ class Service:
     def cursor(self) -> DictCursor:
         return self.__cursor
 
+    @property
+    def tuple_cursor(self):
+        if self.__tuple_cursor is None:
+            self.__tuple_cursor = self.__db.tuple_cursor()
+        return self.__tuple_cursor
+
     @property
     def table_name(self) -> str:
         return self.__table_name
 
-    def execute(self, sql: str, parameters: tuple = None) -> bool:
+    @property
+    def staging_table_name(self) -> str:
+        return self.__table_name + "_staging"
+
+    def execute(self, sql: str, parameters: tuple = None, tuples: bool = False) -> bool:
         """cursorオブジェクトのexecuteメソッドのラッパー。
 
         Args:
             sql (str): SQL文
             parameters (tuple): SQLにプレースホルダを使用する場合の値を格納したリスト
+            tuples (bool): 真なら行をタプルで返すcursorで実行する
 
         Returns:
             bool: 成功したら真を返す。
 
         """
+        cursor = self.tuple_cursor if tuples else self.cursor
         try:
             if parameters:
-                self.cursor.execute(sql, parameters)
+                cursor.execute(sql, parameters)
             else:
-                self.cursor.execute(sql)
+                cursor.execute(sql)
             return True
         except (
             psycopg2.DataError,
@@ -68,19 +90,303 @@ class Service:
         ) as e:
             raise DataError(e.args[0])
 
+    def execute_prepared(
+        self, name: str, sql: str, parameters: tuple = None, tuples: bool = False
+    ) -> bool:
+        """SQL文を接続ごとに1回だけPREPAREし、以降はEXECUTEで実行する。
+
+        同じ接続で2回目からは構文解析と実行計画の作成を省略できる。
+        設定でPREPAREしないようにした場合は、そのままSQL文を実行する。
+
+        Args:
+            name (str): 文の名前。テーブル名を前に付けてPREPAREする
+            sql (str): SQL文。プレースホルダは%sで書く
+            parameters (tuple): SQLにプレースホルダを使用する場合の値を格納したリスト
+            tuples (bool): 真なら行をタプルで返すcursorで実行する
+
+        Returns:
+            bool: 成功したら真を返す。
+
+        """
+        if not Config.DB_PREPARE_STATEMENTS:
+            return self.execute(sql, parameters, tuples=tuples)
+        name = self.__table_name + "_" + name
+        parameters = tuple(parameters) if parameters else ()
+        prepared_statements = self.__db.prepared_statements
+        if name not in prepared_statements:
+            placeholders = tuple("$" + str(i + 1) for i in range(len(parameters)))
+            self.execute("PREPARE " + name + " AS " + sql % placeholders)
+            prepared_statements.add(name)
+        state = "EXECUTE " + name
+        if parameters:
+            state += " (" + ",".join(["%s"] * len(parameters)) + ")"
+        return self.execute(state + ";", parameters, tuples=tuples)
+
+    def stream(self, sql: str, parameters: tuple = None, itersize: int = None):
+        """サーバー側の名前付きcursorで検索し、結果の行を順に返す。
+
+        結果をitersize件ずつ取り寄せるので、件数にかかわらず使用するメモリは
+        一定になる。最後まで反復するか、ジェネレータを閉じるとcursorを閉じる。
+
+        Args:
+            sql (str): SQL文
+            parameters (tuple): SQLにプレースホルダを使用する場合の値を格納したリスト
+            itersize (int): 1回に取り寄せる行数。省略した場合は設定値
+
+        Yields:
+            row (tuple): 検索結果の行
+
+        """
+        if itersize is None:
+            itersize = Config.STREAM_ITERSIZE
+        cursor = self.__db.named_cursor(
+            self.__table_name + "_" + uuid.uuid4().hex, itersize
+        )
+        try:
+            try:
+                cursor.execute(sql, parameters)
+            except (
+                psycopg2.DataError,
+                psycopg2.IntegrityError,
+                psycopg2.InternalError,
+            ) as e:
+                raise DataError(e.args[0])
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+    def execute_values(self, sql: str, values: list) -> bool:
+        """psycopg2.extrasのexecute_values関数のラッパー。
+
+        Args:
+            sql (str): VALUES句のプレースホルダを%sとしたSQL文
+            values (list of tuples): VALUES句に展開する行の値のリスト
+
+        Returns:
+            bool: 成功したら真を返す。
+
+        """
+        try:
+            execute_values(self.cursor, sql, values, page_size=len(values))
+            return True
+        except (
+            psycopg2.DataError,
+            psycopg2.IntegrityError,
+            psycopg2.InternalError,
+        ) as e:
+            raise DataError(e.args[0])
+
+    def upsert_many(
+        self,
+        items,
+        columns: list,
+        key: str,
+        get_values,
+        chunk_size: int = None,
+        table_name: str = None,
+    ) -> int:
+        """複数行のVALUES句を持つINSERT文でデータをまとめて保存する。
+
+        chunk_size件ごとに1回のINSERT文でまとめて保存する。まとめて保存できなかった
+        場合はその範囲だけ1件ずつ保存し直し、保存できなかったデータのエラーを
+        ログに出力する。
+
+        Args:
+            items (iterable): 保存するデータのオブジェクト
+            columns (list of str): 保存する列名のリスト
+            key (str): ON CONFLICT句に指定する一意な列名
+            get_values (callable): オブジェクトを受け取り、列名の順に並べた値の
+                タプルを返す関数
+            chunk_size (int): 1回のINSERT文で保存する件数
+            table_name (str): 保存先のテーブル名。省略した場合はサービスの
+                テーブル
+
+        Returns:
+            count (int): 保存できたデータの件数
+
+        """
+        if table_name is None:
+            table_name = self.table_name
+        if chunk_size is None:
+            chunk_size = Config.BULK_INSERT_CHUNK_SIZE
+        chunk_size = max(int(chunk_size), 1)
+        upsert = ",".join(column + "=EXCLUDED." + column for column in columns)
+        state = (
+            "INSERT INTO "
+            + table_name
+            + " ("
+            + ",".join(columns)
+            + ") VALUES %s ON CONFLICT("
+            + key
+            + ") DO UPDATE SET "
+            + upsert
+        )
+        key_index = columns.index(key)
+
+        count = 0
+        chunk = list()
+        for item in items:
+            chunk.append((item, get_values(item)))
+            if len(chunk) == chunk_size:
+                count += self.__upsert_chunk(state, key_index, chunk)
+                chunk = list()
+        if chunk:
+            count += self.__upsert_chunk(state, key_index, chunk)
+        return count
+
+    def __upsert_chunk(self, state: str, key_index: int, chunk: list) -> int:
+        # 同じINSERT文で同じ行を2回更新できないので、1件ずつ保存した場合と同じく
+        # 後のデータを優先して重複を除く。
+        rows = dict()
+        for _, values in chunk:
+            rows.pop(values[key_index], None)
+            rows[values[key_index]] = values
+
+        self.execute("SAVEPOINT upsert_many;")
+        try:
+            self.execute_values(state, list(rows.values()))
+            self.execute("RELEASE SAVEPOINT upsert_many;")
+            return len(chunk)
+        except DataError:
+            self.execute("ROLLBACK TO SAVEPOINT upsert_many;")
+
+        count = 0
+        for item, values in chunk:
+            self.execute("SAVEPOINT upsert_one;")
+            try:
+                self.execute_values(state, [values])
+                self.execute("RELEASE SAVEPOINT upsert_one;")
+                count += 1
+            except DataError as e:
+                self.execute("ROLLBACK TO SAVEPOINT upsert_one;")
+                self.error_log(e.message)
+        return count
+
+    def create_staging_table(self) -> None:
+        """テーブルと同じ定義で差し替え用の空のテーブルを作成する。
+
+        差し替え用のテーブルへの保存中は元のテーブルをロックしないので、
+        データの取り込み中も検索を妨げない。
+
+        """
+        self.execute("DROP TABLE IF EXISTS " + self.staging_table_name + ";")
+        self.execute(
+            "CREATE TABLE "
+            + self.staging_table_name
+            + " (LIKE "
+            + self.table_name
+            + " INCLUDING ALL);"
+        )
+
+    def swap_staging_table(self, lock_timeout: str = None, retries: int = None) -> None:
+        """差し替え用のテーブルを元のテーブルと入れ替え、元のテーブルを削除する。
+
+        テーブル名の変更だけで入れ替えるので、テーブルをロックする時間は
+        データの件数によらず一定になる。ロックを取得できない場合は入れ替えを
+        取り消し、間隔を空けて再試行する。
+
+        Args:
+            lock_timeout (str): ロックの取得を待つ時間
+            retries (int): ロックを取得できなかった場合に再試行する回数
+
+        """
+        if lock_timeout is None:
+            lock_timeout = Config.SWAP_LOCK_TIMEOUT
+        if retries is None:
+            retries = Config.SWAP_RETRIES
+        old_table_name = self.table_name + "_old"
+
+        # 連番の列のシーケンスは元のテーブルが所有しているので、元のテーブルを
+        # 削除する前に差し替え用のテーブルへ所有者を移す。
+        self.execute(
+            "SELECT column_name,pg_get_serial_sequence(%s,column_name) AS sequence "
+            + "FROM information_schema.columns WHERE table_name=%s "
+            + "AND table_schema=current_schema();",
+            (self.table_name, self.table_name),
+        )
+        sequences = [
+            (row["column_name"], row["sequence"])
+            for row in self.fetchall()
+            if row["sequence"] is not None
+        ]
+
+        # 待つ時間を短くするのは入れ替えの間だけなので、元の値を控えておく。
+        self.execute("SELECT current_setting('lock_timeout') AS lock_timeout;")
+        previous_lock_timeout = self.fetchall()[0]["lock_timeout"]
+
+        for attempt in range(retries + 1):
+            self.execute("SAVEPOINT swap_table;")
+            try:
+                self.cursor.execute("SET LOCAL lock_timeout=%s;", (lock_timeout,))
+                self.cursor.execute(
+                    "ALTER TABLE " + self.table_name + " RENAME TO " + old_table_name
+                )
+                break
+            except psycopg2.errors.LockNotAvailable:
+                self.execute("ROLLBACK TO SAVEPOINT swap_table;")
+                if attempt == retries:
+                    raise DataError(
+                        self.table_name + "テーブルをロックできませんでした。"
+                    )
+                time.sleep(0.1 * 2**attempt)
+        # SET LOCALの値はセーブポイントを解放してもトランザクションの終わりまで
+        # 残り、この後の取り込みの処理も短い時間でタイムアウトしてしまう。
+        self.execute("SET LOCAL lock_timeout=%s;", (previous_lock_timeout,))
+
+        self.execute(
+            "ALTER TABLE " + self.staging_table_name + " RENAME TO " + self.table_name
+        )
+        for column_name, sequence in sequences:
+            self.execute(
+                "ALTER SEQUENCE "
+                + sequence
+                + " OWNED BY "
+                + self.table_name
+                + "."
+                + column_name
+                + ";"
+            )
+        self.execute("DROP TABLE " + old_table_name + ";")
+        self.execute("RELEASE SAVEPOINT swap_table;")
+
+        # 差し替え用のテーブルの名前で作られたインデックスを元の名前に戻す。
+        self.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename=%s "
+            + "AND schemaname=current_schema();",
+            (self.table_name,),
+        )
+        for row in self.fetchall():
+            index_name = row["indexname"]
+            if index_name.startswith(self.staging_table_name):
+                self.execute(
+                    "ALTER INDEX "
+                    + index_name
+                    + " RENAME TO "
+                    + self.table_name
+                    + index_name[len(self.staging_table_name) :]
+                    + ";"
+                )
+        self.info_log(self.table_name + "テーブルを差し替えました。")
+
     def truncate(self) -> None:
         """テーブルのデータを全削除"""
         state = "TRUNCATE TABLE " + self.table_name + " RESTART IDENTITY;"
         self.execute(state)
         self.info_log(self.table_name + "テーブルを初期化しました。")
 
-    def fetchall(self) -> list:
+    def fetchall(self, tuples: bool = False) -> list:
         """cursorオブジェクトのfetchallメソッドのラッパー。
 
+        Args:
+            tuples (bool): 真なら行をタプルで返すcursorの検索結果を返す
+
         Returns:
-            results (list of :obj:`DictCursor`): 検索結果のリスト
+            results (list of :obj:`DictRow` or tuples): 検索結果のリスト
 
         """
+        if tuples:
+            return self.tuple_cursor.fetchall()
         return self.cursor.fetchall()
 
     def info_log(self, message) -> None:
@@ -112,18 +418,23 @@ class EvacuationSiteService(Service):
         """
         Service.__init__(self, db=db, table_name="evacuation_sites")
 
-    def _get_objects(self) -> list:
+    def _get_objects(self, tuples: bool = False) -> list:
         """検索結果から避難場所データのリストを作成する。
 
+        Args:
+            tuples (bool): 真なら行をタプルで返すcursorの検索結果から作成する。
+                列はEvacuationSiteFactory.COLUMNSの順に並んでいなければならない
+
         Returns:
             sites (list of obj:`EvacuationSite`): 検索結果の避難場所
                 オブジェクトのリスト
 
         """
-        results = self.fetchall()
         factory = EvacuationSiteFactory()
-        for row in results:
-            factory.create(**row)
+        if tuples:
+            factory.create_many_from_tuples(self.fetchall(tuples=True))
+        else:
+            factory.create_many(self.fetchall())
         return factory.items
 
     def create(self, evacuation_site: EvacuationSite) -> bool:
@@ -154,6 +465,10 @@ class EvacuationSiteService(Service):
             column_names += "," + item
             place_holders += ",%s"
             upsert += "," + item + "=%s"
+        # 町域名は郵便番号から引いて一緒に保存する。
+        column_names += ",area_name"
+        place_holders += ",(SELECT area_name FROM area_addresses WHERE postal_code=%s)"
+        upsert += ",area_name=EXCLUDED.area_name"
 
         state = (
             "INSERT INTO"
@@ -183,7 +498,7 @@ class EvacuationSiteService(Service):
             datetime.now(timezone(timedelta(hours=+9))),
         ]
         # UPDATE句用に登録データ配列を重複させる
-        values = tuple(temp_values + temp_values)
+        values = tuple(temp_values + [evacuation_site.postal_code] + temp_values)
 
         try:
             self.execute(state, values)
@@ -192,6 +507,105 @@ class EvacuationSiteService(Service):
             self.error_log(e.message)
             return False
 
+    def create_many(
+        self, evacuation_sites, chunk_size: int = None, staging: bool = False
+    ) -> int:
+        """データベースへ複数の避難場所データをまとめて保存
+
+        Args:
+            evacuation_sites (iterable of obj:`EvacuationSite`): 避難場所データの
+                オブジェクト
+            chunk_size (int): 1回のINSERT文で保存する件数
+            staging (bool): 真なら差し替え用のテーブルに保存する
+
+        Returns:
+            count (int): 登録できた避難場所データの件数
+
+        """
+        updated_at = datetime.now(timezone(timedelta(hours=+9)))
+        count = self.upsert_many(
+            evacuation_sites,
+            columns=[
+                "site_id",
+                "site_name",
+                "postal_code",
+                "address",
+                "phone_number",
+                "latitude",
+                "longitude",
+                "updated_at",
+            ],
+            key="site_id",
+            get_values=lambda evacuation_site: (
+                evacuation_site.site_id,
+                evacuation_site.site_name,
+                evacuation_site.postal_code,
+                evacuation_site.address,
+                evacuation_site.phone_number,
+                evacuation_site.latitude,
+                evacuation_site.longitude,
+                updated_at,
+            ),
+            chunk_size=chunk_size,
+            table_name=self.staging_table_name if staging else None,
+        )
+        self.update_area_names(staging=staging)
+        return count
+
+    def sync(self, evacuation_sites) -> tuple:
+        """避難場所データと保存済みのデータを比べ、変わった分だけ保存する。
+
+        連番ごとに連番以外の値のハッシュ値を比べ、新しいか値の変わった
+        避難場所だけ保存し、渡したデータにない避難場所は削除する。
+
+        Args:
+            evacuation_sites (iterable of obj:`EvacuationSite`): 取り込む
+                全ての避難場所データのオブジェクト
+
+        Returns:
+            counts (tuple): 保存できた件数と削除した件数のタプル
+
+        """
+        content_hashes = {site.site_id: site.content_hash for site in self.iter_all()}
+        changed_sites = list()
+        site_ids = set()
+        for evacuation_site in evacuation_sites:
+            site_ids.add(evacuation_site.site_id)
+            content_hash = content_hashes.get(evacuation_site.site_id)
+            if content_hash != evacuation_site.content_hash:
+                changed_sites.append(evacuation_site)
+        deleted_site_ids = sorted(set(content_hashes) - site_ids)
+
+        count = self.create_many(changed_sites) if changed_sites else 0
+        if deleted_site_ids:
+            self.execute(
+                "DELETE FROM " + self.table_name + " WHERE site_id=ANY(%s);",
+                (deleted_site_ids,),
+            )
+        return count, len(deleted_site_ids)
+
+    def update_area_names(self, staging: bool = False) -> None:
+        """避難場所ごとに郵便番号から町域名を引いて保存し直す。
+
+        町域の検索で北海道全域の郵便番号のテーブルを毎回結合しないよう、
+        避難場所のテーブルに町域名を持たせておく。町域名が変わる避難場所だけ
+        更新する。
+
+        Args:
+            staging (bool): 真なら差し替え用のテーブルを更新する
+
+        """
+        table_name = self.staging_table_name if staging else self.table_name
+        self.execute(
+            "UPDATE "
+            + table_name
+            + " AS sites SET area_name=area_addresses.area_name FROM "
+            + table_name
+            + " AS old_sites LEFT JOIN area_addresses ON old_sites.postal_code="
+            + "area_addresses.postal_code WHERE sites.site_id=old_sites.site_id "
+            + "AND sites.area_name IS DISTINCT FROM area_addresses.area_name;"
+        )
+
     def get_all(self) -> list:
         """避難場所全件データのリストを返す。
 
@@ -203,8 +617,137 @@ class EvacuationSiteService(Service):
             "SELECT site_id,site_name,postal_code,address,phone_number,latitude,"
             + "longitude FROM evacuation_sites ORDER BY site_id;"
         )
-        self.execute(state)
-        return self._get_objects()
+        self.execute(state, tuples=True)
+        return self._get_objects(tuples=True)
+
+    def iter_all(self, itersize: int = None):
+        """避難場所全件データを1件ずつ返す。
+
+        サーバー側のcursorで読み込むので、件数にかかわらず使用するメモリは一定になる。
+
+        Args:
+            itersize (int): 1回に取り寄せる行数。省略した場合は設定値
+
+        Returns:
+            sites (generator): 避難場所連番順に避難場所オブジェクトを返すジェネレータ
+
+        """
+        state = (
+            "SELECT site_id,site_name,postal_code,address,phone_number,latitude,"
+            + "longitude FROM evacuation_sites ORDER BY site_id;"
+        )
+        factory = EvacuationSiteFactory()
+        return factory.iter_from_tuples(self.stream(state, itersize=itersize))
+
+    def get_site_table(self) -> SiteTable:
+        """避難場所全件データを列ごとの配列の表で返す。
+
+        避難場所ごとのオブジェクトを作らないので、全件を保持するスナップショットの
+        作成に使う。
+
+        Returns:
+            table (obj:`SiteTable`): 避難場所連番順の避難場所の表
+
+        """
+        state = (
+            "SELECT site_id,site_name,postal_code,address,phone_number,latitude,"
+            + "longitude FROM evacuation_sites ORDER BY site_id;"
+        )
+        self.execute_prepared("get_site_table", state, tuples=True)
+        factory = SiteTableFactory()
+        factory.create_many_from_tuples(self.fetchall(tuples=True))
+        return factory.table
+
+    def build_nearest_grid(self) -> bool:
+        """
+        現在のトランザクションから見える避難場所データで、最寄りの避難場所の
+        候補の格子のファイルを作り直す。
+
+        格子は避難場所の連番と緯度経度が作成した時と同じ場合だけ使うので、
+        避難場所を変更した取り込みでは格子も作り直す。
+
+        Returns:
+            built (bool): 作り直したら真。格子のファイルのパスが設定されて
+                いなければ偽
+
+        """
+        if not Config.NEAREST_GRID_PATH:
+            return False
+        build_nearest_grid(self.get_site_table())
+        return True
+
+    def get_generation(self) -> tuple:
+        """
+        避難場所と町域のデータの世代を返す。
+
+        データを取り込むと件数か最終更新日時のどちらかが変わるので、
+        キャッシュを作り直すかどうかの判定に使う。
+
+        Returns:
+            generation (tuple): 避難場所と町域のそれぞれの件数と最終更新日時のタプル
+
+        """
+        state = (
+            "SELECT site_count,sites_updated_at,area_count,areas_updated_at FROM "
+            + "(SELECT COUNT(*) AS site_count,MAX(updated_at) AS sites_updated_at "
+            + "FROM evacuation_sites) AS sites,"
+            + "(SELECT COUNT(*) AS area_count,MAX(updated_at) AS areas_updated_at "
+            + "FROM area_addresses) AS areas;"
+        )
+        # ワーカーが確認の間隔ごとに繰り返し実行するので、接続ごとにPREPAREしておく。
+        self.execute_prepared("get_generation", state)
+        return tuple(self.fetchall()[0])
+
+    def get_site_area_names(self) -> dict:
+        """
+        避難場所ごとの住所の町域名を返す。
+
+        Returns:
+            site_area_names (dict): 避難場所連番をキー、町域名を値とする辞書
+
+        """
+        state = "SELECT site_id,area_name FROM evacuation_sites;"
+        site_area_names = dict()
+        self.execute_prepared("get_site_area_names", state)
+        for row in self.fetchall():
+            site_area_names[row["site_id"]] = row["area_name"]
+        return site_area_names
+
+    def load_snapshot(self, generation: tuple = None) -> SiteSnapshot:
+        """
+        データベースから避難場所スナップショットを作成する。
+
+        Args:
+            generation (tuple): 作成するスナップショットのデータの世代。省略した
+                場合はデータベースに問い合わせる
+
+        Returns:
+            snapshot (obj:`SiteSnapshot`): 避難場所スナップショット
+
+        """
+        if generation is None:
+            generation = self.get_generation()
+        return SiteSnapshot(
+            generation=generation,
+            sites=self.get_site_table(),
+            site_area_names=self.get_site_area_names(),
+            area_names=self.get_area_names(),
+            nearest_grid=open_nearest_grid(),
+        )
+
+    def get_snapshot(self) -> SiteSnapshot:
+        """
+        プロセス内で共有する避難場所スナップショットを返す。
+
+        ビューと同じく設定した間隔でデータの世代を確認し、世代が変わっていれば
+        スナップショットを作り直す。スナップショットはプロセス内の他の接続とも
+        共有するので、書き込み中のトランザクションでは使わない。
+
+        Returns:
+            snapshot (obj:`SiteSnapshot`): 避難場所スナップショット
+
+        """
+        return site_snapshot_cache.get(lambda: self)
 
     def get_near_sites(self, current_location: CurrentLocation) -> list:
         """
@@ -219,26 +762,78 @@ class EvacuationSiteService(Service):
                 避難場所オブジェクトと現在地までの距離のリストを要素に持つ辞書のリスト
 
         """
-        near_sites = list()
-        for site in self.get_all():
-            near_sites.append(
-                {
-                    "order": None,
-                    "site": site,
-                    "distance": current_location.get_distance_to(site),
-                }
-            )
-        near_sites = sorted(near_sites, key=lambda x: x["distance"])[:5]
-        for i in range(len(near_sites)):
-            # 現在地から近い順で連番を付与する。
-            near_sites[i]["order"] = i + 1
-            # 距離を分かりやすくするためキロメートルに変換する。
-            near_sites[i]["distance"] = float(
-                Decimal(str(near_sites[i]["distance"] / 1000)).quantize(
-                    Decimal("0.1"), rounding=ROUND_HALF_UP
-                )
-            )
-        return near_sites
+        return self.get_snapshot().get_near_sites(current_location)
+
+    def get_near_sites_many(self, locations, k: int = 5):
+        """
+        複数の地点について、それぞれ直線距離で最も近い避難場所上位k件の
+        避難場所データのリストを返す。
+
+        避難場所全件を一度だけ読み込み、地点をまとめて配列演算で処理する。
+
+        Args:
+            locations (array_like): 緯度と経度の組の配列
+            k (int): 地点ごとに返す避難場所の件数
+
+        Returns:
+            near_sites_many (generator): 地点ごとに、get_near_sitesと同じ形式の
+                避難場所データのリストを順に返すジェネレータ
+
+        """
+        return self.get_snapshot().get_near_sites_many(locations, k)
+
+    def find_within_radius(self, current_location: CurrentLocation, radius) -> list:
+        """
+        現在地から指定した距離以内にある避難場所データのリストを近い順に返す。
+
+        Args:
+            current_location (obj:`CurrentLocation`): 現在地の緯度経度情報を持つ
+                オブジェクト
+            radius (float): 探索する距離（キロメートル）
+
+        Returns:
+            near_sites (list of dicts): get_near_sitesと同じ形式の避難場所データの
+                リスト
+
+        """
+        return self.get_snapshot().find_within_radius(current_location, radius)
+
+    def find_in_bbox(self, south, west, north, east) -> list:
+        """
+        緯度経度の矩形の範囲内にある避難場所を返す。
+
+        Args:
+            south (float): 南端の緯度
+            west (float): 西端の経度
+            north (float): 北端の緯度
+            east (float): 東端の経度
+
+        Returns:
+            evacuation_site (list of obj:`EvacuationSite`): 範囲内にある避難場所の
+                避難場所連番順のリスト
+
+        """
+        return self.get_snapshot().find_in_bbox(south, west, north, east)
+
+    def get_clusters(self, south, west, north, east, zoom, max_cells=None) -> tuple:
+        """
+        表示範囲内の避難場所を地図のズームレベルに応じてまとめて返す。
+
+        Args:
+            south (float): 南端の緯度
+            west (float): 西端の経度
+            north (float): 北端の緯度
+            east (float): 東端の経度
+            zoom (int): 地図のズームレベル
+            max_cells (int): まとまりを作るセルの数の上限
+
+        Returns:
+            zoom, clusters (tuple): まとめたズームレベルと、まとまりの辞書のリスト
+
+        """
+        return self.get_snapshot().get_clusters(
+            south, west, north, east, zoom, max_cells
+        )
 
     def find_by_site_id(self, site_id) -> list:
         """
@@ -255,8 +850,8 @@ class EvacuationSiteService(Service):
             "SELECT site_id,site_name,postal_code,address,phone_number,latitude,"
             + "longitude FROM evacuation_sites WHERE site_id=%s;"
         )
-        self.execute(state, (str(site_id),))
-        return self._get_objects()
+        self.execute_prepared("find_by_site_id", state, (str(site_id),), tuples=True)
+        return self._get_objects(tuples=True)
 
     def get_area_names(self) -> list:
         """
@@ -266,13 +861,9 @@ class EvacuationSiteService(Service):
             area_names (list): 避難場所の住所の町域のリスト
 
         """
-        state = (
-            "SELECT DISTINCT ON (area_name) area_name FROM evacuation_sites "
-            + "LEFT JOIN area_addresses ON evacuation_sites.postal_code="
-            + "area_addresses.postal_code;"
-        )
+        state = "SELECT DISTINCT ON (area_name) area_name FROM evacuation_sites;"
         area_names = list()
-        self.execute(state)
+        self.execute_prepared("get_area_names", state)
         for row in self.fetchall():
             area_names.append(row["area_name"])
         return area_names
@@ -290,13 +881,35 @@ class EvacuationSiteService(Service):
 
         """
         state = (
-            "SELECT site_id,site_name,evacuation_sites.postal_code,address,"
-            + "phone_number,latitude,longitude FROM evacuation_sites "
-            + "LEFT JOIN area_addresses ON evacuation_sites.postal_code="
-            + "area_addresses.postal_code WHERE area_name=%s;"
+            "SELECT site_id,site_name,postal_code,address,phone_number,latitude,"
+            + "longitude FROM evacuation_sites WHERE area_name=%s;"
+        )
+        self.execute_prepared("find_by_area_name", state, (area_name,), tuples=True)
+        return self._get_objects(tuples=True)
+
+    def iter_by_area_name(self, area_name, itersize: int = None):
+        """
+        町域名から避難場所を検索し、1件ずつ返す。
+
+        サーバー側のcursorで読み込むので、件数にかかわらず使用するメモリは一定になる。
+
+        Args:
+            area_name (str): 町域名
+            itersize (int): 1回に取り寄せる行数。省略した場合は設定値
+
+        Returns:
+            area_sites (generator): 指定した町域名の避難場所の避難場所オブジェクトを
+                返すジェネレータ
+
+        """
+        state = (
+            "SELECT site_id,site_name,postal_code,address,phone_number,latitude,"
+            + "longitude FROM evacuation_sites WHERE area_name=%s;"
+        )
+        factory = EvacuationSiteFactory()
+        return factory.iter_from_tuples(
+            self.stream(state, (area_name,), itersize=itersize)
         )
-        self.execute(state, (area_name,))
-        return self._get_objects()
 
     def find_by_site_name(self, site_name) -> list:
         """
@@ -314,8 +927,8 @@ class EvacuationSiteService(Service):
             "SELECT site_id,site_name,postal_code,address,phone_number,latitude,"
             + "longitude FROM evacuation_sites WHERE site_name LIKE %s;"
         )
-        self.execute(state, (site_name,))
-        return self._get_objects()
+        self.execute_prepared("find_by_site_name", state, (site_name,), tuples=True)
+        return self._get_objects(tuples=True)
 
 
 class AreaAddressService(Service):
@@ -337,10 +950,8 @@ class AreaAddressService(Service):
                 オブジェクトのリスト
 
         """
-        results = self._fetchall()
         factory = AreaAddressFactory()
-        for row in results:
-            factory.create(**row)
+        factory.create_many(self.fetchall())
         return factory.items
 
     def create(self, area_address: AreaAddress) -> bool:
@@ -397,3 +1008,80 @@ class AreaAddressService(Service):
             return True
         except (DatabaseError, DataError):
             return False
+
+    def create_many(self, area_addresses, chunk_size: int = None) -> int:
+        """データベースへ複数の町域と郵便番号データをまとめて保存
+
+        Args:
+            area_addresses (iterable of obj:`AreaAddress`): 町域と郵便番号データの
+                オブジェクト
+            chunk_size (int): 1回のINSERT文で保存する件数
+
+        Returns:
+            count (int): 登録できた町域と郵便番号データの件数
+
+        """
+        updated_at = datetime.now(timezone(timedelta(hours=+9)))
+        return self.upsert_many(
+            area_addresses,
+            columns=["postal_code", "area_name", "updated_at"],
+            key="postal_code",
+            get_values=lambda area_address: (
+                area_address.postal_code,
+                area_address.area_name,
+                updated_at,
+            ),
+            chunk_size=chunk_size,
+        )
+
+
+class DownloadStateService(Service):
+    """ダウンロードしたファイルのETagとLast-Modifiedを保存するサービス"""
+
+    def __init__(self, db):
+        """
+        Args:
+            db (obj:`DB`): psycopg2のメソッドをラップしたメソッドを持つオブジェクト
+
+        """
+        Service.__init__(self, db=db, table_name="download_states")
+
+    def get_validators(self, url: str) -> tuple:
+        """
+        前回ダウンロードした時のETagとLast-Modifiedを返す。
+
+        Args:
+            url (str): ダウンロードしたファイルのURL
+
+        Returns:
+            validators (tuple): ETagとLast-Modifiedのタプル。保存されていない
+                場合はNone
+
+        """
+        self.execute(
+            "SELECT etag,last_modified FROM " + self.table_name + " WHERE url=%s;",
+            (url,),
+        )
+        rows = self.fetchall()
+        if not rows:
+            return None, None
+        return rows[0]["etag"], rows[0]["last_modified"]
+
+    def save_validators(self, url: str, etag: str, last_modified: str) -> None:
+        """
+        ダウンロードした時のETagとLast-Modifiedを保存する。
+
+        Args:
+            url (str): ダウンロードしたファイルのURL
+            etag (str): レスポンスのETag
+            last_modified (str): レスポンスのLast-Modified
+
+        """
+        self.execute(
+            "INSERT INTO "
+            + self.table_name
+            + " (url,etag,last_modified,updated_at) VALUES (%s,%s,%s,%s) "
+            + "ON CONFLICT(url) DO UPDATE SET etag=EXCLUDED.etag,"
+            + "last_modified=EXCLUDED.last_modified,updated_at=EXCLUDED.updated_at;",
+            (url, etag, last_modified, datetime.now(timezone(timedelta(hours=+9)))),
+        )
@@ -0,0 +1,722 @@
+from heapq import heappop, heappush, heapreplace
+
+import numpy as np
+
+from hinanbasho.models import CurrentLocation, SiteTable, get_distances
+
+# get_distance_toと同じ地球半径（メートル）
+EARTH_RADIUS = 6378137.00
+# Webメルカトル図法で表示できる緯度の上限
+MAX_MERCATOR_LATITUDE = 85.0511287798
+
+
+def to_unit_vectors(latitudes, longitudes) -> np.ndarray:
+    """緯度経度の配列を単位球面上の三次元座標の配列に変換する。
+
+    単位球面上の2点間の直線距離（弦の長さ）は大円距離に対して単調増加なので、
+    弦の長さで近傍探索をすれば大円距離で近い順の候補が得られる。
+
+    Args:
+        latitudes (array_like): 緯度の配列
+        longitudes (array_like): 経度の配列
+
+    Returns:
+        vectors (:obj:`numpy.ndarray`): 形状が(n, 3)の三次元座標の配列
+
+    """
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack(
+        (
+            cos_latitudes * np.cos(longitudes),
+            cos_latitudes * np.sin(longitudes),
+            np.sin(latitudes),
+        )
+    )
+
+
+def chord_length(meters: float) -> float:
+    """地表面上の距離（メートル）を単位球面上の弦の長さに変換する。
+
+    Args:
+        meters (float): 地表面上の距離（メートル）
+
+    Returns:
+        chord (float): 単位球面上の弦の長さ
+
+    """
+    return 2.0 * np.sin(min(meters / EARTH_RADIUS, np.pi) / 2.0)
+
+
+def to_web_mercator(latitudes, longitudes) -> tuple:
+    """緯度経度をWebメルカトル図法の0から1の範囲の座標に変換する。
+
+    Args:
+        latitudes (array_like): 緯度の配列
+        longitudes (array_like): 経度の配列
+
+    Returns:
+        x, y (tuple of :obj:`numpy.ndarray`): 西端を0とするx座標と、北端を0と
+            するy座標の配列
+
+    """
+    latitudes = np.clip(
+        np.asarray(latitudes, dtype=np.float64),
+        -MAX_MERCATOR_LATITUDE,
+        MAX_MERCATOR_LATITUDE,
+    )
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    x = (longitudes + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(latitudes) / 2)) / (2 * np.pi)
+    return np.clip(x, 0.0, 1.0), np.clip(y, 0.0, 1.0)
+
+
+def get_top_k(values, k: int) -> np.ndarray:
+    """値の小さい順にk個の要素の添字を返す。
+
+    np.argpartitionで上位k件を絞り込んでから並べ替えるので、全件を並べ替えるより
+    速い。値が同じ要素は添字の小さい順に並べる。
+
+    Args:
+        values (array_like): 値の配列
+        k (int): 返す添字の数
+
+    Returns:
+        indices (:obj:`numpy.ndarray`): 値の小さい順に並べた添字の配列
+
+    """
+    values = np.asarray(values)
+    k = min(int(k), len(values))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(values):
+        # k番目の値と同じ値の要素は全て候補に含め、添字の小さいものを優先する。
+        kth_value = values[np.argpartition(values, k - 1)[:k]].max()
+        candidates = np.flatnonzero(values <= kth_value)
+    else:
+        candidates = np.arange(len(values))
+    order = np.argsort(values[candidates], kind="stable")
+    return candidates[order][:k]
+
+
+class KDTree:
+    """点の集合に対するKD木
+
+    各ノードに含まれる点のバウンディングボックスを保持し、最近傍探索と
+    半径検索、矩形検索で探索範囲を枝刈りする。
+
+    Attributes:
+        size (int): 点の数
+
+    """
+
+    def __init__(self, points, leaf_size: int = 16):
+        """
+        Args:
+            points (array_like): 形状が(n, d)の座標の配列
+            leaf_size (int): 葉ノードに格納する点の最大数
+
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2:
+            points = points.reshape(len(points), -1)
+        self.__leaf_size = max(int(leaf_size), 1)
+        self.__order = np.arange(len(points))
+        self.__starts = list()
+        self.__ends = list()
+        self.__lefts = list()
+        self.__rights = list()
+        self.__mins = list()
+        self.__maxs = list()
+        if len(points) > 0:
+            self.__build(points, 0, len(points))
+        # 葉ノードの点が連続した領域に並ぶよう並べ替えておく。
+        self.__points = points[self.__order]
+
+    @property
+    def size(self) -> int:
+        return len(self.__order)
+
+    def __build(self, points: np.ndarray, start: int, end: int) -> int:
+        node = len(self.__starts)
+        block = points[self.__order[start:end]]
+        mins = block.min(axis=0)
+        maxs = block.max(axis=0)
+        self.__starts.append(start)
+        self.__ends.append(end)
+        self.__lefts.append(-1)
+        self.__rights.append(-1)
+        self.__mins.append(mins)
+        self.__maxs.append(maxs)
+        if end - start > self.__leaf_size:
+            # 最も広がりの大きい次元の中央値で分割する。
+            dimension = int(np.argmax(maxs - mins))
+            middle = (start + end) // 2
+            partition = np.argpartition(block[:, dimension], middle - start)
+            self.__order[start:end] = self.__order[start:end][partition]
+            self.__lefts[node] = self.__build(points, start, middle)
+            self.__rights[node] = self.__build(points, middle, end)
+        return node
+
+    def __min_distance(self, node: int, point: np.ndarray) -> float:
+        gaps = np.maximum(self.__mins[node] - point, point - self.__maxs[node])
+        return float(np.sqrt(np.square(np.maximum(gaps, 0.0)).sum()))
+
+    def __leaf_distances(self, node: int, point: np.ndarray) -> np.ndarray:
+        block = self.__points[self.__starts[node] : self.__ends[node]]
+        return np.sqrt(np.square(block - point).sum(axis=1))
+
+    def query(self, point, k: int = 1) -> tuple:
+        """指定した点から近い順にk個の点を探索する。
+
+        Args:
+            point (array_like): 探索の基準となる座標
+            k (int): 探索する点の数
+
+        Returns:
+            distances, indices (tuple of :obj:`numpy.ndarray`): 近い順に並べた
+                距離と、コンストラクタに渡した配列上の点の添字
+
+        """
+        point = np.asarray(point, dtype=np.float64)
+        k = min(int(k), self.size)
+        if k <= 0:
+            return np.empty(0), np.empty(0, dtype=np.intp)
+
+        # 暫定の上位k件を距離の符号を反転した最大ヒープで保持する。
+        best = list()
+        nodes = [(0.0, 0)]
+        while nodes:
+            bound, node = heappop(nodes)
+            if len(best) == k and bound > -best[0][0]:
+                break
+            if self.__lefts[node] < 0:
+                start = self.__starts[node]
+                distances = self.__leaf_distances(node, point)
+                for i, distance in enumerate(distances.tolist()):
+                    if len(best) < k:
+                        heappush(best, (-distance, start + i))
+                    elif distance < -best[0][0]:
+                        heapreplace(best, (-distance, start + i))
+            else:
+                for child in (self.__lefts[node], self.__rights[node]):
+                    heappush(nodes, (self.__min_distance(child, point), child))
+
+        best = sorted((-distance, position) for distance, position in best)
+        distances = np.array([distance for distance, _ in best])
+        positions = np.array([position for _, position in best], dtype=np.intp)
+        return distances, self.__order[positions]
+
+    def query_radius(self, point, radius: float) -> tuple:
+        """指定した点から半径radius以内にある点を全て探索する。
+
+        Args:
+            point (array_like): 探索の基準となる座標
+            radius (float): 探索する半径
+
+        Returns:
+            distances, indices (tuple of :obj:`numpy.ndarray`): 距離と、
+                コンストラクタに渡した配列上の点の添字（順不同）
+
+        """
+        point = np.asarray(point, dtype=np.float64)
+        found_distances = list()
+        found_positions = list()
+        nodes = [0] if self.size > 0 else []
+        while nodes:
+            node = nodes.pop()
+            if self.__min_distance(node, point) > radius:
+                continue
+            if self.__lefts[node] < 0:
+                distances = self.__leaf_distances(node, point)
+                matches = np.flatnonzero(distances <= radius)
+                found_distances.append(distances[matches])
+                found_positions.append(matches + self.__starts[node])
+            else:
+                nodes.append(self.__lefts[node])
+                nodes.append(self.__rights[node])
+
+        if not found_positions:
+            return np.empty(0), np.empty(0, dtype=np.intp)
+        return (
+            np.concatenate(found_distances),
+            self.__order[np.concatenate(found_positions)],
+        )
+
+    def query_box(self, mins, maxs) -> np.ndarray:
+        """各次元の座標が指定した範囲内にある点を全て探索する。
+
+        矩形に完全に含まれるノードは点ごとの比較をせずにまとめて返すので、
+        計算量は点の総数ではなく見つかった点の数にほぼ比例する。
+
+        Args:
+            mins (array_like): 各次元の座標の下限
+            maxs (array_like): 各次元の座標の上限
+
+        Returns:
+            indices (:obj:`numpy.ndarray`): コンストラクタに渡した配列上の
+                点の添字（順不同）
+
+        """
+        mins = np.asarray(mins, dtype=np.float64)
+        maxs = np.asarray(maxs, dtype=np.float64)
+        found_positions = list()
+        nodes = [0] if self.size > 0 else []
+        while nodes:
+            node = nodes.pop()
+            if (self.__maxs[node] < mins).any() or (self.__mins[node] > maxs).any():
+                continue
+            start = self.__starts[node]
+            end = self.__ends[node]
+            if (self.__mins[node] >= mins).all() and (self.__maxs[node] <= maxs).all():
+                found_positions.append(np.arange(start, end))
+            elif self.__lefts[node] < 0:
+                block = self.__points[start:end]
+                inside = ((block >= mins) & (block <= maxs)).all(axis=1)
+                found_positions.append(np.flatnonzero(inside) + start)
+            else:
+                nodes.append(self.__lefts[node])
+                nodes.append(self.__rights[node])
+
+        if not found_positions:
+            return np.empty(0, dtype=np.intp)
+        return self.__order[np.concatenate(found_positions)]
+
+
+class SiteIndex:
+    """避難場所の空間インデックス
+
+    避難場所の緯度経度を単位球面上の座標に変換してKD木を作成し、現在地から近い
+    避難場所の探索を避難場所の件数に対して対数時間で行う。地図の表示範囲の
+    検索のため、緯度経度そのものを座標とするKD木も作成する。最寄りの避難場所の
+    候補を格子のセルごとに求めたファイルがあれば、セル内の地点はその候補だけ
+    距離を計算する。
+
+    Attributes:
+        sites (list of :obj:`EvacuationSite`): 避難場所連番順の避難場所
+            オブジェクトのリスト
+        nearest_grid (:obj:`NearestSiteGrid`): 最寄りの避難場所の候補の格子
+
+    """
+
+    # KD木の弦の長さとget_distance_toの計算結果の順位が浮動小数点誤差で
+    # 入れ替わっても取りこぼさないよう、候補を探索する距離に持たせる余裕。
+    MARGIN_METERS = 10.0
+    # 複数地点の探索で、避難場所がこの件数以下なら全件との距離の行列を
+    # 計算する。それより多ければ地点ごとにKD木で探索する。
+    DENSE_SEARCH_MAX_SITES = 2000
+    # 距離の行列を一度に計算する要素数の上限
+    DENSE_SEARCH_MATRIX_SIZE = 2**20
+
+    def __init__(self, sites: list, nearest_grid=None):
+        """
+        Args:
+            sites (list of :obj:`EvacuationSite` or :obj:`SiteTable`): 避難場所
+                連番順の避難場所オブジェクトのリストまたは避難場所の表
+            nearest_grid (:obj:`NearestSiteGrid`): sitesと同じデータから作成した
+                最寄りの避難場所の候補の格子
+
+        """
+        table = SiteTable.from_sites(sites)
+        self.__sites = table if sites is table else list(sites)
+        self.__latitudes = table.latitudes
+        self.__longitudes = table.longitudes
+        self.__tree = KDTree(to_unit_vectors(self.__latitudes, self.__longitudes))
+        self.__box_tree = KDTree(np.column_stack((self.__latitudes, self.__longitudes)))
+        self.__nearest_grid = nearest_grid
+        site_ids = table.site_ids
+        self.__site_id_order = np.argsort(site_ids, kind="stable")
+        self.__sorted_site_ids = site_ids[self.__site_id_order]
+
+    @property
+    def sites(self) -> list:
+        return self.__sites
+
+    @property
+    def nearest_grid(self):
+        return self.__nearest_grid
+
+    def __get_grid_candidates(self, current_location: CurrentLocation, k: int):
+        if self.__nearest_grid is None or k > self.__nearest_grid.k:
+            return None
+        site_ids = self.__nearest_grid.get_candidates(
+            current_location.latitude, current_location.longitude
+        )
+        if site_ids is None:
+            return None
+        positions = np.searchsorted(self.__sorted_site_ids, site_ids)
+        return np.sort(self.__site_id_order[positions])
+
+    def get_nearest(self, current_location: CurrentLocation, k: int = 5) -> list:
+        """
+        現在地から近い順にk件の避難場所と距離を返す。
+
+        距離はget_distance_toで計算し、距離が同じ場合は避難場所連番順に並べるので、
+        全件の距離を計算して並べ替えた場合と同じ結果になる。
+
+        Args:
+            current_location (obj:`CurrentLocation`): 現在地の緯度経度情報を持つ
+                オブジェクト
+            k (int): 返す避難場所の件数
+
+        Returns:
+            nearest (list of tuples): 避難場所オブジェクトと現在地までの距離
+                （メートル）のタプルのリスト
+
+        """
+        candidates = self.__get_grid_candidates(current_location, k)
+        if candidates is None:
+            point = to_unit_vectors(
+                [current_location.latitude], [current_location.longitude]
+            )[0]
+            distances, indices = self.__tree.query(point, k)
+            if len(indices) == 0:
+                return list()
+
+            # k番目の候補と同じ距離に丸められる避難場所も拾えるよう余裕を持たせて
+            # 半径検索し、候補だけ正確な距離を計算して並べ替える。
+            radius = distances[-1] + chord_length(self.MARGIN_METERS)
+            _, candidates = self.__tree.query_radius(point, radius)
+            candidates = np.sort(candidates)
+        return self.get_nearest_from(current_location, candidates, k)
+
+    def get_nearest_from(
+        self, current_location: CurrentLocation, candidates, k: int = 5
+    ) -> list:
+        """
+        候補の避難場所だけ距離を計算し、現在地から近い順にk件の避難場所と距離を返す。
+
+        Args:
+            current_location (obj:`CurrentLocation`): 現在地の緯度経度情報を持つ
+                オブジェクト
+            candidates (:obj:`numpy.ndarray`): 候補の避難場所の添字の昇順の配列。
+                現在地から近い順にk件の避難場所を全て含んでいなければならない
+            k (int): 返す避難場所の件数
+
+        Returns:
+            nearest (list of tuples): 避難場所オブジェクトと現在地までの距離
+                （メートル）のタプルのリスト
+
+        """
+        candidate_distances = current_location.get_distances_to(
+            self.__latitudes[candidates], self.__longitudes[candidates]
+        )
+        nearest = list()
+        for i in get_top_k(candidate_distances, k).tolist():
+            nearest.append((self.__sites[candidates[i]], float(candidate_distances[i])))
+        return nearest
+
+    def get_cell_candidates(
+        self, south: float, west: float, north: float, east: float, k: int = 5
+    ) -> np.ndarray:
+        """
+        緯度経度の矩形の中のどの地点についても、近い順にk件の避難場所を必ず含む
+        候補を返す。
+
+        矩形の中心から近い順にk番目の避難場所までの距離に、中心から角までの距離の
+        2倍と余裕を足した距離以内の避難場所を候補とする。
+
+        Args:
+            south (float): 南端の緯度
+            west (float): 西端の経度
+            north (float): 北端の緯度
+            east (float): 東端の経度
+            k (int): 候補を求める避難場所の件数
+
+        Returns:
+            candidates (:obj:`numpy.ndarray`): 候補の避難場所の添字の昇順の配列
+
+        """
+        center_latitude = (south + north) / 2
+        center_longitude = (west + east) / 2
+        half_diagonal = float(
+            get_distances(
+                center_latitude,
+                center_longitude,
+                [south, south, north, north],
+                [west, east, west, east],
+            ).max()
+        )
+        point = to_unit_vectors([center_latitude], [center_longitude])[0]
+        distances, indices = self.__tree.query(point, k)
+        if len(indices) == 0:
+            return indices
+        # 弦の長さを地表面上の距離に戻してから半径を広げる。
+        kth_meters = 2 * EARTH_RADIUS * np.arcsin(min(distances[-1] / 2, 1.0))
+        radius = chord_length(kth_meters + 2 * half_diagonal + self.MARGIN_METERS)
+        _, candidates = self.__tree.query_radius(point, radius)
+        return np.sort(candidates)
+
+    def get_nearest_many(self, latitudes, longitudes, k: int = 5):
+        """
+        複数の地点について、それぞれ近い順にk件の避難場所と距離を返す。
+
+        地点を一定数ごとに区切って処理するジェネレータなので、地点の数が多くても
+        使用するメモリは一定になる。各地点の結果はget_nearestと同じになる。
+
+        Args:
+            latitudes (array_like): 地点の緯度の配列
+            longitudes (array_like): 地点の経度の配列
+            k (int): 地点ごとに返す避難場所の件数
+
+        Yields:
+            nearest (list of tuples): 避難場所オブジェクトと地点までの距離
+                （メートル）のタプルのリスト
+
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64).reshape(-1)
+        longitudes = np.asarray(longitudes, dtype=np.float64).reshape(-1)
+        if len(self.__sites) > self.DENSE_SEARCH_MAX_SITES:
+            for latitude, longitude in zip(latitudes.tolist(), longitudes.tolist()):
+                yield self.get_nearest(CurrentLocation(latitude, longitude), k)
+            return
+
+        chunk_size = max(self.DENSE_SEARCH_MATRIX_SIZE // max(len(self.__sites), 1), 1)
+        for start in range(0, len(latitudes), chunk_size):
+            distances = get_distances(
+                latitudes[start : start + chunk_size, np.newaxis],
+                longitudes[start : start + chunk_size, np.newaxis],
+                self.__latitudes[np.newaxis, :],
+                self.__longitudes[np.newaxis, :],
+            )
+            for row in distances:
+                yield [
+                    (self.__sites[i], float(row[i])) for i in get_top_k(row, k).tolist()
+                ]
+
+    def get_within_radius(
+        self, current_location: CurrentLocation, meters: float
+    ) -> list:
+        """
+        現在地から指定した距離以内にある避難場所と距離を近い順に返す。
+
+        距離はget_distance_toで計算し、距離が同じ場合は避難場所連番順に並べる。
+
+        Args:
+            current_location (obj:`CurrentLocation`): 現在地の緯度経度情報を持つ
+                オブジェクト
+            meters (float): 探索する距離（メートル）
+
+        Returns:
+            within (list of tuples): 避難場所オブジェクトと現在地までの距離
+                （メートル）のタプルのリスト
+
+        """
+        point = to_unit_vectors(
+            [current_location.latitude], [current_location.longitude]
+        )[0]
+        radius = chord_length(float(meters) + self.MARGIN_METERS)
+        _, candidates = self.__tree.query_radius(point, radius)
+        candidates = np.sort(candidates)
+        candidate_distances = current_location.get_distances_to(
+            self.__latitudes[candidates], self.__longitudes[candidates]
+        )
+        inside = np.flatnonzero(candidate_distances <= meters)
+        within = list()
+        for i in inside[
+            np.argsort(candidate_distances[inside], kind="stable")
+        ].tolist():
+            within.append((self.__sites[candidates[i]], float(candidate_distances[i])))
+        return within
+
+    def get_in_bbox(self, south: float, west: float, north: float, east: float) -> list:
+        """
+        緯度経度の矩形の範囲内にある避難場所を返す。
+
+        西端の経度が東端の経度より大きい場合は、経度180度の線をまたぐ範囲とする。
+
+        Args:
+            south (float): 南端の緯度
+            west (float): 西端の経度
+            north (float): 北端の緯度
+            east (float): 東端の経度
+
+        Returns:
+            sites (list of :obj:`EvacuationSite`): 範囲内にある避難場所の
+                避難場所連番順のリスト
+
+        """
+        if south > north:
+            return list()
+        if west <= east:
+            boxes = [(west, east)]
+        else:
+            boxes = [(west, np.inf), (-np.inf, east)]
+        found = [
+            self.__box_tree.query_box((south, box_west), (north, box_east))
+            for box_west, box_east in boxes
+        ]
+        indices = np.unique(np.concatenate(found))
+        return [self.__sites[i] for i in indices.tolist()]
+
+
+class ClusterIndex:
+    """地図の縮尺ごとに避難場所をまとめる階層的なグリッド
+
+    Webメルカトル図法の地図タイルを縦横に分割したセルごとに避難場所の件数と
+    座標の合計を保持する。最も詳細な縮尺のグリッドを避難場所から作成し、
+    縮尺を1段階下げるごとに隣り合う2×2のセルをまとめる。表示範囲と重なる
+    セルだけを返すので、応答の大きさは避難場所の件数によらず表示範囲の
+    セルの数で決まる。
+
+    Attributes:
+        min_zoom (int): グリッドを作成する最小のズームレベル
+        max_zoom (int): グリッドを作成する最大のズームレベル
+
+    """
+
+    # 地図タイル1枚を縦横それぞれ2のこの数乗個のセルに分割する。
+    # 256ピクセルのタイルなら1セルは64ピクセル四方になる。
+    CELL_BITS = 2
+
+    def __init__(self, sites: list, min_zoom: int = 0, max_zoom: int = 18):
+        """
+        Args:
+            sites (list of :obj:`EvacuationSite` or :obj:`SiteTable`): 避難場所
+                連番順の避難場所オブジェクトのリストまたは避難場所の表
+            min_zoom (int): グリッドを作成する最小のズームレベル
+            max_zoom (int): グリッドを作成する最大のズームレベル
+
+        """
+        table = SiteTable.from_sites(sites)
+        self.__sites = table if sites is table else list(sites)
+        self.__min_zoom = max(int(min_zoom), 0)
+        self.__max_zoom = max(int(max_zoom), self.__min_zoom)
+        latitudes = table.latitudes
+        longitudes = table.longitudes
+        self.__levels = dict()
+        size = self.__get_grid_size(self.__max_zoom)
+        x, y = to_web_mercator(latitudes, longitudes)
+        columns = np.minimum((x * size).astype(np.int64), size - 1)
+        rows = np.minimum((y * size).astype(np.int64), size - 1)
+        level = self.__aggregate(
+            columns,
+            rows,
+            size,
+            np.ones(len(self.__sites), dtype=np.int64),
+            latitudes,
+            longitudes,
+            np.arange(len(self.__sites)),
+        )
+        self.__levels[self.__max_zoom] = level
+        for zoom in range(self.__max_zoom - 1, self.__min_zoom - 1, -1):
+            keys, counts, latitude_sums, longitude_sums, first_indices = level
+            child_size = self.__get_grid_size(zoom + 1)
+            level = self.__aggregate(
+                (keys // child_size) >> 1,
+                (keys % child_size) >> 1,
+                self.__get_grid_size(zoom),
+                counts,
+                latitude_sums,
+                longitude_sums,
+                first_indices,
+            )
+            self.__levels[zoom] = level
+
+    @property
+    def min_zoom(self) -> int:
+        return self.__min_zoom
+
+    @property
+    def max_zoom(self) -> int:
+        return self.__max_zoom
+
+    def __get_grid_size(self, zoom: int) -> int:
+        return 1 << (zoom + self.CELL_BITS)
+
+    def __aggregate(
+        self, columns, rows, size, counts, latitude_sums, longitude_sums, indices
+    ) -> tuple:
+        keys, inverse = np.unique(columns * size + rows, return_inverse=True)
+        first_indices = np.full(len(keys), len(self.__sites), dtype=np.int64)
+        np.minimum.at(first_indices, inverse, indices)
+        return (
+            keys,
+            np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int64),
+            np.bincount(inverse, weights=latitude_sums, minlength=len(keys)),
+            np.bincount(inverse, weights=longitude_sums, minlength=len(keys)),
+            first_indices,
+        )
+
+    def __get_cell_ranges(
+        self, south: float, west: float, north: float, east: float, zoom: int
+    ) -> tuple:
+        size = self.__get_grid_size(zoom)
+        if west <= east:
+            longitude_ranges = [(west, east)]
+        else:
+            longitude_ranges = [(west, 180.0), (-180.0, east)]
+        column_ranges = list()
+        for range_west, range_east in longitude_ranges:
+            x, _ = to_web_mercator([0.0, 0.0], [range_west, range_east])
+            first, last = np.minimum((x * size).astype(np.int64), size - 1).tolist()
+            column_ranges.append((first, last))
+        _, y = to_web_mercator([north, south], [0.0, 0.0])
+        first_row, last_row = np.minimum((y * size).astype(np.int64), size - 1).tolist()
+        return column_ranges, (first_row, last_row)
+
+    def get_clusters(
+        self,
+        south: float,
+        west: float,
+        north: float,
+        east: float,
+        zoom: int,
+        max_cells: int = None,
+    ) -> tuple:
+        """
+        表示範囲内の避難場所をズームレベルに応じてまとめて返す。
+
+        表示範囲のセルの数がmax_cellsを超える場合は、超えなくなるまで
+        ズームレベルを下げてまとめる。
+
+        Args:
+            south (float): 南端の緯度
+            west (float): 西端の経度
+            north (float): 北端の緯度
+            east (float): 東端の経度
+            zoom (int): 地図のズームレベル
+            max_cells (int): 表示範囲のセルの数の上限。省略した場合は制限しない
+
+        Returns:
+            zoom, clusters (tuple): まとめたズームレベルと、まとまりごとの件数、
+                重心の緯度経度、件数が1件の場合はその避難場所オブジェクトを持つ
+                辞書のリスト
+
+        """
+        zoom = min(max(int(zoom), self.__min_zoom), self.__max_zoom)
+        if south > north:
+            return zoom, list()
+        while True:
+            column_ranges, (first_row, last_row) = self.__get_cell_ranges(
+                south, west, north, east, zoom
+            )
+            cells = (last_row - first_row + 1) * sum(
+                last - first + 1 for first, last in column_ranges
+            )
+            if max_cells is None or cells <= max_cells or zoom == self.__min_zoom:
+                break
+            zoom -= 1
+
+        size = self.__get_grid_size(zoom)
+        keys, counts, latitude_sums, longitude_sums, first_indices = self.__levels[zoom]
+        clusters = list()
+        for first_column, last_column in column_ranges:
+            for column in range(first_column, last_column + 1):
+                start, end = np.searchsorted(
+                    keys, [column * size + first_row, column * size + last_row + 1]
+                ).tolist()
+                for i in range(start, end):
+                    count = int(counts[i])
+                    clusters.append(
+                        {
+                            "count": count,
+                            "latitude": float(latitude_sums[i] / count),
+                            "longitude": float(longitude_sums[i] / count),
+                            "site": (
+                                self.__sites[first_indices[i]] if count == 1 else None
+                            ),
+                        }
+                    )
+        return zoom, clusters
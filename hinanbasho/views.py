@@ -1,13 +1,29 @@
+import json
 import os
 
-from flask import Flask, escape, g, render_template, request, url_for
-
-from hinanbasho.db import DB
+from flask import (
+    Flask,
+    Response,
+    escape,
+    g,
+    jsonify,
+    render_template,
+    request,
+    stream_with_context,
+    url_for
+)
+from markupsafe import Markup
+
+from hinanbasho.cache import GenerationCache, site_snapshot_cache
+from hinanbasho.config import Config
+from hinanbasho.db import DB, ConnectionPool
 from hinanbasho.errors import LocationError
 from hinanbasho.models import CurrentLocation
 from hinanbasho.services import EvacuationSiteService
 
 app = Flask(__name__)
+connection_pool = ConnectionPool() if Config.DB_POOL_SIZE > 0 else None
+area_menu_cache = GenerationCache()
 
 
 @app.after_request
@@ -33,6 +49,11 @@ def override_url_for():
     return dict(url_for=dated_url_for)
 
 
+@app.context_processor
+def inject_area_menu():
+    return dict(area_menu=get_area_menu())
+
+
 def dated_url_for(endpoint, **values):
     if endpoint == "static":
         filename = values.get("filename", None)
@@ -43,7 +64,7 @@ def dated_url_for(endpoint, **values):
 
 
 def connect_db():
-    return DB()
+    return DB(pool=connection_pool)
 
 
 def get_db():
@@ -52,11 +73,21 @@ def get_db():
     return g.postgres_db
 
 
+def get_snapshot():
+    return site_snapshot_cache.get(lambda: EvacuationSiteService(get_db()))
+
+
 def get_area_names():
-    if not hasattr(g, "area_names"):
-        service = EvacuationSiteService(get_db())
-        g.area_names = service.get_area_names()
-    return g.area_names
+    return get_snapshot().area_names
+
+
+def render_area_menu(snapshot):
+    template = app.jinja_env.get_template("area_menu.html")
+    return Markup(template.render(area_names=snapshot.area_names))
+
+
+def get_area_menu():
+    return area_menu_cache.get(get_snapshot(), render_area_menu)
 
 
 @app.teardown_appcontext
@@ -86,23 +117,20 @@ def search_by_gps():
             current_location = CurrentLocation(
                 latitude=current_latitude, longitude=current_longitude
             )
+            near_sites = get_snapshot().get_near_sites(current_location)
         except (LocationError, ValueError):
             title = "検索条件に誤りがあります"
             error_message = "緯度経度が正しくありません。"
             return render_template(
                 "error.html",
                 title=title,
-                area_names=get_area_names(),
                 error_message=error_message,
             )
 
-        service = EvacuationSiteService(get_db())
-        near_sites = service.get_near_sites(current_location)
         results_length = len(near_sites)
         return render_template(
             "search_by_gps.html",
             title=title,
-            area_names=get_area_names(),
             search_results=near_sites,
             current_latitude=current_latitude,
             current_longitude=current_longitude,
@@ -110,6 +138,115 @@ def search_by_gps():
         )
 
 
+@app.route("/search_by_gps_many", methods=["POST"])
+def search_by_gps_many():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("locations"), list):
+        return jsonify(error="locationsに緯度経度の組の配列を指定してください。"), 400
+    locations = body["locations"]
+    if len(locations) > Config.BATCH_MAX_LOCATIONS:
+        return jsonify(error="地点の数が多すぎます。"), 400
+    try:
+        k = int(body.get("k", 5))
+    except (TypeError, ValueError):
+        return jsonify(error="kには整数を指定してください。"), 400
+    k = min(max(k, 1), Config.BATCH_MAX_SITES)
+    try:
+        near_sites_many = get_snapshot().get_near_sites_many(locations, k)
+    except LocationError as e:
+        return jsonify(error=e.message), 400
+
+    def generate():
+        # 1地点ごとに1行のJSONを返し、全地点の結果をメモリに溜めない。
+        for i, near_sites in enumerate(near_sites_many):
+            result = {
+                "index": i,
+                "latitude": locations[i][0],
+                "longitude": locations[i][1],
+                "sites": [
+                    {
+                        "order": near_site["order"],
+                        "site_id": near_site["site"].site_id,
+                        "site_name": near_site["site"].site_name,
+                        "distance": near_site["distance"],
+                    }
+                    for near_site in near_sites
+                ],
+            }
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def site_to_json(site):
+    return {
+        "site_id": site.site_id,
+        "site_name": site.site_name,
+        "address": site.address,
+        "latitude": site.latitude,
+        "longitude": site.longitude,
+        "url": url_for("site", site_id=site.site_id),
+    }
+
+
+@app.route("/sites_within_radius")
+def sites_within_radius():
+    try:
+        current_location = CurrentLocation(
+            latitude=request.args.get("latitude"),
+            longitude=request.args.get("longitude"),
+        )
+        radius = float(request.args.get("radius", 1))
+    except (LocationError, ValueError):
+        return jsonify(error="緯度経度または距離が正しくありません。"), 400
+    if radius > Config.RADIUS_SEARCH_MAX_KM:
+        return jsonify(error="距離が大きすぎます。"), 400
+    try:
+        near_sites = get_snapshot().find_within_radius(current_location, radius)
+    except LocationError as e:
+        return jsonify(error=e.message), 400
+    sites = list()
+    for near_site in near_sites:
+        site = site_to_json(near_site["site"])
+        site["order"] = near_site["order"]
+        site["distance"] = near_site["distance"]
+        sites.append(site)
+    return jsonify(radius=radius, sites=sites)
+
+
+@app.route("/sites_in_bbox")
+def sites_in_bbox():
+    bounds = [request.args.get(key) for key in ("south", "west", "north", "east")]
+    try:
+        sites = get_snapshot().find_in_bbox(*bounds)
+    except LocationError as e:
+        return jsonify(error=e.message), 400
+    return jsonify(sites=[site_to_json(site) for site in sites])
+
+
+@app.route("/clusters")
+def clusters():
+    bounds = [request.args.get(key) for key in ("south", "west", "north", "east")]
+    try:
+        zoom, clusters = get_snapshot().get_clusters(
+            *bounds, request.args.get("zoom"), Config.CLUSTER_MAX_CELLS
+        )
+    except LocationError as e:
+        return jsonify(error=e.message), 400
+    results = list()
+    for cluster in clusters:
+        if cluster["site"] is None:
+            result = {
+                "latitude": cluster["latitude"],
+                "longitude": cluster["longitude"],
+            }
+        else:
+            result = site_to_json(cluster["site"])
+        result["count"] = cluster["count"]
+        results.append(result)
+    return jsonify(zoom=zoom, clusters=results)
+
+
 @app.route("/site/<site_id>")
 def site(site_id):
     site_id = escape(site_id)
@@ -121,19 +258,16 @@ def site(site_id):
         return render_template(
             "error.html",
             title=title,
-            area_names=get_area_names(),
             error_message=error_message,
         )
 
-    service = EvacuationSiteService(get_db())
-    result = service.find_by_site_id(site_id)
+    result = get_snapshot().find_by_site_id(site_id)
     if len(result) == 0:
         title = "検索条件に誤りがあります"
         error_message = "そのような避難場所連番はありません。"
         return render_template(
             "error.html",
             title=title,
-            area_names=get_area_names(),
             error_message=error_message,
         )
 
@@ -141,7 +275,6 @@ def site(site_id):
     return render_template(
         "site.html",
         title=title,
-        area_names=get_area_names(),
         result=result[0],
     )
 
@@ -149,8 +282,7 @@ def site(site_id):
 @app.route("/area/<area_name>")
 def area(area_name):
     area_name = escape(area_name)
-    service = EvacuationSiteService(get_db())
-    search_results = service.find_by_area_name(area_name)
+    search_results = get_snapshot().find_by_area_name(area_name)
     results_length = len(search_results)
     if results_length == 0:
         title = "検索条件に誤りがあります"
@@ -158,7 +290,6 @@ def area(area_name):
         return render_template(
             "error.html",
             title=title,
-            area_names=get_area_names(),
             error_message=error_message,
         )
 
@@ -166,7 +297,6 @@ def area(area_name):
     return render_template(
         "area.html",
         title=title,
-        area_names=get_area_names(),
         area_name=area_name,
         search_results=search_results,
         results_length=results_length,
@@ -177,23 +307,51 @@ def area(area_name):
 def search_by_site_name():
     site_name = escape(request.args.get("site_name", None))
     title = "名称に「" + site_name + "」を含むの避難場所の検索結果"
-    service = EvacuationSiteService(get_db())
-    search_results = service.find_by_site_name(site_name)
+    search_results = get_snapshot().find_by_site_name(site_name)
     results_number = len(search_results)
     return render_template(
         "search_by_site_name.html",
         title=title,
-        area_names=get_area_names(),
         site_name=site_name,
         search_results=search_results,
         results_number=results_number,
     )
 
 
+@app.route("/autocomplete")
+def autocomplete():
+    keyword = request.args.get("q", "")
+    try:
+        limit = int(request.args.get("limit", Config.AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        limit = Config.AUTOCOMPLETE_LIMIT
+    limit = min(max(limit, 1), Config.AUTOCOMPLETE_MAX_LIMIT)
+    completions = get_snapshot().complete(keyword, limit)
+    for completion in completions:
+        if completion["type"] == "site":
+            completion["url"] = url_for("site", site_id=completion["site_id"])
+        else:
+            completion["url"] = url_for("area", area_name=completion["name"])
+    return jsonify(query=keyword, completions=completions)
+
+
+@app.route("/metrics")
+def metrics():
+    near_sites_cache = get_snapshot().near_sites_cache
+    return jsonify(
+        snapshot_refresh=site_snapshot_cache.single_flight.get_stats(),
+        near_sites_cache={
+            "size": near_sites_cache.size,
+            "hits": near_sites_cache.hits,
+            "misses": near_sites_cache.misses,
+        },
+    )
+
+
 @app.errorhandler(404)
 def not_found(error):
     title = "404 Page Not Found."
-    return render_template("404.html", title=title, area_names=get_area_names())
+    return render_template("404.html", title=title)
 
 
 if __name__ == "__main__":
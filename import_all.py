@@ -0,0 +1,119 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hinanbasho.config import Config
+from hinanbasho.db import DB
+from hinanbasho.errors import DatabaseError, DataError
+from hinanbasho.models import AreaAddressFactory, EvacuationSiteFactory
+from hinanbasho.pipeline import flatten, iter_models, prefetch, run_timed
+from hinanbasho.scraper import OpenData, PostOfficeCSV
+from hinanbasho.services import (
+    AreaAddressService,
+    DownloadStateService,
+    EvacuationSiteService
+)
+
+
+def import_all(full: bool = False, url: str = None) -> dict:
+    """避難場所データと郵便番号データをまとめて取り込む
+
+    避難場所のCSVをスレッドでダウンロードしている間に郵便番号データを保存する。
+    どちらのCSVもチャンクごとに別のスレッドで読み込んで保存と並行させるので、
+    使用するメモリはチャンクの大きさで決まる。両方のデータを1つの
+    トランザクションで保存してコミットするので、どちらかの保存に失敗した場合は
+    どちらも保存しない。避難場所が変わった場合は最寄りの避難場所の候補の格子も
+    作り直す。
+
+    Args:
+        full (bool): 真なら更新の有無にかかわらず避難場所データをダウンロードし、
+            全件を取り込み直す
+        url (str): 避難場所のCSVのURL。省略した場合は設定値
+
+    Returns:
+        timings (dict): 処理の段階ごとにかかった時間（秒）
+
+    """
+    if url is None:
+        url = Config.OPENDATA_URL
+    timings = dict()
+    start = time.perf_counter()
+
+    db = DB()
+    try:
+        with ThreadPoolExecutor(max_workers=1) as threads:
+            state_service = DownloadStateService(db)
+            etag, last_modified = None, None
+            if not full:
+                etag, last_modified = state_service.get_validators(url)
+            open_data_future = threads.submit(
+                run_timed, OpenData, etag, last_modified, url
+            )
+
+            # 避難場所のCSVをダウンロードしている間に郵便番号データを保存する。
+            area_addresses = flatten(
+                prefetch(
+                    iter_models(PostOfficeCSV().iter_chunks(), AreaAddressFactory())
+                )
+            )
+            area_count, timings["郵便番号の保存"] = run_timed(
+                AreaAddressService(db).create_many, area_addresses
+            )
+            print("郵便番号データを{}件保存しました。".format(area_count))
+
+            open_data, timings["避難場所のダウンロード"] = open_data_future.result()
+
+        service = EvacuationSiteService(db)
+        write_start = time.perf_counter()
+        changed = False
+        swapped = False
+        if open_data.not_modified:
+            print("避難場所データは更新されていません。")
+        else:
+            evacuation_sites = flatten(
+                prefetch(iter_models(open_data.iter_chunks(), EvacuationSiteFactory()))
+            )
+            if full:
+                service.create_staging_table()
+                service.create_many(evacuation_sites, staging=True)
+                service.swap_staging_table()
+                changed = True
+                swapped = True
+            else:
+                count, deleted_count = service.sync(evacuation_sites)
+                print(
+                    "避難場所データを{}件保存し、{}件削除しました。".format(
+                        count, deleted_count
+                    )
+                )
+                changed = count > 0 or deleted_count > 0
+            state_service.save_validators(url, open_data.etag, open_data.last_modified)
+        if not swapped:
+            # 避難場所に持たせている町域名を新しい郵便番号データで引き直す。
+            # 差し替えたテーブルは保存した時に引き直しているので、入れ替えの
+            # 排他ロックを持ったまま全件を更新しないよう飛ばす。
+            service.update_area_names()
+        timings["避難場所の保存"] = time.perf_counter() - write_start
+
+        commit_start = time.perf_counter()
+        db.commit()
+        timings["コミット"] = time.perf_counter() - commit_start
+
+        if changed:
+            # 格子は避難場所のデータが変わると使われなくなるので作り直す。入れ替えの
+            # 排他ロックを持ったまま作らないよう、コミットした後のデータから作る。
+            _, timings["格子の作成"] = run_timed(service.build_nearest_grid)
+    except (DatabaseError, DataError) as e:
+        db.rollback()
+        print(e.message)
+    finally:
+        db.close()
+
+    timings["合計"] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == "__main__":
+    timings = import_all(full="--full" in sys.argv[1:])
+    for stage, seconds in timings.items():
+        print("  {}: {:.3f} 秒".format(stage, seconds))
@@ -1,25 +1,66 @@
+import sys
+
+from hinanbasho.config import Config
 from hinanbasho.db import DB
 from hinanbasho.errors import DatabaseError, DataError
 from hinanbasho.models import EvacuationSiteFactory
+from hinanbasho.pipeline import flatten, iter_models, prefetch
 from hinanbasho.scraper import OpenData
-from hinanbasho.services import EvacuationSiteService
+from hinanbasho.services import DownloadStateService, EvacuationSiteService
+
 
+def import_opendata(full: bool = False, url: str = None):
+    """データベースに旭川市オープンデータの避難場所データを格納
 
-def import_opendata():
-    """データベースに旭川市オープンデータの避難場所データを格納"""
+    前回から更新されていなければダウンロードせず、更新されていれば
+    変わった避難場所だけ保存する。CSVはチャンクごとに別のスレッドで読み込み、
+    データベースへの保存と並行させる。避難場所が変わった場合は最寄りの避難場所の
+    候補の格子も作り直す。
 
-    open_data = OpenData()
-    factory = EvacuationSiteFactory()
-    for row in open_data.lists:
-        factory.create(**row)
+    Args:
+        full (bool): 真なら更新の有無にかかわらずダウンロードし、全件を
+            取り込み直す
+        url (str): CSVのURL。省略した場合は設定値
+
+    """
+    if url is None:
+        url = Config.OPENDATA_URL
 
     db = DB()
     try:
+        state_service = DownloadStateService(db)
+        etag, last_modified = None, None
+        if not full:
+            etag, last_modified = state_service.get_validators(url)
+        open_data = OpenData(etag=etag, last_modified=last_modified, url=url)
+        if open_data.not_modified:
+            print("避難場所データは更新されていません。")
+            return
+        evacuation_sites = flatten(
+            prefetch(iter_models(open_data.iter_chunks(), EvacuationSiteFactory()))
+        )
+
         service = EvacuationSiteService(db)
-        service.truncate()
-        for evacuation_site in factory.items:
-            service.create(evacuation_site)
+        if full:
+            # 差し替え用のテーブルに取り込んでから入れ替え、取り込み中も検索できるようにする。
+            service.create_staging_table()
+            service.create_many(evacuation_sites, staging=True)
+            service.swap_staging_table()
+            changed = True
+        else:
+            count, deleted_count = service.sync(evacuation_sites)
+            print(
+                "避難場所データを{}件保存し、{}件削除しました。".format(
+                    count, deleted_count
+                )
+            )
+            changed = count > 0 or deleted_count > 0
+        state_service.save_validators(url, open_data.etag, open_data.last_modified)
         db.commit()
+        if changed:
+            # 格子は避難場所のデータが変わると使われなくなるので作り直す。入れ替えの
+            # 排他ロックを持ったまま作らないよう、コミットした後のデータから作る。
+            service.build_nearest_grid()
     except (DatabaseError, DataError) as e:
         db.rollback()
         print(e.message)
@@ -28,4 +69,4 @@ def import_opendata():
 
 
 if __name__ == "__main__":
-    import_opendata()
+    import_opendata(full="--full" in sys.argv[1:])
@@ -1,23 +1,29 @@
 from hinanbasho.db import DB
 from hinanbasho.errors import DatabaseError, DataError
 from hinanbasho.models import AreaAddressFactory
+from hinanbasho.pipeline import flatten, iter_models, prefetch
 from hinanbasho.scraper import PostOfficeCSV
-from hinanbasho.services import AreaAddressService
+from hinanbasho.services import AreaAddressService, EvacuationSiteService
 
 
 def import_post_office_csv():
-    """データベースに日本郵便Webサイトの郵便番号CSVデータを格納"""
+    """データベースに日本郵便Webサイトの郵便番号CSVデータを格納
+
+    CSVはチャンクごとに別のスレッドで読み込み、データベースへの保存と並行させる。
+
+    """
 
     post_office_csv = PostOfficeCSV()
-    factory = AreaAddressFactory()
-    for row in post_office_csv.lists:
-        factory.create(**row)
+    area_addresses = flatten(
+        prefetch(iter_models(post_office_csv.iter_chunks(), AreaAddressFactory()))
+    )
 
     db = DB()
     try:
         service = AreaAddressService(db)
-        for area_address in factory.items:
-            service.create(area_address)
+        service.create_many(area_addresses)
+        # 避難場所に持たせている町域名を新しい郵便番号データで引き直す。
+        EvacuationSiteService(db).update_area_names()
         db.commit()
     except (DatabaseError, DataError) as e:
         db.rollback()
@@ -0,0 +1,332 @@
+import threading
+import time
+import unittest
+
+from hinanbasho.cache import (
+    GenerationCache,
+    LRUCache,
+    SingleFlight,
+    SiteSnapshot,
+    SiteSnapshotCache
+)
+from hinanbasho.errors import LocationError
+from hinanbasho.models import CurrentLocation, EvacuationSiteFactory
+
+test_evacuation_site_data = [
+    {
+        "site_id": 1,
+        "site_name": "常磐公園",
+        "postal_code": "070-0044",
+        "address": "北海道旭川市常磐公園",
+        "phone_number": "0166-23-8961",
+        "latitude": 43.7748548,
+        "longitude": 142.3578223,
+    },
+    {
+        "site_id": 2,
+        "site_name": "花咲スポーツ公園",
+        "postal_code": "070-0901",
+        "address": "北海道旭川市花咲町1〜5丁目",
+        "phone_number": "0166-52-1934",
+        "latitude": 43.78850998,
+        "longitude": 142.3681739,
+    },
+    {
+        "site_id": 3,
+        "site_name": "イオンモール旭川西店(3階駐車場及び屋上駐車場)",
+        "postal_code": "070-0823",
+        "address": "北海道旭川市緑町23丁目",
+        "phone_number": "0166-59-7900",
+        "latitude": 43.79368448,
+        "longitude": 142.325844,
+    },
+    {
+        "site_id": 4,
+        "site_name": "東光スポーツ公園",
+        "postal_code": "078-8361",
+        "address": "北海道旭川市東光21～27条7・8丁目・東光22～27条9丁目",
+        "phone_number": "0166-52-1934",
+        "latitude": 43.73178028,
+        "longitude": 142.4120177,
+    },
+    {
+        "site_id": 5,
+        "site_name": "クリスタルパーク",
+        "postal_code": "070-8003",
+        "address": "北海道旭川市神楽3条7・8丁目",
+        "phone_number": "0166-74-8005",
+        "latitude": 43.75891797,
+        "longitude": 142.3520454,
+    },
+    {
+        "site_id": 6,
+        "site_name": "忠和公園",
+        "postal_code": "070-8021",
+        "address": "北海道旭川市神居町忠和",
+        "phone_number": "0166-69-2345",
+        "latitude": 43.78344692,
+        "longitude": 142.3164453,
+    },
+]
+test_site_area_names = {
+    1: "常磐公園",
+    2: "花咲町",
+    3: "緑町",
+    4: "東光２１条",
+    5: "神楽３条",
+    6: None,
+}
+
+
+def create_snapshot(generation=(6, None, 6, None)):
+    factory = EvacuationSiteFactory()
+    for row in test_evacuation_site_data:
+        factory.create(**row)
+    area_names = ["花咲町", "常磐公園", "神楽３条", "東光２１条", "緑町", None]
+    return SiteSnapshot(
+        generation=generation,
+        sites=factory.items,
+        site_area_names=test_site_area_names,
+        area_names=area_names,
+    )
+
+
+class DummyService:
+    def __init__(self, generation):
+        self.generation = generation
+        self.generation_count = 0
+        self.load_count = 0
+
+    def get_generation(self):
+        self.generation_count += 1
+        return self.generation
+
+    def load_snapshot(self, generation):
+        self.load_count += 1
+        return create_snapshot(generation)
+
+
+class TestSiteSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = create_snapshot()
+
+    def test_get_near_sites(self):
+        current_location = CurrentLocation(latitude=43.7708179, longitude=142.3628371)
+        near_sites = self.snapshot.get_near_sites(current_location)
+        self.assertEqual(near_sites[0]["order"], 1)
+        self.assertEqual(near_sites[0]["site"].site_name, "常磐公園")
+        self.assertEqual(near_sites[0]["distance"], 0.6)
+        self.assertEqual(near_sites[-1]["order"], 5)
+        self.assertEqual(near_sites[-1]["site"].site_name, "忠和公園")
+        self.assertEqual(near_sites[-1]["distance"], 4)
+        for latitude, longitude in [
+            (float("nan"), 142.3628371),
+            (43.7708179, float("inf")),
+            (float("-inf"), float("nan")),
+        ]:
+            with self.assertRaises(LocationError):
+                self.snapshot.get_near_sites(CurrentLocation(latitude, longitude))
+
+    def test_get_near_sites_many(self):
+        locations = [[43.7708179, 142.3628371], [43.78850998, 142.3681739]]
+        results = list(self.snapshot.get_near_sites_many(locations, 3))
+        self.assertEqual(len(results), 2)
+        for (latitude, longitude), near_sites in zip(locations, results):
+            current_location = CurrentLocation(latitude, longitude)
+            self.assertEqual(
+                near_sites, self.snapshot.get_near_sites(current_location)[:3]
+            )
+        with self.assertRaises(LocationError):
+            self.snapshot.get_near_sites_many([[43.77, "hoge"]])
+        with self.assertRaises(LocationError):
+            self.snapshot.get_near_sites_many([43.77, 142.36])
+
+    def test_find_within_radius(self):
+        current_location = CurrentLocation(latitude=43.7708179, longitude=142.3628371)
+        near_sites = self.snapshot.find_within_radius(current_location, 2)
+        self.assertEqual(
+            [near_site["site"].site_id for near_site in near_sites], [1, 5]
+        )
+        self.assertEqual(near_sites, self.snapshot.get_near_sites(current_location)[:2])
+        with self.assertRaises(LocationError):
+            self.snapshot.find_within_radius(current_location, -1)
+
+    def test_find_in_bbox(self):
+        results = self.snapshot.find_in_bbox(43.75, 142.33, 43.79, 142.37)
+        self.assertEqual([site.site_id for site in results], [1, 2, 5])
+        with self.assertRaises(LocationError):
+            self.snapshot.find_in_bbox(43.75, None, 43.79, 142.37)
+
+    def test_get_clusters(self):
+        zoom, clusters = self.snapshot.get_clusters(43.7, 142.3, 43.8, 142.42, 0)
+        self.assertEqual(zoom, 0)
+        self.assertEqual([cluster["count"] for cluster in clusters], [6])
+        with self.assertRaises(LocationError):
+            self.snapshot.get_clusters(43.7, 142.3, 43.8, 142.42, "hoge")
+
+    def test_near_sites_cache(self):
+        # 同じセルの地点は候補を使い回し、地点ごとに正確な距離で並べ替える。
+        snapshot = SiteSnapshot(
+            generation=None,
+            sites=self.snapshot.sites,
+            site_area_names=test_site_area_names,
+            area_names=[],
+            near_sites_cache_size=0,
+        )
+        for latitude, longitude in [
+            (43.7708179, 142.3628371),
+            (43.7708, 142.3628),
+            (43.7701, 142.3621),
+            (43.7885, 142.3681),
+        ]:
+            current_location = CurrentLocation(latitude, longitude)
+            self.assertEqual(
+                self.snapshot.get_near_sites(current_location),
+                snapshot.get_near_sites(current_location),
+            )
+        self.assertEqual(self.snapshot.near_sites_cache.hits, 2)
+        self.assertEqual(self.snapshot.near_sites_cache.misses, 2)
+        self.assertEqual(snapshot.near_sites_cache.size, 0)
+
+    def test_find_by_site_id(self):
+        self.assertEqual(self.snapshot.find_by_site_id(3)[0].site_id, 3)
+        self.assertEqual(self.snapshot.find_by_site_id(100), [])
+
+    def test_find_by_area_name(self):
+        area_sites = self.snapshot.find_by_area_name("花咲町")
+        self.assertEqual([site.site_name for site in area_sites], ["花咲スポーツ公園"])
+        self.assertEqual(self.snapshot.find_by_area_name("末広"), [])
+
+    def test_find_by_site_name(self):
+        results = self.snapshot.find_by_site_name("スポーツ")
+        self.assertEqual([site.site_id for site in results], [2, 4])
+        self.assertEqual(self.snapshot.find_by_site_name("小学校"), [])
+        # キーワード中の%と_はワイルドカードとして扱う。
+        results = self.snapshot.find_by_site_name("ス_ーツ%園")
+        self.assertEqual([site.site_id for site in results], [2, 4])
+
+    def test_complete(self):
+        completions = self.snapshot.complete("はなさき")
+        self.assertEqual(completions, [])
+        completions = self.snapshot.complete("花咲")
+        self.assertEqual(
+            completions,
+            [
+                {"type": "site", "name": "花咲スポーツ公園", "site_id": 2},
+                {"type": "area", "name": "花咲町"},
+            ],
+        )
+        self.assertEqual(self.snapshot.complete("くりす")[0]["site_id"], 5)
+
+    def test_find_by_address(self):
+        results = self.snapshot.find_by_address("神居町")
+        self.assertEqual([site.site_id for site in results], [6])
+
+
+class TestSiteSnapshotCache(unittest.TestCase):
+    def test_get(self):
+        cache = SiteSnapshotCache(check_interval=60)
+        service = DummyService((6, None, 6, None))
+        snapshot = cache.get(lambda: service)
+        # 確認の間隔内はデータベースに問い合わせない。
+        self.assertIs(cache.get(lambda: service), snapshot)
+        self.assertEqual(service.generation_count, 1)
+        # 世代が変わらなければスナップショットを作り直さない。
+        self.assertIs(cache.get(lambda: service, check_interval=0), snapshot)
+        self.assertEqual(service.generation_count, 2)
+        self.assertEqual(service.load_count, 1)
+        # 世代が変わったらスナップショットを作り直す。
+        service.generation = (7, None, 6, None)
+        new_snapshot = cache.get(lambda: service, check_interval=0)
+        self.assertIsNot(new_snapshot, snapshot)
+        self.assertEqual(new_snapshot.generation, (7, None, 6, None))
+
+    def test_invalidate(self):
+        cache = SiteSnapshotCache(check_interval=60)
+        service = DummyService((6, None, 6, None))
+        snapshot = cache.get(lambda: service)
+        cache.invalidate()
+        self.assertIsNot(cache.get(lambda: service), snapshot)
+        self.assertEqual(service.load_count, 2)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_do(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        executions = list()
+        results = list()
+
+        def slow_function():
+            executions.append(1)
+            started.set()
+            time.sleep(0.2)
+            return "result"
+
+        def call():
+            results.append(single_flight.do("key", slow_function))
+
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        started.wait()
+        # 実行中に同じキーで呼び出したスレッドは処理を実行せずに結果を共有する。
+        for _ in range(4):
+            threads.append(threading.Thread(target=call))
+            threads[-1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(
+            single_flight.get_stats(), {"calls": 5, "executions": 1, "coalesced": 4}
+        )
+        # 実行が終われば次の呼び出しは改めて実行する。
+        self.assertEqual(single_flight.do("key", slow_function), "result")
+        self.assertEqual(single_flight.executions, 2)
+
+    def test_do_error(self):
+        single_flight = SingleFlight()
+
+        def error_function():
+            raise ValueError("error")
+
+        with self.assertRaises(ValueError):
+            single_flight.do("key", error_function)
+        self.assertEqual(single_flight.do("key", lambda: 1), 1)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get(self):
+        cache = LRUCache(2)
+        self.assertEqual(cache.get("a", lambda: 1), 1)
+        self.assertEqual(cache.get("b", lambda: 2), 2)
+        self.assertEqual(cache.get("a", lambda: 3), 1)
+        # 上限を超えたら最も長く使われていないbを破棄する。
+        self.assertEqual(cache.get("c", lambda: 4), 4)
+        self.assertEqual(cache.get("b", lambda: 5), 5)
+        self.assertEqual(cache.size, 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+        cache.clear()
+        self.assertEqual((cache.size, cache.hits, cache.misses), (0, 0, 0))
+
+
+class TestGenerationCache(unittest.TestCase):
+    def test_get(self):
+        cache = GenerationCache()
+        calls = list()
+
+        def create(snapshot):
+            calls.append(snapshot.generation)
+            return ",".join(snapshot.area_names[:2])
+
+        snapshot = create_snapshot()
+        self.assertEqual(cache.get(snapshot, create), "花咲町,常磐公園")
+        self.assertEqual(cache.get(create_snapshot(), create), "花咲町,常磐公園")
+        self.assertEqual(len(calls), 1)
+        # スナップショットの世代が変わったら作り直す。
+        cache.get(create_snapshot((7, None, 6, None)), create)
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
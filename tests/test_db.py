@@ -0,0 +1,60 @@
+import unittest
+
+from hinanbasho.db import DB, ConnectionPool
+from hinanbasho.errors import DatabaseError
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=2, timeout=0.1, ping_interval=0)
+
+    def tearDown(self):
+        self.pool.closeall()
+
+    def test_getconn(self):
+        conn = self.pool.getconn()
+        self.pool.putconn(conn)
+        # 返却した接続を再利用する。
+        self.assertIs(self.pool.getconn(), conn)
+
+    def test_putconn(self):
+        conn = self.pool.getconn()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+        # 実行中のトランザクションはロールバックして返却する。
+        self.pool.putconn(conn)
+        conn = self.pool.getconn()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_getconn_closed(self):
+        conn = self.pool.getconn()
+        self.pool.putconn(conn)
+        conn.close()
+        # 切れた接続は貸し出さずに新しく接続する。
+        new_conn = self.pool.getconn()
+        self.assertIsNot(new_conn, conn)
+        self.assertFalse(new_conn.closed)
+
+    def test_getconn_timeout(self):
+        self.pool.getconn()
+        self.pool.getconn()
+        with self.assertRaises(DatabaseError):
+            self.pool.getconn()
+
+
+class TestDB(unittest.TestCase):
+    def test_close(self):
+        pool = ConnectionPool(max_size=1, timeout=0.1)
+        db = DB(pool=pool)
+        db.cursor().execute("SELECT 1;")
+        db.close()
+        # 接続はプールに返却されているので、上限が1でも借りられる。
+        db = DB(pool=pool)
+        db.close()
+        pool.closeall()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from test_spatial import create_random_sites
+
+from hinanbasho.cache import SiteSnapshot
+from hinanbasho.grid import (
+    NearestSiteGrid,
+    build_nearest_grid,
+    get_sites_fingerprint,
+    open_nearest_grid
+)
+from hinanbasho.models import CurrentLocation
+from hinanbasho.spatial import SiteIndex
+
+
+class TestNearestSiteGrid(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "nearest_grid.bin")
+        self.sites = create_random_sites(200)
+        build_nearest_grid(
+            self.sites, self.path, cell_meters=500, k=5, padding_meters=1000
+        )
+        self.grid = NearestSiteGrid(self.path)
+
+    def tearDown(self):
+        del self.grid
+        self.directory.cleanup()
+
+    def test_header(self):
+        self.assertEqual(self.grid.fingerprint, get_sites_fingerprint(self.sites))
+        self.assertEqual(self.grid.k, 5)
+        self.assertGreater(self.grid.rows * self.grid.columns, 0)
+
+    def test_get_candidates(self):
+        candidates = self.grid.get_candidates(43.75, 142.35)
+        self.assertGreaterEqual(len(candidates), 5)
+        self.assertLess(len(candidates), 200)
+        self.assertIsNone(self.grid.get_candidates(35.68, 139.76))
+        self.assertIsNone(self.grid.get_candidates(float("nan"), 142.35))
+        self.assertIsNone(self.grid.get_candidates(43.75, float("inf")))
+
+    def test_get_nearest(self):
+        # 格子の候補から探索しても空間インデックスだけで探索した結果と一致する。
+        site_index = SiteIndex(self.sites)
+        grid_site_index = SiteIndex(self.sites, self.grid)
+        random = np.random.RandomState(4)
+        for latitude, longitude in zip(
+            random.uniform(43.5, 44.0, 200), random.uniform(142.0, 142.7, 200)
+        ):
+            current_location = CurrentLocation(latitude, longitude)
+            for k in (1, 5, 8):
+                self.assertEqual(
+                    grid_site_index.get_nearest(current_location, k),
+                    site_index.get_nearest(current_location, k),
+                )
+
+    def test_snapshot_fingerprint(self):
+        snapshot = SiteSnapshot(None, self.sites, dict(), list(), self.grid)
+        self.assertIs(snapshot.site_index.nearest_grid, self.grid)
+        # 格子を作成した時と避難場所のデータが異なれば格子を使わない。
+        snapshot = SiteSnapshot(
+            None, create_random_sites(200, seed=1), dict(), list(), self.grid
+        )
+        self.assertIsNone(snapshot.site_index.nearest_grid)
+
+    def test_snapshot_uses_grid(self):
+        # 候補のキャッシュが有効でも、格子があれば格子の候補から探索する。
+        snapshot = SiteSnapshot(
+            None,
+            self.sites,
+            dict(),
+            list(),
+            self.grid,
+            near_sites_cache_size=100,
+        )
+        snapshot_without_grid = SiteSnapshot(
+            None, self.sites, dict(), list(), near_sites_cache_size=100
+        )
+        current_location = CurrentLocation(43.75, 142.35)
+        with patch.object(
+            self.grid, "get_candidates", wraps=self.grid.get_candidates
+        ) as get_candidates:
+            near_sites = snapshot.get_near_sites(current_location)
+        get_candidates.assert_called_once_with(43.75, 142.35)
+        self.assertEqual(
+            [(site["site"].site_id, site["distance"]) for site in near_sites],
+            [
+                (site["site"].site_id, site["distance"])
+                for site in snapshot_without_grid.get_near_sites(current_location)
+            ],
+        )
+        self.assertEqual(snapshot.near_sites_cache.misses, 0)
+
+    def test_open_nearest_grid(self):
+        self.assertIsNone(open_nearest_grid(self.path + ".missing"))
+        broken_path = os.path.join(self.directory.name, "broken.bin")
+        with open(broken_path, "wb") as f:
+            f.write(b"broken")
+        self.assertIsNone(open_nearest_grid(broken_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
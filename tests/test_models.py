@@ -1,12 +1,17 @@
 import unittest
 
+import numpy as np
+
 from hinanbasho.errors import LocationError
 from hinanbasho.models import (
     AreaAddress,
     AreaAddressFactory,
     CurrentLocation,
     EvacuationSite,
-    EvacuationSiteFactory
+    EvacuationSiteFactory,
+    SiteTable,
+    SiteTableFactory,
+    round_half_up
 )
 
 test_evacuation_site_data = [
@@ -62,6 +67,17 @@ class TestEvacuationSite(unittest.TestCase):
     def test_longitude(self):
         self.assertEqual(self.evacuation_site.longitude, 142.3578223)
 
+    def test_content_hash(self):
+        # 連番が違っても他の値が同じならハッシュ値は同じになる。
+        same_site = EvacuationSite(**dict(test_evacuation_site_data[0], site_id=3))
+        self.assertEqual(same_site.content_hash, self.evacuation_site.content_hash)
+        changed_site = EvacuationSite(
+            **dict(test_evacuation_site_data[0], latitude=43.7748549)
+        )
+        self.assertNotEqual(
+            changed_site.content_hash, self.evacuation_site.content_hash
+        )
+
 
 class TestEvacuationSiteFactory(unittest.TestCase):
     def test_create(self):
@@ -70,6 +86,61 @@ class TestEvacuationSiteFactory(unittest.TestCase):
         evacuation_site = factory.create(test_evacuation_site_data[0])
         self.assertTrue(isinstance(evacuation_site, EvacuationSite))
 
+    def test_create_many(self):
+        factory = EvacuationSiteFactory()
+        factory.create_many(test_evacuation_site_data)
+        factory.create(**test_evacuation_site_data[0])
+        self.assertEqual([site.site_id for site in factory.items], [1, 2, 1])
+        # __slots__を使うので属性の追加や変更はできない。
+        with self.assertRaises(AttributeError):
+            factory.items[0].site_id = 3
+        with self.assertRaises(AttributeError):
+            factory.items[0].note = "メモ"
+
+
+class TestSiteTable(unittest.TestCase):
+    def setUp(self):
+        factory = SiteTableFactory()
+        for row in test_evacuation_site_data:
+            factory.create(**row)
+        self.table = factory.table
+
+    def test_columns(self):
+        self.assertEqual(len(self.table), 2)
+        self.assertEqual(self.table.site_ids.tolist(), [1, 2])
+        self.assertEqual(self.table.latitudes.dtype, np.float64)
+        self.assertEqual(
+            self.table.site_names.tolist(), ["常磐公園", "花咲スポーツ公園"]
+        )
+
+    def test_row(self):
+        # 行のビューはEvacuationSiteと同じ属性で値を返す。
+        site = EvacuationSite(**test_evacuation_site_data[1])
+        row = self.table[-1]
+        for name in test_evacuation_site_data[1]:
+            self.assertEqual(getattr(row, name), getattr(site, name))
+        self.assertIsInstance(row.site_id, int)
+        self.assertIsInstance(row.latitude, float)
+        self.assertEqual(row, self.table[1])
+        self.assertNotEqual(row, self.table[0])
+        with self.assertRaises(IndexError):
+            self.table[2]
+
+    def test_take(self):
+        rows = self.table.take([1, 0])
+        self.assertEqual([row.site_id for row in rows], [2, 1])
+        self.assertEqual([row.site_id for row in self.table], [1, 2])
+
+    def test_from_sites(self):
+        sites = [EvacuationSite(**row) for row in test_evacuation_site_data]
+        table = SiteTable.from_sites(sites)
+        self.assertEqual(table.longitudes.tolist(), [142.3578223, 142.3681739])
+        self.assertIs(SiteTable.from_sites(table), table)
+        with self.assertRaises(LocationError):
+            SiteTableFactory().create(
+                **dict(test_evacuation_site_data[0], latitude="x")
+            )
+
 
 class TestCurrentLocation(unittest.TestCase):
     def setUp(self):
@@ -86,11 +157,26 @@ class TestCurrentLocation(unittest.TestCase):
         result = self.current_location.get_distance_to(self.evacuation_site)
         self.assertEqual(result, 1732.87)
 
+    def test_get_distances_to(self):
+        result = self.current_location.get_distances_to(
+            [row["latitude"] for row in test_evacuation_site_data],
+            [row["longitude"] for row in test_evacuation_site_data],
+        )
+        self.assertEqual(result.tolist(), [1732.87, 0.0])
+
     def test_init(self):
         with self.assertRaises(LocationError):
             CurrentLocation(latitude="hoge", longitude="fuga")
 
 
+class TestRoundHalfUp(unittest.TestCase):
+    def test_round_half_up(self):
+        # 2進数で表すと境界よりわずかに小さくなる値も文字列表現どおりに丸める。
+        result = round_half_up(np.array([1.005, 2.675, 0.125, 1.114, -0.0]), 2)
+        self.assertEqual(result.tolist(), [1.01, 2.68, 0.13, 1.11, 0.0])
+        self.assertEqual(round_half_up([1732.87 / 1000], 1).tolist(), [1.7])
+
+
 class TestAreaAddress(unittest.TestCase):
     def setUp(self):
         self.area_address = AreaAddress(**test_area_address_data[0])
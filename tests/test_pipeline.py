@@ -0,0 +1,81 @@
+import threading
+import time
+import unittest
+
+from hinanbasho.models import AreaAddress, AreaAddressFactory
+from hinanbasho.pipeline import flatten, iter_models, prefetch, run_timed
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_prefetch(self):
+        self.assertEqual(list(prefetch(range(100), buffer_size=3)), list(range(100)))
+        self.assertEqual(list(prefetch([])), [])
+
+    def test_buffer_size(self):
+        produced = list()
+
+        def produce():
+            for i in range(10):
+                produced.append(i)
+                yield i
+
+        items = prefetch(produce(), buffer_size=2)
+        time.sleep(0.2)
+        # 使う側が受け取る前に読み進めるのは、バッファの数と渡しかけの1個まで。
+        self.assertLessEqual(len(produced), 3)
+        self.assertEqual(list(items), list(range(10)))
+
+    def test_error(self):
+        def produce():
+            yield 1
+            raise ValueError("error")
+
+        items = prefetch(produce())
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(ValueError):
+            next(items)
+
+    def test_close(self):
+        stopped = threading.Event()
+
+        def produce():
+            try:
+                for i in range(1000):
+                    yield i
+            finally:
+                stopped.set()
+
+        items = prefetch(produce(), buffer_size=1)
+        self.assertEqual(next(items), 0)
+        # 使う側が途中でやめたら、読み込み側のスレッドも終わる。
+        items.close()
+        self.assertTrue(stopped.wait(1))
+
+
+class TestIterModels(unittest.TestCase):
+    def test_iter_models(self):
+        chunks = [
+            [{"postal_code": "0700044", "area_name": "常磐公園"}],
+            [
+                {"postal_code": "0700901", "area_name": "花咲町"},
+                {"postal_code": "0700823", "area_name": "緑町"},
+            ],
+        ]
+        models = list(iter_models(chunks, AreaAddressFactory()))
+        self.assertEqual([len(items) for items in models], [1, 2])
+        areas = list(flatten(models))
+        self.assertTrue(all(isinstance(area, AreaAddress) for area in areas))
+        self.assertEqual(
+            [area.area_name for area in areas], ["常磐公園", "花咲町", "緑町"]
+        )
+
+
+class TestRunTimed(unittest.TestCase):
+    def test_run_timed(self):
+        result, seconds = run_timed(time.sleep, 0.05)
+        self.assertIsNone(result)
+        self.assertGreaterEqual(seconds, 0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,51 @@
+import os
+import tempfile
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock, patch
 
 from requests import ConnectionError, HTTPError, RequestException, Timeout
 
 from hinanbasho.scraper import OpenData, PostOfficeCSV
 
+test_csv_content = (
+    "施設名,郵便番号,住所,電話番号,ファクス番号,地図の緯度,地図の経度"
+    + "\r\n"
+    + "常磐公園,070-0044,北海道旭川市常磐公園,0166-23-8961,なし,43.7748548,"
+    + "142.3578223"
+    + "\r\n"
+)
+
+
+class OpenDataHandler(BaseHTTPRequestHandler):
+    """ETagとLast-Modifiedで条件付きリクエストに応えるオープンデータの代わり"""
+
+    status = 200
+    etag = '"1"'
+    last_modified = "Mon, 01 Apr 2024 00:00:00 GMT"
+    content = test_csv_content.encode("cp932")
+
+    def do_GET(self):
+        handler = type(self)
+        if handler.status != 200:
+            self.send_response(handler.status)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == handler.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", handler.etag)
+        self.send_header("Last-Modified", handler.last_modified)
+        self.send_header("Content-Length", str(len(handler.content)))
+        self.end_headers()
+        self.wfile.write(handler.content)
+
+    def log_message(self, format, *args):
+        pass
+
 
 class TestOpenData(unittest.TestCase):
     @patch("hinanbasho.scraper.requests")
@@ -55,6 +96,9 @@ class TestOpenData(unittest.TestCase):
         ]
         open_data = OpenData()
         self.assertEqual(open_data.lists, expect)
+        # 指定した行数ずつ読み込んでも、連番はCSVの行数になる。
+        chunks = list(open_data.iter_chunks(chunk_size=2))
+        self.assertEqual(chunks, [expect[:2], expect[2:]])
 
         mock_requests.get.side_effect = Timeout("Dummy Error.")
         with self.assertRaises(RequestException):
@@ -69,6 +113,43 @@ class TestOpenData(unittest.TestCase):
             OpenData()
 
 
+class TestOpenDataConditional(unittest.TestCase):
+    def setUp(self):
+        self.handler = type("Handler", (OpenDataHandler,), {})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/hinanbasho.csv".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_not_modified(self):
+        open_data = OpenData(url=self.url)
+        self.assertFalse(open_data.not_modified)
+        self.assertEqual(open_data.lists[0]["site_name"], "常磐公園")
+        self.assertEqual(open_data.etag, '"1"')
+        self.assertEqual(open_data.last_modified, "Mon, 01 Apr 2024 00:00:00 GMT")
+        # 前回のETagを送り、更新されていなければダウンロードしない。
+        open_data = OpenData(
+            etag=open_data.etag, last_modified=open_data.last_modified, url=self.url
+        )
+        self.assertTrue(open_data.not_modified)
+        self.assertEqual(open_data.lists, [])
+        self.assertEqual(open_data.etag, '"1"')
+        # 更新されていればダウンロードし直す。
+        self.handler.etag = '"2"'
+        open_data = OpenData(etag='"1"', url=self.url)
+        self.assertFalse(open_data.not_modified)
+        self.assertEqual(len(open_data.lists), 1)
+        self.assertEqual(open_data.etag, '"2"')
+
+    def test_error(self):
+        self.handler.status = 500
+        with self.assertRaises(HTTPError):
+            OpenData(url=self.url)
+
+
 class TestPostOfficeCSV(unittest.TestCase):
     def test_lists(self):
         post_office_csv = PostOfficeCSV()
@@ -91,6 +172,52 @@ class TestPostOfficeCSV(unittest.TestCase):
         }
         self.assertEqual(post_office_csv.lists[-1], expect)
 
+    def test_municipality_code(self):
+        # 旭川市の郵便番号だけ取り出す。
+        post_office_csv = PostOfficeCSV(municipality_code="01204")
+        self.assertEqual(len(post_office_csv.lists), 347)
+        expect = {
+            "postal_code": "0700055",
+            "area_name": "５条西",
+        }
+        self.assertIn(expect, post_office_csv.lists)
+        self.assertTrue(
+            all(row["postal_code"][:2] == "07" for row in post_office_csv.lists)
+        )
+
+    def test_split_area_name(self):
+        # 同じ郵便番号が続く行の町域名をつなげる。最終行も同じように扱う。
+        rows = [
+            ("01204", "0700001", "Ａ（１"),
+            ("01204", "0700001", "～３丁目）"),
+            ("01204", "0700002", "Ｂ"),
+            ("01204", "0700001", "Ｃ"),
+            ("01204", "0700003", "Ｄ（１"),
+            ("01204", "0700003", "、２丁目）"),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test.csv")
+            with open(path, "w", encoding="cp932") as f:
+                for code, postal_code, area_name in rows:
+                    f.write(
+                        '{},"070",{},ｶﾅ,ｶﾅ,ｶﾅ,北海道,旭川市,{},0,0,0,0,0,0\r\n'.format(
+                            code, postal_code, area_name
+                        )
+                    )
+            post_office_csv = PostOfficeCSV(path, municipality_code="")
+            lists = post_office_csv.lists
+            # チャンクの境目で分かれた町域もつなげる。
+            for chunk_size in range(1, len(rows) + 1):
+                chunks = list(post_office_csv.iter_chunks(chunk_size))
+                self.assertEqual([row for chunk in chunks for row in chunk], lists)
+        expect = [
+            {"postal_code": "0700001", "area_name": "Ａ（１～３丁目）"},
+            {"postal_code": "0700002", "area_name": "Ｂ"},
+            {"postal_code": "0700001", "area_name": "Ｃ"},
+            {"postal_code": "0700003", "area_name": "Ｄ（１、２丁目）"},
+        ]
+        self.assertEqual(lists, expect)
+
 
 if __name__ == "__main__":
     unittest.main()
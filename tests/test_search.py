@@ -0,0 +1,92 @@
+import unittest
+
+from hinanbasho.search import (
+    LikePattern,
+    NgramIndex,
+    PrefixIndex,
+    normalize_reading
+)
+
+test_texts = [
+    "常磐公園",
+    "花咲スポーツ公園",
+    "イオンモール旭川西店(3階駐車場及び屋上駐車場)",
+    "東光スポーツ公園",
+    "クリスタルパーク",
+    "忠和公園",
+    "旭川市立旭川第一小学校",
+    "100%_会館",
+]
+
+
+class TestLikePattern(unittest.TestCase):
+    def test_literals(self):
+        self.assertEqual(LikePattern("%公園%").literals, ["公園"])
+        self.assertEqual(LikePattern("%スポ_ツ%公%").literals, ["スポ", "ツ", "公"])
+        self.assertEqual(LikePattern("%100\\%\\_%").literals, ["100%_"])
+
+    def test_match(self):
+        self.assertTrue(LikePattern("%公園%").match("常磐公園"))
+        self.assertTrue(LikePattern("%公_%").match("常磐公園"))
+        self.assertFalse(LikePattern("%公\\_%").match("常磐公園"))
+        self.assertTrue(LikePattern("%(3階%").match("西店(3階駐車場)"))
+        self.assertTrue(LikePattern("%\\%\\_%").match("100%_会館"))
+
+
+class TestNgramIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = NgramIndex(test_texts)
+
+    def test_find(self):
+        self.assertEqual(self.index.find("公園"), [0, 1, 3, 5])
+        self.assertEqual(self.index.find("旭川"), [2, 6])
+        self.assertEqual(self.index.find("園"), [0, 1, 3, 5])
+        self.assertEqual(self.index.find("公園公園"), [])
+        self.assertEqual(self.index.find(""), list(range(len(test_texts))))
+
+    def test_find_like(self):
+        # %は任意の文字列、_は任意の1文字とし、バックスラッシュの次の文字はそのまま扱う。
+        for pattern, expect in [
+            ("%公園%", [0, 1, 3, 5]),
+            ("%公_%", [0, 1, 3, 5]),
+            ("%公園_%", []),
+            ("%スポ_ツ%", [1, 3]),
+            ("%スポ%公園", [1, 3]),
+            ("常磐%", [0]),
+            ("%公園", [0, 1, 3, 5]),
+            ("公園", []),
+            ("忠和公園", [5]),
+            ("____", [0, 5]),
+            ("%旭川%第一%", [6]),
+            ("%旭川_第一%", []),
+            ("%(3階%", [2]),
+            ("%\\%\\_%", [7]),
+            ("%\\_%", [7]),
+            ("%_会館", [7]),
+            ("%", list(range(len(test_texts)))),
+            ("", []),
+        ]:
+            self.assertEqual(self.index.find_like(pattern), expect, pattern)
+            self.assertEqual(self.index.find_like(LikePattern(pattern)), expect)
+
+
+class TestPrefixIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = PrefixIndex([(text, i) for i, text in enumerate(test_texts)])
+
+    def test_normalize_reading(self):
+        self.assertEqual(normalize_reading("すぽーつ"), "スポーツ")
+        self.assertEqual(normalize_reading("東光２１条"), "東光21条")
+        self.assertEqual(normalize_reading("ﾄｳｺｳ"), "トウコウ")
+
+    def test_complete(self):
+        self.assertEqual(self.index.complete("旭川"), [6])
+        self.assertEqual(self.index.complete("くりす"), [4])
+        self.assertEqual(self.index.complete("公園"), [])
+        self.assertEqual(self.index.complete(""), [])
+        index = PrefixIndex([("花咲町", 1), ("花咲スポーツ公園", 2), ("花園", 3)])
+        self.assertEqual(index.complete("花", 2), [2, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
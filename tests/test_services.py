@@ -1,13 +1,24 @@
+import os
+import tempfile
 import unittest
 
-from hinanbasho.db import DB
+from hinanbasho.cache import site_snapshot_cache
+from hinanbasho.config import Config
+from hinanbasho.db import DB, ConnectionPool
+from hinanbasho.errors import DataError
+from hinanbasho.grid import NearestSiteGrid, get_sites_fingerprint
 from hinanbasho.models import (
+    AreaAddress,
     AreaAddressFactory,
     CurrentLocation,
     EvacuationSite,
     EvacuationSiteFactory
 )
-from hinanbasho.services import AreaAddressService, EvacuationSiteService
+from hinanbasho.services import (
+    AreaAddressService,
+    DownloadStateService,
+    EvacuationSiteService
+)
 
 test_evacuation_site_data = [
     {
@@ -114,11 +125,56 @@ class TestEvacuationSiteService(unittest.TestCase):
         for item in self.factory.items:
             self.assertTrue(self.service.create(item))
         self.db.commit()
+        # 町域名も郵便番号から引いて保存する。
+        self.assertEqual(self.service.get_site_area_names()[2], "花咲町")
+
+    def test_update_area_names(self):
+        self.service.execute(
+            "UPDATE evacuation_sites SET area_name='末広' WHERE site_id=2;"
+        )
+        self.assertEqual(self.service.find_by_area_name("末広")[0].site_id, 2)
+        self.service.update_area_names()
+        self.db.commit()
+        self.assertEqual(self.service.find_by_area_name("末広"), [])
+        self.assertEqual(self.service.get_site_area_names()[2], "花咲町")
+
+    def test_create_many(self):
+        self.service.truncate()
+        invalid_site = EvacuationSite(
+            **dict(test_evacuation_site_data[0], site_id=7, phone_number="0" * 17)
+        )
+        items = self.factory.items + [invalid_site]
+        # 保存できないデータがあっても他のデータは保存する。
+        self.assertEqual(self.service.create_many(items, chunk_size=4), 6)
+        self.db.commit()
+        self.assertEqual(
+            [item.site_id for item in self.service.get_all()], [1, 2, 3, 4, 5, 6]
+        )
 
     def test_get_all(self):
         for item in self.service.get_all():
             self.assertTrue(isinstance(item, EvacuationSite))
 
+    def test_iter_all(self):
+        # サーバー側のcursorで少しずつ読み込んでも全件を同じ順に返す。
+        sites = self.service.iter_all(itersize=2)
+        self.assertFalse(isinstance(sites, list))
+        self.assertEqual(
+            [(site.site_id, site.site_name) for site in sites],
+            [(site.site_id, site.site_name) for site in self.service.get_all()],
+        )
+
+    def test_get_site_table(self):
+        # タプルのcursorから作った表と避難場所オブジェクトの値は一致する。
+        table = self.service.get_site_table()
+        sites = self.service.get_all()
+        self.assertEqual(len(table), len(sites))
+        for row, site in zip(table, sites):
+            self.assertEqual(
+                (row.site_id, row.site_name, row.latitude, row.longitude),
+                (site.site_id, site.site_name, site.latitude, site.longitude),
+            )
+
     def test_get_near_sites(self):
         near_sites = self.service.get_near_sites(self.current_location)
         # 一番近い避難場所
@@ -146,10 +202,181 @@ class TestEvacuationSiteService(unittest.TestCase):
         area_sites = self.service.find_by_area_name("花咲町")
         self.assertEqual(area_sites[0].site_name, "花咲スポーツ公園")
 
+    def test_iter_by_area_name(self):
+        area_sites = list(self.service.iter_by_area_name("花咲町", itersize=1))
+        self.assertEqual([site.site_name for site in area_sites], ["花咲スポーツ公園"])
+        self.assertEqual(list(self.service.iter_by_area_name("末広")), [])
+
     def test_find_by_site_name(self):
         results = self.service.find_by_site_name("花咲")
         self.assertEqual(results[0].site_name, "花咲スポーツ公園")
 
+    def test_execute_prepared(self):
+        # プールに返却した接続を借り直しても、PREPAREした文を使い回す。
+        pool = ConnectionPool(max_size=1, timeout=0.1)
+        try:
+            db = DB(pool=pool)
+            sites = EvacuationSiteService(db).find_by_site_name("スポーツ")
+            self.assertIn("evacuation_sites_find_by_site_name", db.prepared_statements)
+            db.close()
+            db = DB(pool=pool)
+            service = EvacuationSiteService(db)
+            service.cursor.execute(
+                "SELECT count(*) FROM pg_prepared_statements WHERE name=%s;",
+                ("evacuation_sites_find_by_site_name",),
+            )
+            self.assertEqual(service.cursor.fetchone()[0], 1)
+            self.assertEqual(
+                [site.site_id for site in service.find_by_site_name("スポーツ")],
+                [site.site_id for site in sites],
+            )
+            db.close()
+        finally:
+            pool.closeall()
+
+    def test_execute_prepared_snapshot(self):
+        # ワーカーが繰り返す世代の確認とスナップショットの読み込みもPREPAREする。
+        db = DB()
+        try:
+            service = EvacuationSiteService(db)
+            snapshot = service.load_snapshot()
+            self.assertLessEqual(
+                {
+                    "evacuation_sites_get_generation",
+                    "evacuation_sites_get_site_table",
+                    "evacuation_sites_get_site_area_names",
+                    "evacuation_sites_get_area_names",
+                },
+                db.prepared_statements,
+            )
+            self.assertEqual(service.get_generation(), snapshot.generation)
+            self.assertEqual(len(snapshot.sites), len(service.get_all()))
+        finally:
+            db.close()
+
+    def test_execute_prepared_disabled(self):
+        db = DB()
+        default = Config.DB_PREPARE_STATEMENTS
+        Config.DB_PREPARE_STATEMENTS = False
+        try:
+            area_sites = EvacuationSiteService(db).find_by_area_name("花咲町")
+            self.assertEqual(
+                [site.site_name for site in area_sites], ["花咲スポーツ公園"]
+            )
+            self.assertEqual(db.prepared_statements, set())
+        finally:
+            Config.DB_PREPARE_STATEMENTS = default
+            db.close()
+
+    def test_swap_staging_table(self):
+        self.service.create_staging_table()
+        self.assertEqual(self.service.create_many(self.factory.items, staging=True), 6)
+        self.service.execute("SET LOCAL lock_timeout='5s';")
+        self.service.swap_staging_table(lock_timeout="100ms")
+        # 入れ替えの後の処理は元のロックの待ち時間で実行する。
+        self.service.execute("SHOW lock_timeout;")
+        lock_timeout = self.service.fetchall()[0]["lock_timeout"]
+        self.db.commit()
+        self.assertEqual(lock_timeout, "5s")
+        self.assertEqual(
+            [item.site_id for item in self.service.get_all()], [1, 2, 3, 4, 5, 6]
+        )
+        # 差し替えた後のテーブルにも連番が振られ、1件ずつの登録もできる。
+        self.assertTrue(self.service.create(self.factory.items[0]))
+        self.db.commit()
+
+    def test_sync(self):
+        self.service.truncate()
+        self.assertEqual(self.service.sync(self.factory.items), (6, 0))
+        # 変わっていなければ何も保存しない。
+        self.assertEqual(self.service.sync(self.factory.items), (0, 0))
+        # 値の変わった避難場所だけ保存し、なくなった避難場所は削除する。
+        changed_site = EvacuationSite(
+            **dict(test_evacuation_site_data[1], phone_number="0166-00-0000")
+        )
+        items = [changed_site] + [
+            item for item in self.factory.items if item.site_id not in (2, 6)
+        ]
+        self.assertEqual(self.service.sync(items), (1, 1))
+        self.assertEqual(
+            [item.site_id for item in self.service.get_all()], [1, 2, 3, 4, 5]
+        )
+        self.assertEqual(
+            self.service.find_by_site_id(2)[0].phone_number, "0166-00-0000"
+        )
+        self.assertEqual(self.service.sync(self.factory.items), (2, 0))
+        self.db.commit()
+
+    def test_swap_staging_table_locked(self):
+        # 他の接続が避難場所テーブルを参照している間は入れ替えない。
+        reader = DB()
+        EvacuationSiteService(reader).get_all()
+        try:
+            self.service.create_staging_table()
+            self.service.create_many(self.factory.items[:1], staging=True)
+            with self.assertRaises(DataError):
+                self.service.swap_staging_table(lock_timeout="100ms", retries=0)
+            self.db.rollback()
+        finally:
+            reader.close()
+        self.assertEqual(len(self.service.get_all()), 6)
+
+    def test_build_nearest_grid(self):
+        default = Config.NEAREST_GRID_PATH
+        with tempfile.TemporaryDirectory() as directory:
+            Config.NEAREST_GRID_PATH = os.path.join(directory, "nearest_grid.bin")
+            try:
+                self.assertTrue(self.service.build_nearest_grid())
+                grid = NearestSiteGrid(Config.NEAREST_GRID_PATH)
+                self.assertEqual(
+                    grid.fingerprint, get_sites_fingerprint(self.service.get_all())
+                )
+                del grid
+                Config.NEAREST_GRID_PATH = ""
+                self.assertFalse(self.service.build_nearest_grid())
+            finally:
+                Config.NEAREST_GRID_PATH = default
+
+    def test_get_snapshot(self):
+        site_snapshot_cache.invalidate()
+        snapshot = self.service.get_snapshot()
+        self.assertEqual(snapshot.generation, self.service.get_generation())
+        self.assertEqual(
+            [site.site_id for site in snapshot.find_by_area_name("花咲町")],
+            [site.site_id for site in self.service.find_by_area_name("花咲町")],
+        )
+        self.assertEqual(
+            [site.site_id for site in snapshot.find_by_site_name("公園")],
+            [site.site_id for site in self.service.find_by_site_name("公園")],
+        )
+        # 確認の間隔内はデータの世代を問い合わせずに同じスナップショットを返す。
+        executions = site_snapshot_cache.single_flight.executions
+        self.assertIs(self.service.get_snapshot(), snapshot)
+        self.assertEqual(site_snapshot_cache.single_flight.executions, executions)
+
+
+class TestDownloadStateService(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        self.db = DB()
+        self.service = DownloadStateService(self.db)
+
+    @classmethod
+    def tearDownClass(self):
+        self.db.rollback()
+        self.db.close()
+
+    def test_save_validators(self):
+        url = "http://127.0.0.1/hinanbasho.csv"
+        self.service.execute("DELETE FROM download_states WHERE url=%s;", (url,))
+        self.assertEqual(self.service.get_validators(url), (None, None))
+        self.service.save_validators(url, '"1"', "Mon, 01 Apr 2024 00:00:00 GMT")
+        self.assertEqual(
+            self.service.get_validators(url), ('"1"', "Mon, 01 Apr 2024 00:00:00 GMT")
+        )
+        self.service.save_validators(url, '"2"', None)
+        self.assertEqual(self.service.get_validators(url), ('"2"', None))
+
 
 class TestAreaAddressService(unittest.TestCase):
     @classmethod
@@ -170,6 +397,14 @@ class TestAreaAddressService(unittest.TestCase):
             self.assertTrue(self.service.create(item))
         self.db.commit()
 
+    def test_create_many(self):
+        self.service.truncate()
+        # 同じ郵便番号のデータは後のデータで上書きする。
+        duplicate = AreaAddress(postal_code="0700044", area_name="常磐公園")
+        items = [duplicate] + self.factory.items
+        self.assertEqual(self.service.create_many(items, chunk_size=3), 7)
+        self.db.commit()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,219 @@
+import unittest
+
+import numpy as np
+
+from hinanbasho.models import CurrentLocation, EvacuationSite
+from hinanbasho.spatial import (
+    ClusterIndex,
+    KDTree,
+    SiteIndex,
+    get_top_k,
+    to_unit_vectors
+)
+
+
+def create_random_sites(size, seed=0):
+    random = np.random.RandomState(seed)
+    latitudes = random.uniform(43.6, 43.9, size)
+    longitudes = random.uniform(142.1, 142.6, size)
+    sites = list()
+    for i in range(size):
+        sites.append(
+            EvacuationSite(
+                site_id=i + 1,
+                site_name="避難場所" + str(i + 1),
+                postal_code="070-0044",
+                address="北海道旭川市",
+                phone_number="なし",
+                latitude=latitudes[i],
+                longitude=longitudes[i],
+            )
+        )
+    return sites
+
+
+class TestGetTopK(unittest.TestCase):
+    def test_get_top_k(self):
+        values = np.array([3.0, 1.0, 2.0, 1.0, 2.0, 5.0])
+        self.assertEqual(get_top_k(values, 3).tolist(), [1, 3, 2])
+        self.assertEqual(get_top_k(values, 10).tolist(), [1, 3, 2, 4, 0, 5])
+        self.assertEqual(get_top_k(values, 0).tolist(), [])
+
+
+class TestKDTree(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(1)
+        self.points = random.uniform(-1, 1, (500, 3))
+        self.tree = KDTree(self.points, leaf_size=8)
+
+    def test_query(self):
+        point = np.array([0.1, -0.2, 0.3])
+        distances, indices = self.tree.query(point, 7)
+        expect = np.sqrt(np.square(self.points - point).sum(axis=1))
+        self.assertEqual(indices.tolist(), np.argsort(expect)[:7].tolist())
+        np.testing.assert_allclose(distances, np.sort(expect)[:7])
+
+    def test_query_radius(self):
+        point = np.array([0.5, 0.5, -0.5])
+        _, indices = self.tree.query_radius(point, 0.4)
+        expect = np.sqrt(np.square(self.points - point).sum(axis=1))
+        self.assertEqual(
+            sorted(indices.tolist()), np.flatnonzero(expect <= 0.4).tolist()
+        )
+
+    def test_query_box(self):
+        indices = self.tree.query_box([-0.5, 0.0, -1.0], [0.5, 0.8, 0.2])
+        inside = (self.points >= [-0.5, 0.0, -1.0]) & (self.points <= [0.5, 0.8, 0.2])
+        self.assertEqual(
+            sorted(indices.tolist()), np.flatnonzero(inside.all(axis=1)).tolist()
+        )
+
+    def test_empty(self):
+        tree = KDTree(np.empty((0, 3)))
+        distances, indices = tree.query([0, 0, 0], 5)
+        self.assertEqual(len(indices), 0)
+
+
+class TestSiteIndex(unittest.TestCase):
+    def setUp(self):
+        self.sites = create_random_sites(300)
+        self.site_index = SiteIndex(self.sites)
+
+    def test_to_unit_vectors(self):
+        vectors = to_unit_vectors([43.77, -10.0], [142.36, 200.0])
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), [1.0, 1.0])
+
+    def test_get_nearest(self):
+        random = np.random.RandomState(2)
+        for latitude, longitude in zip(
+            random.uniform(43.5, 44.0, 50), random.uniform(142.0, 142.7, 50)
+        ):
+            current_location = CurrentLocation(latitude, longitude)
+            # 全件の距離を計算して並べ替えた結果と一致するか確認する。
+            expect = sorted(
+                [(site, current_location.get_distance_to(site)) for site in self.sites],
+                key=lambda x: x[1],
+            )[:5]
+            self.assertEqual(self.site_index.get_nearest(current_location, 5), expect)
+
+    def test_get_nearest_many(self):
+        random = np.random.RandomState(3)
+        latitudes = random.uniform(43.5, 44.0, 100)
+        longitudes = random.uniform(142.0, 142.7, 100)
+        expect = [
+            self.site_index.get_nearest(CurrentLocation(latitude, longitude), 5)
+            for latitude, longitude in zip(latitudes, longitudes)
+        ]
+        # 全件との距離の行列で探索してもKD木で探索しても同じ結果になる。
+        self.assertEqual(
+            list(self.site_index.get_nearest_many(latitudes, longitudes, 5)), expect
+        )
+        self.site_index.DENSE_SEARCH_MAX_SITES = 0
+        self.assertEqual(
+            list(self.site_index.get_nearest_many(latitudes, longitudes, 5)), expect
+        )
+
+    def test_get_cell_candidates(self):
+        candidates = self.site_index.get_cell_candidates(43.75, 142.35, 43.76, 142.36)
+        self.assertLess(len(candidates), len(self.sites))
+        random = np.random.RandomState(5)
+        for latitude, longitude in zip(
+            random.uniform(43.75, 43.76, 50), random.uniform(142.35, 142.36, 50)
+        ):
+            current_location = CurrentLocation(latitude, longitude)
+            self.assertEqual(
+                self.site_index.get_nearest_from(current_location, candidates, 5),
+                self.site_index.get_nearest(current_location, 5),
+            )
+
+    def test_get_within_radius(self):
+        current_location = CurrentLocation(43.77, 142.36)
+        expect = sorted(
+            [(site, current_location.get_distance_to(site)) for site in self.sites],
+            key=lambda x: x[1],
+        )
+        expect = [item for item in expect if item[1] <= 3000]
+        self.assertEqual(
+            self.site_index.get_within_radius(current_location, 3000), expect
+        )
+        self.assertEqual(self.site_index.get_within_radius(current_location, 0), [])
+
+    def test_get_in_bbox(self):
+        expect = [
+            site
+            for site in self.sites
+            if 43.7 <= site.latitude <= 43.8 and 142.2 <= site.longitude <= 142.4
+        ]
+        self.assertEqual(self.site_index.get_in_bbox(43.7, 142.2, 43.8, 142.4), expect)
+        self.assertEqual(self.site_index.get_in_bbox(43.8, 142.2, 43.7, 142.4), [])
+        # 西端の経度が東端より大きければ経度180度をまたぐ範囲として扱う。
+        expect = [site for site in self.sites if site.longitude >= 142.5]
+        self.assertEqual(self.site_index.get_in_bbox(-90, 142.5, 90, -170), expect)
+
+    def test_get_nearest_same_location(self):
+        # 同じ座標の避難場所は避難場所連番順に並ぶ。
+        sites = create_random_sites(3)
+        sites.append(
+            EvacuationSite(
+                site_id=4,
+                site_name="避難場所4",
+                postal_code="070-0044",
+                address="北海道旭川市",
+                phone_number="なし",
+                latitude=sites[0].latitude,
+                longitude=sites[0].longitude,
+            )
+        )
+        site_index = SiteIndex(sites)
+        current_location = CurrentLocation(sites[0].latitude, sites[0].longitude)
+        nearest = site_index.get_nearest(current_location, 2)
+        self.assertEqual([site.site_id for site, _ in nearest], [1, 4])
+
+
+class TestClusterIndex(unittest.TestCase):
+    def setUp(self):
+        self.sites = create_random_sites(1000)
+        self.cluster_index = ClusterIndex(self.sites, max_zoom=16)
+
+    def test_get_clusters(self):
+        for zoom in (0, 8, 12, 16):
+            _, clusters = self.cluster_index.get_clusters(-85, -180, 85, 180, zoom)
+            # どのズームレベルでも全ての避難場所がいずれかのまとまりに含まれる。
+            self.assertEqual(sum(cluster["count"] for cluster in clusters), 1000)
+        _, clusters = self.cluster_index.get_clusters(-85, -180, 85, 180, 0)
+        self.assertEqual(len(clusters), 1)
+        self.assertAlmostEqual(
+            clusters[0]["latitude"], np.mean([site.latitude for site in self.sites])
+        )
+        _, clusters = self.cluster_index.get_clusters(-85, -180, 85, 180, 16)
+        # 1件だけのまとまりは避難場所そのものの座標になる。
+        for cluster in clusters:
+            if cluster["count"] == 1:
+                self.assertAlmostEqual(cluster["site"].latitude, cluster["latitude"])
+            else:
+                self.assertIsNone(cluster["site"])
+
+    def test_get_clusters_bbox(self):
+        _, clusters = self.cluster_index.get_clusters(43.7, 142.2, 43.8, 142.4, 16)
+        count = sum(cluster["count"] for cluster in clusters)
+        inside = [
+            site
+            for site in self.sites
+            if 43.7 <= site.latitude <= 43.8 and 142.2 <= site.longitude <= 142.4
+        ]
+        # 表示範囲と重なるセルの避難場所は全て含まれる。
+        self.assertGreaterEqual(count, len(inside))
+        self.assertLess(count, 1000)
+        self.assertEqual(self.cluster_index.get_clusters(44, 142, 43, 143, 10)[1], [])
+
+    def test_get_clusters_max_cells(self):
+        zoom, clusters = self.cluster_index.get_clusters(
+            43.6, 142.1, 43.9, 142.6, 16, max_cells=100
+        )
+        self.assertLess(zoom, 16)
+        self.assertLessEqual(len(clusters), 100)
+        self.assertEqual(sum(cluster["count"] for cluster in clusters), 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()